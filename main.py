@@ -3,7 +3,7 @@ import logging
 import time
 import os
 from aiohttp import web
-from telegram.ext import Application, CommandHandler, MessageHandler, filters, ChatMemberHandler
+from telegram.ext import Application, AIORateLimiter, CommandHandler, MessageHandler, filters, ChatMemberHandler
 from telegram.error import NetworkError
 
 from modules.config import Config
@@ -118,6 +118,9 @@ async def post_init(application):
         asyncio.create_task(photo_handler._cleanup_completed_tasks())
     if doc_handler:
         asyncio.create_task(doc_handler._cleanup_completed_tasks())
+    
+    from modules.location_features.location_handler import get_location_handler
+    asyncio.create_task(get_location_handler()._gc_loop())
 
 # ─── 🚫 Bot Blocking Detection ─────────────────────────────────────────────────
 async def on_my_chat_member(update, context):
@@ -188,14 +191,27 @@ async def reply_handler(u, c): asyncio.create_task(command_handlers.reply_comman
 async def error_handler(update, context):
     logger.error(f"Exception while handling update: {context.error}", exc_info=context.error)
 
+# ─── 🚦 Rate Limiting ─────────────────────────────────────────────────
+def build_rate_limiter():
+    """Telegram flood-control limiter (queues and retries 429s), or None without the rate-limiter extra"""
+    try:
+        return AIORateLimiter(max_retries=3)
+    except RuntimeError as e:
+        logger.warning(f"AIORateLimiter unavailable, sending without rate limiting: {e}")
+        return None
+
 # ─── 🚀 Main Entry Point ─────────────────────────────────────────────────
 async def main_async():
     """Async main function to run both Bot and Web Server"""
     
     # 1. Setup Telegram Bot
     try:
+        builder = Application.builder()
+        rate_limiter = build_rate_limiter()
+        if rate_limiter:
+            builder = builder.rate_limiter(rate_limiter)
         app = (
-            Application.builder()
+            builder
             .token(str(Config.TELEGRAM_TOKEN))
             .read_timeout(Config.NETWORK_TIMEOUT)
             .write_timeout(Config.NETWORK_TIMEOUT)
@@ -274,6 +290,12 @@ async def main_async():
     await app.updater.stop()
     await app.stop()
     await app.shutdown()
+    from modules.retry_utils import close_session
+    await close_session()
+    from modules.location_features.location_handler import get_location_handler
+    await get_location_handler().nearby_handler.close()
+    await get_location_handler().prayer_handler.close()
+    await get_location_handler().close()
     await runner.cleanup()
 
 def main():
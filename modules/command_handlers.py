@@ -527,7 +527,7 @@ class CommandHandlers:
         
         if query.data and query.data.startswith("admin_stats_page_"):
             try:
-                page = int(query.data.split("_")[-1])
+                page = int(query.data.rsplit("_", 1)[-1])
                 # Store page in context
                 if context.user_data is None:
                     context.user_data = {}
@@ -541,7 +541,7 @@ class CommandHandlers:
                 await query.answer("❌ Invalid page", show_alert=True)
         elif query.data and query.data.startswith("admin_stats_blocked_page_"):
             try:
-                blocked_page = int(query.data.split("_")[-1])
+                blocked_page = int(query.data.rsplit("_", 1)[-1])
                 # Store blocked page in context
                 if context.user_data is None:
                     context.user_data = {}
@@ -23,6 +23,11 @@ class Config:
     MAX_USERS_IN_MEMORY = 2000
     MAX_INACTIVE_DAYS = 15  # Back to 15 days for proper cleanup
     
+    # Location Features
+    LOCATION_DB_PATH = os.getenv("LOCATION_DB_PATH", "location.db")
+    GEOCODE_BACKEND = os.getenv("GEOCODE_BACKEND", "nominatim")  # "nominatim" or "places"
+    GEOCODE_S2_LEVEL = int(os.getenv("GEOCODE_S2_LEVEL", "18"))  # S2 level of reverse-geocode cache cells
+    
     # File Processing
     MAX_FILE_SIZE = 20 * 1024 * 1024  # 20MB limit
     
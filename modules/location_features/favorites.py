@@ -1,32 +1,104 @@
 import logging
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
 from datetime import datetime
+from typing import Optional
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, KeyboardButton, ReplyKeyboardMarkup, Location
 from telegram.ext import ContextTypes
 from telegram.constants import ParseMode
 from modules.utils import safe_reply
-from modules.location_features.utils import calculate_distance
+from modules.location_features.utils import distance_from_location, SEPARATOR
+from .store import expiry_epoch
 
 logger = logging.getLogger(__name__)
 
+# Hot-path aliases bound once at import time
+_HTML = ParseMode.HTML
+_IKB = InlineKeyboardButton
+_IKM = InlineKeyboardMarkup
+_fromiso = datetime.fromisoformat
+
+# Compact callback_data prefixes for per-item favorites buttons (followed by a number).
+# Short tokens keep inline keyboard payloads small on large favorites pages.
+CB = {
+    'view': 'fv',
+    'map': 'fm',
+    'dir': 'fd',
+    'delC': 'fx',
+    'delF': 'fX',
+    'page': 'fp',
+    'delP': 'fy',
+}
+CB_ACTIONS = {token: action for action, token in CB.items()}
+
+
+@dataclass(slots=True)
+class Favorite:
+    """A saved favorite place"""
+    name: str
+    latitude: float
+    longitude: float
+    created_at: str
+    id: str = ""
+    category: str = "Umumiy"
+    notes: str = ""
+    _dt: Optional[datetime] = field(default=None, repr=False, compare=False)
+    
+    @property
+    def created_dt(self) -> datetime:
+        """Parsed created_at, computed once per favorite"""
+        if self._dt is None:
+            self._dt = _fromiso(self.created_at)
+        return self._dt
+    
+    def to_json(self) -> dict:
+        """Serialize to a plain dict for persistence"""
+        return {
+            "id": self.id,
+            "name": self.name,
+            "latitude": self.latitude,
+            "longitude": self.longitude,
+            "created_at": self.created_at,
+            "category": self.category,
+            "notes": self.notes
+        }
+    
+    @classmethod
+    def from_json(cls, data: dict) -> "Favorite":
+        """Build a favorite from a persisted dict"""
+        return cls(
+            name=data["name"],
+            latitude=data["latitude"],
+            longitude=data["longitude"],
+            created_at=data["created_at"],
+            id=data.get("id", ""),
+            category=data.get("category", "Umumiy"),
+            notes=data.get("notes", "")
+        )
+
 class FavoritesHandler:
     """Handles favorite places functionality with improved UI/UX"""
     
+    DISTANCE_MEMO_MAX = 1024  # Chats whose favorite distances are memoized (least recently used dropped)
+    
     def __init__(self, location_data, user_favorites):
         self.location_data = location_data
         self.user_favorites = user_favorites
+        self._distance_memo = OrderedDict()  # chat_id -> (location version, {favorite_index: distance})
     
     async def show_favorites_menu(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Show main favorites menu with better organization"""
         keyboard = [
-            [InlineKeyboardButton("➕ Yangi sevimli joy qo'shish", callback_data="favorites_add")],
-            [InlineKeyboardButton("📋 Mening sevimlilarim", callback_data="favorites_list")],
-            [InlineKeyboardButton("🗑️ Sevimlilarni o'chirish", callback_data="favorites_delete")],
+            [_IKB("➕ Yangi sevimli joy qo'shish", callback_data="favorites_add")],
+            [_IKB("📋 Mening sevimlilarim", callback_data="favorites_list")],
+            [_IKB("🗑️ Sevimlilarni o'chirish", callback_data="favorites_delete")],
             # Removed categories button as requested
-            [InlineKeyboardButton("📊 Statistikalar", callback_data="favorites_stats")],
-            [InlineKeyboardButton("⬅️ Orqaga", callback_data="location_menu")]  # This is correct - goes back to location services
+            [_IKB("📊 Statistikalar", callback_data="favorites_stats")],
+            [_IKB("⬅️ Orqaga", callback_data="location_menu")]  # This is correct - goes back to location services
         ]
         
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        reply_markup = _IKM(keyboard)
         
         # Use the appropriate method to send the message
         if update.callback_query and update.callback_query.message:
@@ -34,7 +106,7 @@ class FavoritesHandler:
                 await update.callback_query.edit_message_text(
                     "⭐ <b>Sevimli joylarim</b>\n\n"
                     "Quyidagi amallardan birini tanlang:",
-                    parse_mode=ParseMode.HTML,
+                    parse_mode=_HTML,
                     reply_markup=reply_markup
                 )
             except Exception as e:
@@ -46,14 +118,14 @@ class FavoritesHandler:
                         await update.effective_message.reply_text(
                             "⭐ <b>Sevimli joylarim</b>\n\n"
                             "Quyidagi amallardan birini tanlang:",
-                            parse_mode=ParseMode.HTML,
+                            parse_mode=_HTML,
                             reply_markup=reply_markup
                         )
         elif update.message:
             await update.message.reply_text(
                 "⭐ <b>Sevimli joylarim</b>\n\n"
                 "Quyidagi amallardan birini tanlang:",
-                parse_mode=ParseMode.HTML,
+                parse_mode=_HTML,
                 reply_markup=reply_markup
             )
         elif update.effective_message:
@@ -61,7 +133,7 @@ class FavoritesHandler:
             await update.effective_message.reply_text(
                 "⭐ <b>Sevimli joylarim</b>\n\n"
                 "Quyidagi amallardan birini tanlang:",
-                parse_mode=ParseMode.HTML,
+                parse_mode=_HTML,
                 reply_markup=reply_markup
             )
     
@@ -93,7 +165,7 @@ class FavoritesHandler:
             "Iltimos, sevimli bo'lgan joylashuvingizni yuboring:\n"
             "• 📍 Tugma orqali hozirgi joylashuvingizni yuboring\n"
             "• 🏙️ Shahar nomini kiriting",
-            parse_mode=ParseMode.HTML
+            parse_mode=_HTML
         )
         
         # Send location options as a separate message
@@ -122,9 +194,9 @@ class FavoritesHandler:
             await query.edit_message_text(
                 "❌ Sizda hali sevimli joylar yo'q.\n\n"
                 "➕ Yangi sevimli joy qo'shish uchun quyidagi tugmani bosing:",
-                reply_markup=InlineKeyboardMarkup([
-                    [InlineKeyboardButton("➕ Yangi sevimli qo'shish", callback_data="favorites_add")],
-                    [InlineKeyboardButton("⬅️ Orqaga", callback_data="favorites_menu")]  # Changed to go back to favorites menu
+                reply_markup=_IKM([
+                    [_IKB("➕ Yangi sevimli qo'shish", callback_data="favorites_add")],
+                    [_IKB("⬅️ Orqaga", callback_data="favorites_menu")]  # Changed to go back to favorites menu
                 ])
             )
             return
@@ -146,8 +218,8 @@ class FavoritesHandler:
         favorites_text += "=" * 30 + "\n\n"
         
         for i, favorite in enumerate(page_favorites, start_index + 1):
-            created_date = datetime.fromisoformat(favorite['created_at']).strftime("%Y-%m-%d")
-            favorites_text += f"📍 <b>{i}. {favorite['name']}</b>\n"
+            created_date = favorite.created_dt.strftime("%Y-%m-%d")
+            favorites_text += f"📍 <b>{i}. {favorite.name}</b>\n"
             # Removed category as requested
             favorites_text += f"   📅 <b>Qo'shilgan:</b> {created_date}\n\n"
         
@@ -162,42 +234,42 @@ class FavoritesHandler:
             row = []
             # First button
             favorite_index = start_index + i
-            callback_data_1 = f"favorites_view_{favorite_index}"
-            row.append(InlineKeyboardButton(f"👁️ {favorite_index+1}-ni ko'rish", callback_data=callback_data_1))
+            callback_data_1 = f"{CB['view']}{favorite_index}"
+            row.append(_IKB(f"👁️ {favorite_index+1}-ni ko'rish", callback_data=callback_data_1))
             
             # Second button if exists
             if i + 1 < len(page_favorites):
                 favorite_index_2 = start_index + i + 1
-                callback_data_2 = f"favorites_view_{favorite_index_2}"
-                row.append(InlineKeyboardButton(f"👁️ {favorite_index_2+1}-ni ko'rish", callback_data=callback_data_2))
+                callback_data_2 = f"{CB['view']}{favorite_index_2}"
+                row.append(_IKB(f"👁️ {favorite_index_2+1}-ni ko'rish", callback_data=callback_data_2))
             
             keyboard.append(row)
         
         # Add pagination controls
         pagination_row = []
         if page > 1:
-            pagination_row.append(InlineKeyboardButton("⬅️ Oldingi", callback_data=f"favorites_page_{page-1}"))
+            pagination_row.append(_IKB("⬅️ Oldingi", callback_data=f"{CB['page']}{page-1}"))
         
         # Add page indicator
-        pagination_row.append(InlineKeyboardButton(f"{page}/{total_pages}", callback_data="favorites_info"))
+        pagination_row.append(_IKB(f"{page}/{total_pages}", callback_data="favorites_info"))
         
         if page < total_pages:
-            pagination_row.append(InlineKeyboardButton("Keyingi ➡️", callback_data=f"favorites_page_{page+1}"))
+            pagination_row.append(_IKB("Keyingi ➡️", callback_data=f"{CB['page']}{page+1}"))
         
         if pagination_row:
             keyboard.append(pagination_row)
         
         # Add navigation buttons
         keyboard.append([
-            InlineKeyboardButton("➕ Yangi qo'shish", callback_data="favorites_add"),
-            InlineKeyboardButton("⬅️ Orqaga", callback_data="favorites_menu")  # Changed to go back to favorites menu
+            _IKB("➕ Yangi qo'shish", callback_data="favorites_add"),
+            _IKB("⬅️ Orqaga", callback_data="favorites_menu")  # Changed to go back to favorites menu
         ])
         
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        reply_markup = _IKM(keyboard)
         
         await query.edit_message_text(
             favorites_text,
-            parse_mode=ParseMode.HTML,
+            parse_mode=_HTML,
             reply_markup=reply_markup
         )
     
@@ -225,33 +297,28 @@ class FavoritesHandler:
         
         # Calculate distance if user location is available
         distance_info = ""
-        if chat_id in self.location_data:
-            user_location = self.location_data[chat_id]
-            user_lat = user_location["latitude"]
-            user_lon = user_location["longitude"]
-            fav_lat = favorite['latitude']
-            fav_lon = favorite['longitude']
-            distance = self._calculate_distance(user_lat, user_lon, fav_lat, fav_lon)
+        distance = self._get_favorite_distance(chat_id, favorite_index, favorite)
+        if distance is not None:
             distance_info = f"📏 <b>Masofa:</b> {distance:.2f} km\n"
         
         # Create detailed view
-        detail_text = f"📍 <b>{favorite['name']}</b>\n"
-        detail_text += "=" * (len(favorite['name']) + 2) + "\n\n"
+        detail_text = f"📍 <b>{favorite.name}</b>\n"
+        detail_text += SEPARATOR + "\n\n"
         
         detail_text += "📋 <b>Asosiy ma'lumotlar:</b>\n"
 
         # Removed category as requested
-        detail_text += f"📅 <b>Qo'shilgan:</b> {datetime.fromisoformat(favorite['created_at']).strftime('%Y-%m-%d')}\n"
+        detail_text += f"📅 <b>Qo'shilgan:</b> {favorite.created_dt.strftime('%Y-%m-%d')}\n"
         if distance_info:
             detail_text += distance_info
         detail_text += "\n"
         
         detail_text += "🧭 <b>Geografik ma'lumotlar:</b>\n"
-        detail_text += f"• <b>Kenglik (latitude):</b> {favorite['latitude']:.6f}\n"
-        detail_text += f"• <b>Uzunlik (longitude):</b> {favorite['longitude']:.6f}\n\n"
+        detail_text += f"• <b>Kenglik (latitude):</b> {favorite.latitude:.6f}\n"
+        detail_text += f"• <b>Uzunlik (longitude):</b> {favorite.longitude:.6f}\n\n"
         
-        if favorite.get('notes'):
-            detail_text += f"📝 <b>Eslatma:</b> {favorite['notes']}\n\n"
+        if favorite.notes:
+            detail_text += f"📝 <b>Eslatma:</b> {favorite.notes}\n\n"
         
         # Add action buttons description
         detail_text += "📋 <b>Mavjud amallar:</b>\n"
@@ -262,23 +329,23 @@ class FavoritesHandler:
         detail_text += "• 🏠 <b>Bosh menyu</b> - Asosiy menyuga qaytish\n\n"
         
         # Add footer
-        detail_text += f"🔷 <b>Joy nomi:</b> {favorite['name']}\n"
+        detail_text += f"🔷 <b>Joy nomi:</b> {favorite.name}\n"
         detail_text += f"📄 <b>Raqam:</b> {favorite_index + 1}\n\n"
         
         # Add action buttons
         keyboard = [
-            [InlineKeyboardButton("🗺️ Xaritada ko'rish", callback_data=f"favorites_map_{favorite_index}")],
-            [InlineKeyboardButton("🧭 Yo'nalish olish", callback_data=f"favorites_directions_{favorite_index}")],
-            [InlineKeyboardButton("🗑️ O'chirish", callback_data=f"favorites_delete_confirm_{favorite_index}")],
-            [InlineKeyboardButton("⬅️ Orqaga", callback_data="favorites_list")],
-            [InlineKeyboardButton("🏠 Bosh menyu", callback_data="location_menu")]  # Changed to go back to location menu
+            [_IKB("🗺️ Xaritada ko'rish", callback_data=f"{CB['map']}{favorite_index}")],
+            [_IKB("🧭 Yo'nalish olish", callback_data=f"{CB['dir']}{favorite_index}")],
+            [_IKB("🗑️ O'chirish", callback_data=f"{CB['delC']}{favorite_index}")],
+            [_IKB("⬅️ Orqaga", callback_data="favorites_list")],
+            [_IKB("🏠 Bosh menyu", callback_data="location_menu")]  # Changed to go back to location menu
         ]
         
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        reply_markup = _IKM(keyboard)
         
         await query.edit_message_text(
             detail_text,
-            parse_mode=ParseMode.HTML,
+            parse_mode=_HTML,
             reply_markup=reply_markup
         )
     
@@ -299,8 +366,7 @@ class FavoritesHandler:
         if chat_id in self.location_data:
             location = self.location_data[chat_id]
             if "expires_at" in location:
-                expires_at = datetime.fromisoformat(location["expires_at"])
-                if datetime.now() > expires_at:
+                if time.time() > expiry_epoch(location):
                     await query.answer("📍 Joylashuv ma'lumotlari eskirgan. Iltimos, qaytadan jo'nating!", show_alert=True)
                     return
         
@@ -315,54 +381,49 @@ class FavoritesHandler:
         
         # Send location
         location_msg = Location(
-            longitude=favorite['longitude'],
-            latitude=favorite['latitude']
+            longitude=favorite.longitude,
+            latitude=favorite.latitude
         )
         
         # Calculate distance if user location is available
         distance_info = ""
-        if chat_id in self.location_data:
-            user_location = self.location_data[chat_id]
-            user_lat = user_location["latitude"]
-            user_lon = user_location["longitude"]
-            fav_lat = favorite['latitude']
-            fav_lon = favorite['longitude']
-            distance = self._calculate_distance(user_lat, user_lon, fav_lat, fav_lon)
+        distance = self._get_favorite_distance(chat_id, favorite_index, favorite)
+        if distance is not None:
             distance_info = f"📏 <b>Masofa:</b> {distance:.2f} km\n"
         
         # Create detailed map message
-        map_text = f"📍 <b>{favorite['name']}</b> joylashuvi xaritada ko'rsatilgan\n"
-        map_text += "=" * (len(favorite['name']) + 20) + "\n\n"
+        map_text = f"📍 <b>{favorite.name}</b> joylashuvi xaritada ko'rsatilgan\n"
+        map_text += SEPARATOR + "\n\n"
         
         map_text += "🧭 <b>Geografik ma'lumotlar:</b>\n"
-        map_text += f"• <b>Kenglik (latitude):</b> {favorite['latitude']:.6f}\n"
-        map_text += f"• <b>Uzunlik (longitude):</b> {favorite['longitude']:.6f}\n"
+        map_text += f"• <b>Kenglik (latitude):</b> {favorite.latitude:.6f}\n"
+        map_text += f"• <b>Uzunlik (longitude):</b> {favorite.longitude:.6f}\n"
         if distance_info:
             map_text += distance_info
         map_text += "\n"
         
-        if favorite.get('notes'):
-            map_text += f"📝 <b>Eslatma:</b> {favorite['notes']}\n\n"
+        if favorite.notes:
+            map_text += f"📝 <b>Eslatma:</b> {favorite.notes}\n\n"
         
         map_text += "<i>Xaritada ko'rish uchun yuqoridagi joylashuv xabarini oching</i>\n\n"
         map_text += "<i>Joylashuvni Google Maps ilovasida ochish uchun xabarni bosing</i>\n\n"
         
         # Add footer
-        map_text += f"🔷 <b>Joy nomi:</b> {favorite['name']}\n"
+        map_text += f"🔷 <b>Joy nomi:</b> {favorite.name}\n"
         map_text += f"📄 <b>Raqam:</b> {favorite_index + 1}\n\n"
         
         if update.effective_message:
             await update.effective_message.reply_location(location=location_msg)
             await update.effective_message.reply_text(
                 map_text,
-                parse_mode=ParseMode.HTML,
-                reply_markup=InlineKeyboardMarkup([
-                    [InlineKeyboardButton("⬅️ Orqaga", callback_data=f"favorites_view_{favorite_index}")],
-                    [InlineKeyboardButton("🏠 Bosh menyu", callback_data="location_menu")]  # Changed to go back to location menu
+                parse_mode=_HTML,
+                reply_markup=_IKM([
+                    [_IKB("⬅️ Orqaga", callback_data=f"{CB['view']}{favorite_index}")],
+                    [_IKB("🏠 Bosh menyu", callback_data="location_menu")]  # Changed to go back to location menu
                 ])
             )
         
-        await query.answer(f"📍 {favorite['name']} xaritada ko'rsatildi", show_alert=False)
+        await query.answer(f"📍 {favorite.name} xaritada ko'rsatildi", show_alert=False)
     
     async def show_directions(self, update: Update, context: ContextTypes.DEFAULT_TYPE, favorite_index: int):
         """Show directions to favorite place"""
@@ -388,40 +449,34 @@ class FavoritesHandler:
         if chat_id in self.location_data:
             location = self.location_data[chat_id]
             if "expires_at" in location:
-                expires_at = datetime.fromisoformat(location["expires_at"])
-                if datetime.now() > expires_at:
+                if time.time() > expiry_epoch(location):
                     await query.answer("📍 Joylashuv ma'lumotlari eskirgan. Iltimos, qaytadan jo'natish!", show_alert=True)
                     return
         
         favorite = user_favorites[favorite_index]
         
         # Provide directions link (Google Maps)
-        directions_url = f"https://www.google.com/maps/dir/?api=1&destination={favorite['latitude']},{favorite['longitude']}"
+        directions_url = f"https://www.google.com/maps/dir/?api=1&destination={favorite.latitude},{favorite.longitude}"
         
         # Calculate distance if user location is available
         distance_info = ""
-        if chat_id in self.location_data:
-            user_location = self.location_data[chat_id]
-            user_lat = user_location["latitude"]
-            user_lon = user_location["longitude"]
-            fav_lat = favorite['latitude']
-            fav_lon = favorite['longitude']
-            distance = self._calculate_distance(user_lat, user_lon, fav_lat, fav_lon)
+        distance = self._get_favorite_distance(chat_id, favorite_index, favorite)
+        if distance is not None:
             distance_info = f"📏 <b>Masofa:</b> {distance:.2f} km\n"
         
         # Create detailed directions message
-        directions_text = f"🧭 <b>{favorite['name']} ga yo'nalish</b>\n"
-        directions_text += "=" * (len(favorite['name']) + 15) + "\n\n"
+        directions_text = f"🧭 <b>{favorite.name} ga yo'nalish</b>\n"
+        directions_text += SEPARATOR + "\n\n"
         
         directions_text += "📍 <b>Manzil ma'lumotlari:</b>\n"
-        directions_text += f"• <b>Joy nomi:</b> {favorite['name']}\n"
-        directions_text += f"• <b>Koordinatalar:</b> {favorite['latitude']:.6f}, {favorite['longitude']:.6f}\n"
+        directions_text += f"• <b>Joy nomi:</b> {favorite.name}\n"
+        directions_text += f"• <b>Koordinatalar:</b> {favorite.latitude:.6f}, {favorite.longitude:.6f}\n"
         if distance_info:
             directions_text += distance_info
         directions_text += "\n"
         
-        if favorite.get('notes'):
-            directions_text += f"📝 <b>Eslatma:</b> {favorite['notes']}\n\n"
+        if favorite.notes:
+            directions_text += f"📝 <b>Eslatma:</b> {favorite.notes}\n\n"
         
         directions_text += "🧭 <b>Yo'nalish:</b>\n"
         directions_text += f"<a href='{directions_url}'>Google Maps orqali yo'nalish olish</a>\n\n"
@@ -429,20 +484,20 @@ class FavoritesHandler:
         directions_text += "<i>Yo'nalishni Google Maps ilovasida ochish uchun havolani bosing</i>\n\n"
         
         # Add footer
-        directions_text += f"🔷 <b>Joy nomi:</b> {favorite['name']}\n"
+        directions_text += f"🔷 <b>Joy nomi:</b> {favorite.name}\n"
         directions_text += f"📄 <b>Raqam:</b> {favorite_index + 1}\n\n"
         
         await query.edit_message_text(
             directions_text,
-            parse_mode=ParseMode.HTML,
-            reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("⬅️ Orqaga", callback_data=f"favorites_view_{favorite_index}")],
-                [InlineKeyboardButton("🏠 Bosh menyu", callback_data="location_menu")]  # Changed to go back to location menu
+            parse_mode=_HTML,
+            reply_markup=_IKM([
+                [_IKB("⬅️ Orqaga", callback_data=f"{CB['view']}{favorite_index}")],
+                [_IKB("🏠 Bosh menyu", callback_data="location_menu")]  # Changed to go back to location menu
             ])
         )
     
-    async def delete_favorite_menu(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Show menu for deleting favorites"""
+    async def delete_favorite_menu(self, update: Update, context: ContextTypes.DEFAULT_TYPE, page=1):
+        """Show menu for deleting favorites with pagination"""
         query = update.callback_query
         if not query or not query.message:
             return
@@ -453,54 +508,82 @@ class FavoritesHandler:
         if chat_id not in self.user_favorites or not self.user_favorites[chat_id]:
             await query.edit_message_text(
                 "❌ O'chirish uchun sevimli joylaringiz yo'q.",
-                reply_markup=InlineKeyboardMarkup([
-                    [InlineKeyboardButton("➕ Yangi sevimli joy qo'shish", callback_data="favorites_add")],
-                    [InlineKeyboardButton("⬅️ Orqaga", callback_data="favorites_menu")]  # Changed to go back to favorites menu
+                reply_markup=_IKM([
+                    [_IKB("➕ Yangi sevimli joy qo'shish", callback_data="favorites_add")],
+                    [_IKB("⬅️ Orqaga", callback_data="favorites_menu")]  # Changed to go back to favorites menu
                 ])
             )
             return
         
-        # Show user favorites for deletion
         user_favorites = self.user_favorites[chat_id]
+        
+        # Pagination settings
+        items_per_page = 10
+        total_pages = (len(user_favorites) + items_per_page - 1) // items_per_page
+        page = max(1, min(page, total_pages))
+        
+        # Get items for current page
+        start_index = (page - 1) * items_per_page
+        end_index = min(start_index + items_per_page, len(user_favorites))
+        page_favorites = user_favorites[start_index:end_index]
+        
+        # Show user favorites for deletion
         deletion_text = "🗑️ <b>Sevimli joyni o'chirish</b>\n"
         deletion_text += "=" * 25 + "\n\n"
         deletion_text += "O'chirish uchun sevimli joy tanlang:\n\n"
+        deletion_text += f"📄 Sahifa {page}/{total_pages}\n\n"
         
         # Create inline keyboard
         keyboard = []
         
-        # Add favorites (2 per row)
-        for i in range(0, len(user_favorites), 2):
+        # Add favorites for current page (2 per row)
+        for i in range(0, len(page_favorites), 2):
             row = []
             # First button
-            favorite_name_1 = user_favorites[i]['name']
+            favorite_index = start_index + i
+            favorite_name_1 = page_favorites[i].name
             if len(favorite_name_1) > 15:
-                button_text_1 = f"{i+1}. {favorite_name_1[:12]}..."
+                button_text_1 = f"{favorite_index+1}. {favorite_name_1[:12]}..."
             else:
-                button_text_1 = f"{i+1}. {favorite_name_1}"
-            callback_data_1 = f"favorites_delete_confirm_{i}"
-            row.append(InlineKeyboardButton(button_text_1, callback_data=callback_data_1))
+                button_text_1 = f"{favorite_index+1}. {favorite_name_1}"
+            callback_data_1 = f"{CB['delC']}{favorite_index}"
+            row.append(_IKB(button_text_1, callback_data=callback_data_1))
             
             # Second button if exists
-            if i + 1 < len(user_favorites):
-                favorite_name_2 = user_favorites[i+1]['name']
+            if i + 1 < len(page_favorites):
+                favorite_index_2 = start_index + i + 1
+                favorite_name_2 = page_favorites[i+1].name
                 if len(favorite_name_2) > 15:
-                    button_text_2 = f"{i+2}. {favorite_name_2[:12]}..."
+                    button_text_2 = f"{favorite_index_2+1}. {favorite_name_2[:12]}..."
                 else:
-                    button_text_2 = f"{i+2}. {favorite_name_2}"
-                callback_data_2 = f"favorites_delete_confirm_{i+1}"
-                row.append(InlineKeyboardButton(button_text_2, callback_data=callback_data_2))
+                    button_text_2 = f"{favorite_index_2+1}. {favorite_name_2}"
+                callback_data_2 = f"{CB['delC']}{favorite_index_2}"
+                row.append(_IKB(button_text_2, callback_data=callback_data_2))
             
             keyboard.append(row)
         
+        # Add pagination controls
+        if total_pages > 1:
+            pagination_row = []
+            if page > 1:
+                pagination_row.append(_IKB("⬅️ Oldingi", callback_data=f"{CB['delP']}{page-1}"))
+            
+            # Add page indicator
+            pagination_row.append(_IKB(f"{page}/{total_pages}", callback_data="favorites_info"))
+            
+            if page < total_pages:
+                pagination_row.append(_IKB("Keyingi ➡️", callback_data=f"{CB['delP']}{page+1}"))
+            
+            keyboard.append(pagination_row)
+        
         # Add cancel button
-        keyboard.append([InlineKeyboardButton("❌ Bekor qilish", callback_data="favorites_menu")])
+        keyboard.append([_IKB("❌ Bekor qilish", callback_data="favorites_menu")])
         
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        reply_markup = _IKM(keyboard)
         
         await query.edit_message_text(
             deletion_text,
-            parse_mode=ParseMode.HTML,
+            parse_mode=_HTML,
             reply_markup=reply_markup
         )
     
@@ -529,12 +612,12 @@ class FavoritesHandler:
         # Show confirmation
         await query.edit_message_text(
             f"❓ <b>Rostan ham o'chirmoqchimisiz?</b>\n\n"
-            f"📍 <b>{favorite['name']}</b>\n\n"
+            f"📍 <b>{favorite.name}</b>\n\n"
             f"Ushbu amalni bekor qilib bo'lmaydi!",
-            parse_mode=ParseMode.HTML,
-            reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("✅ Ha, o'chir", callback_data=f"favorites_delete_final_{favorite_index}")],
-                [InlineKeyboardButton("❌ Yo'q, bekor qil", callback_data="favorites_menu")]  # Changed to go back to favorites menu
+            parse_mode=_HTML,
+            reply_markup=_IKM([
+                [_IKB("✅ Ha, o'chir", callback_data=f"{CB['delF']}{favorite_index}")],
+                [_IKB("❌ Yo'q, bekor qil", callback_data="favorites_menu")]  # Changed to go back to favorites menu
             ])
         )
     
@@ -561,17 +644,22 @@ class FavoritesHandler:
         # Delete favorite
         deleted_favorite = user_favorites.pop(favorite_index)
         
-        # Remove key if no favorites left
+        # Indices shift after deletion, so memoized distances are no longer valid
+        self._distance_memo.pop(chat_id, None)
+        
+        # Remove key if no favorites left, otherwise persist the shortened list
         if not user_favorites:
             del self.user_favorites[chat_id]
+        else:
+            self.user_favorites.persist(chat_id)
         
         # Show confirmation
         await query.edit_message_text(
-            f"✅ <b>{deleted_favorite['name']}</b> sevimli joylaringizdan o'chirildi!",
-            parse_mode=ParseMode.HTML,
-            reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("⬅️ Orqaga", callback_data="favorites_menu")],  # Changed to go back to favorites menu
-                [InlineKeyboardButton("🏠 Bosh menyu", callback_data="location_menu")]  # Changed to go back to location menu
+            f"✅ <b>{deleted_favorite.name}</b> sevimli joylaringizdan o'chirildi!",
+            parse_mode=_HTML,
+            reply_markup=_IKM([
+                [_IKB("⬅️ Orqaga", callback_data="favorites_menu")],  # Changed to go back to favorites menu
+                [_IKB("🏠 Bosh menyu", callback_data="location_menu")]  # Changed to go back to location menu
             ])
         )
     
@@ -590,10 +678,10 @@ class FavoritesHandler:
                 "==================\n\n"
                 "❌ Sizda hali sevimli joylar yo'q.\n\n"
                 "➕ Yangi sevimli joy qo'shish uchun quyidagi tugmani bosing:",
-                parse_mode=ParseMode.HTML,
-                reply_markup=InlineKeyboardMarkup([
-                    [InlineKeyboardButton("➕ Yangi sevimli qo'shish", callback_data="favorites_add")],
-                    [InlineKeyboardButton("⬅️ Orqaga", callback_data="favorites_menu")]  # Changed to go back to favorites menu
+                parse_mode=_HTML,
+                reply_markup=_IKM([
+                    [_IKB("➕ Yangi sevimli qo'shish", callback_data="favorites_add")],
+                    [_IKB("⬅️ Orqaga", callback_data="favorites_menu")]  # Changed to go back to favorites menu
                 ])
             )
             return
@@ -604,7 +692,7 @@ class FavoritesHandler:
         total_favorites = len(user_favorites)
         
         # Date statistics
-        dates = [datetime.fromisoformat(fav['created_at']) for fav in user_favorites]
+        dates = [fav.created_dt for fav in user_favorites]
         earliest_date = min(dates).strftime("%Y-%m-%d") if dates else "Noma'lum"
         latest_date = max(dates).strftime("%Y-%m-%d") if dates else "Noma'lum"
         
@@ -612,15 +700,7 @@ class FavoritesHandler:
         distance_stats = ""
         if chat_id in self.location_data:
             user_location = self.location_data[chat_id]
-            user_lat = user_location["latitude"]
-            user_lon = user_location["longitude"]
-            
-            distances = []
-            for fav in user_favorites:
-                fav_lat = fav['latitude']
-                fav_lon = fav['longitude']
-                distance = self._calculate_distance(user_lat, user_lon, fav_lat, fav_lon)
-                distances.append(distance)
+            distances = [distance_from_location(user_location, fav.latitude, fav.longitude) for fav in user_favorites]
             
             if distances:
                 avg_distance = sum(distances) / len(distances)
@@ -649,18 +729,35 @@ class FavoritesHandler:
         
         # Add navigation buttons
         keyboard = [
-            [InlineKeyboardButton("⬅️ Orqaga", callback_data="favorites_menu")],
-            [InlineKeyboardButton("🏠 Bosh menyu", callback_data="location_menu")]  # Changed to go back to location menu
+            [_IKB("⬅️ Orqaga", callback_data="favorites_menu")],
+            [_IKB("🏠 Bosh menyu", callback_data="location_menu")]  # Changed to go back to location menu
         ]
         
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        reply_markup = _IKM(keyboard)
         
         await query.edit_message_text(
             stats_text,
-            parse_mode=ParseMode.HTML,
+            parse_mode=_HTML,
             reply_markup=reply_markup
         )
     
-    def _calculate_distance(self, lat1, lon1, lat2, lon2):
-        """Calculate the distance between two points - delegates to shared utility"""
-        return calculate_distance(lat1, lon1, lat2, lon2)
\ No newline at end of file
+    def _get_favorite_distance(self, chat_id, favorite_index, favorite):
+        """Get distance from the user's location to a favorite, memoized per location version"""
+        user_location = self.location_data.get(chat_id)
+        if user_location is None:
+            return None
+        
+        version = user_location.get("version", 0)
+        memo = self._distance_memo.get(chat_id)
+        if memo is None or memo[0] != version:
+            memo = (version, {})
+            self._distance_memo[chat_id] = memo
+            while len(self._distance_memo) > self.DISTANCE_MEMO_MAX:
+                self._distance_memo.popitem(last=False)
+        else:
+            self._distance_memo.move_to_end(chat_id)
+        
+        distances = memo[1]
+        if favorite_index not in distances:
+            distances[favorite_index] = distance_from_location(user_location, favorite.latitude, favorite.longitude)
+        return distances[favorite_index]
@@ -0,0 +1,162 @@
+"""
+Geocoding backends for location features
+Nominatim is the default; PhotoPrism Places can serve reverse lookups by S2 cell
+"""
+import logging
+from typing import Optional, Protocol
+from modules.retry_utils import http_get_with_retry, get_session
+from modules.location_features.utils import validate_coordinates
+
+# s2sphere is optional - without it the Places backend falls back to Nominatim
+try:
+    import s2sphere
+    S2_AVAILABLE = True
+except ImportError:
+    S2_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+USER_AGENT = "AQLJON-bot/1.0 (https://t.me/AQLJON_bot)"
+
+
+def s2_key(latitude: float, longitude: float, level: int = 18) -> str:
+    """S2 cell token of a point at the given level (level 18 is ~30 m per edge)"""
+    latlng = s2sphere.LatLng.from_degrees(latitude, longitude)
+    return s2sphere.CellId.from_lat_lng(latlng).parent(level).to_token()
+
+
+def cell_key(latitude: float, longitude: float, level: int = 18) -> str:
+    """Geocache key of a point: its S2 cell token, or a ~110 m rounded grid cell without s2sphere"""
+    if S2_AVAILABLE:
+        return s2_key(latitude, longitude, level)
+    return f"{round(latitude, 3)},{round(longitude, 3)}"
+
+
+class GeocodeBackend(Protocol):
+    """Reverse and forward geocoder returning location_info dicts (or None when nothing was found)"""
+
+    async def reverse(self, latitude: float, longitude: float) -> Optional[dict]: ...
+
+    async def search(self, city_name: str) -> Optional[dict]: ...
+
+
+class NominatimBackend:
+    """Geocoding through a Nominatim instance (public OSM server by default)"""
+
+    def __init__(self, base_url: str = "https://nominatim.openstreetmap.org"):
+        self.base_url = base_url.rstrip("/")
+
+    async def reverse(self, latitude: float, longitude: float) -> Optional[dict]:
+        """Reverse-geocode coordinates"""
+        params = {
+            "format": "json",
+            "lat": latitude,
+            "lon": longitude,
+            "accept-language": "uz"
+        }
+        data = await http_get_with_retry(
+            f"{self.base_url}/reverse", params=params, headers={"User-Agent": USER_AGENT},
+            timeout=15, session=await get_session()
+        )
+        if not data:
+            return None
+
+        address = data.get("address", {})
+        return {
+            "city": address.get("city") or address.get("town") or address.get("village") or "Noma'lum shahar",
+            "country": address.get("country", "Noma'lum mamlakat"),
+            "state": address.get("state", ""),
+            "display_name": data.get("display_name", "Noma'lum joylashuv"),
+            "latitude": latitude,
+            "longitude": longitude
+        }
+
+    async def search(self, city_name: str) -> Optional[dict]:
+        """Forward-geocode a city name"""
+        params = {
+            "format": "json",
+            "q": city_name,
+            "addressdetails": 1,
+            "limit": 5
+        }
+        data = await http_get_with_retry(
+            f"{self.base_url}/search", params=params, headers={"User-Agent": USER_AGENT},
+            timeout=15, session=await get_session()
+        )
+        if not data:
+            return None
+
+        # Get the most relevant result (highest Nominatim importance)
+        location = max(data, key=lambda r: r.get("importance", 0.0))
+        lat = float(location["lat"])
+        lon = float(location["lon"])
+        if not validate_coordinates(lat, lon):
+            logger.error(f"Invalid coordinates from Nominatim: {lat}, {lon}")
+            return None
+
+        address = location.get("address", {})
+        return {
+            "city": address.get("city") or address.get("town") or address.get("village") or city_name,
+            "country": address.get("country", "Noma'lum mamlakat"),
+            "state": address.get("state", ""),
+            "display_name": location.get("display_name", city_name),
+            "latitude": lat,
+            "longitude": lon
+        }
+
+
+class PlacesBackend:
+    """
+    Reverse geocoding through PhotoPrism Places, keyed by level-18 S2 cell token
+
+    Forward search, cells Places does not know (404) and missing s2sphere all go to the fallback backend.
+    """
+
+    S2_LEVEL = 18
+
+    def __init__(self, fallback: GeocodeBackend, base_url: str = "https://places.photoprism.app"):
+        self.fallback = fallback
+        self.base_url = base_url.rstrip("/")
+
+    async def reverse(self, latitude: float, longitude: float) -> Optional[dict]:
+        """Reverse-geocode coordinates, falling back when Places has no answer"""
+        return await self.reverse_places(latitude, longitude) or await self.fallback.reverse(latitude, longitude)
+
+    async def reverse_places(self, latitude: float, longitude: float) -> Optional[dict]:
+        """Reverse-geocode coordinates through Places only (None when Places has no answer)"""
+        if S2_AVAILABLE:
+            try:
+                data = await http_get_with_retry(
+                    f"{self.base_url}/v1/location/{s2_key(latitude, longitude, self.S2_LEVEL)}",
+                    headers={"User-Agent": USER_AGENT}, timeout=10, session=await get_session()
+                )
+            except Exception as e:
+                logger.warning(f"Places reverse geocoding failed, using fallback: {e}")
+                data = None
+            if data:
+                place = data.get("place", {})
+                return {
+                    "city": place.get("city") or "Noma'lum shahar",
+                    "country": place.get("country") or "Noma'lum mamlakat",
+                    "state": place.get("state", ""),
+                    "display_name": place.get("label") or data.get("name") or "Noma'lum joylashuv",
+                    "latitude": latitude,
+                    "longitude": longitude
+                }
+        return None
+
+    async def search(self, city_name: str) -> Optional[dict]:
+        """Forward-geocode a city name (Places has no search - always the fallback)"""
+        return await self.fallback.search(city_name)
+
+
+def get_geocode_backend(name: str) -> GeocodeBackend:
+    """Build the geocoder named by GEOCODE_BACKEND ("nominatim" or "places")"""
+    nominatim = NominatimBackend()
+    if name.lower() == "places":
+        if not S2_AVAILABLE:
+            logger.warning("GEOCODE_BACKEND=places needs s2sphere; reverse lookups will use Nominatim")
+        return PlacesBackend(nominatim)
+    if name.lower() != "nominatim":
+        logger.warning(f"Unknown GEOCODE_BACKEND '{name}', using Nominatim")
+    return nominatim
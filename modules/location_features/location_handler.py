@@ -1,41 +1,222 @@
 import asyncio
+import functools
 import logging
-from datetime import datetime, timedelta
+import re
+import sys
+import time
+from collections import OrderedDict, namedtuple
+from datetime import datetime
+import aiohttp
 from telegram import Update, ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardButton, InlineKeyboardMarkup, Location
 from telegram.ext import ContextTypes
 from telegram.constants import ParseMode
-from modules.utils import safe_reply, safe_edit_message
-from modules.retry_utils import http_get_with_retry
-from modules.location_features.utils import validate_city_name, validate_coordinates
-from .favorites import FavoritesHandler
+from telegram.error import RetryAfter, TelegramError, TimedOut
+from modules.config import Config
+from modules.utils import safe_reply, safe_edit_message, location_initial_keyboard, location_services_keyboard, main_menu_keyboard
+from modules.location_features.utils import location_radians, validate_city_name, KeyedLocks
+from .geocoding import get_geocode_backend, cell_key, PlacesBackend
+from .favorites import FavoritesHandler, Favorite, CB_ACTIONS as FAV_CB_ACTIONS
 from .nearby import NearbyHandler
 from .prayer_times import PrayerTimesHandler
+from .store import LocationStore, PersistentLRUDict, TTLCache, expiry_epoch, next_location_version, LOCATION_TTL
 
 logger = logging.getLogger(__name__)
 
-# Global instance to maintain state across interactions
-_location_handler_instance = None
+# Stand-in for telegram.Location when the location comes from a city search
+FakeLocation = namedtuple("FakeLocation", ["latitude", "longitude", "horizontal_accuracy"])
 
-def get_location_handler():
+# Reply keyboards are immutable - build them once at import time
+_MAIN_KB = location_initial_keyboard()
+_SERVICES_KB = location_services_keyboard()
+_MAIN_MENU_KB = main_menu_keyboard()
+_BACK_KB = ReplyKeyboardMarkup([[KeyboardButton("⬅️ Orqaga")]], resize_keyboard=True, one_time_keyboard=True)
+
+# Message template for save_favorite_with_location
+FAV_CONFIRM_TMPL = (
+    "✅ <b>Sevimli joyingiz saqlandi!</b>\n\n"
+    "⭐ <b>Nom:</b> {name}\n"
+    "🏙️ <b>Shahar:</b> {city}\n"
+    "📍 <b>Koordinatalar:</b>\n"
+    "• <b>Kenglik:</b> {lat:.6f}\n"
+    "• <b>Uzunlik:</b> {lon:.6f}\n\n"
+    "Endi bu joyga tezda qaytish uchun 'Sevimli joylarim' menyusidan foydalanishingiz mumkin."
+)
+
+# Place types accepted from nearby_{place_type} callbacks
+NEARBY_PLACE_TYPES: frozenset[str] = frozenset({
+    "cafe", "restaurant", "pizza", "fast_food", "confectionery", "tea_shop",
+    "bakery", "takeaway", "grocery", "marketplace", "supermarket", "books",
+    "clothes", "electronics", "bank", "hairdresser", "mobile_phone_repair",
+    "fuel", "car_service", "post_office", "doctor", "pharmacy", "hotel",
+    "school", "university", "bus_stop", "train_station", "aerodrome",
+    "taxi_stand", "bicycle_rental",
+})
+
+# Tail of nearby_[{detail|map|directions}_]{place_type}[_{page or index}] after "nearby_"
+_CB_RE = re.compile(r"^(?:(detail|map|directions)_)?(?P<type>[a-z_]+?)(?:_(?P<page>\d+))?$")
+
+# Callback trie leaf keys; they contain "_" so they can never collide with a partitioned token
+_CB_EXACT = "_exact"
+_CB_PARAM = "_param"
+
+# user_data keys used while adding a favorite
+FAVORITE_FLOW_KEYS = ("temp_favorite_location", "adding_favorite", "awaiting_favorite_location", "awaiting_favorite_name")
+
+# Long-form favorites_{action}_{index} actions -> compact token actions
+FAV_LEGACY_ACTIONS = {"view": "view", "map": "map", "directions": "dir"}
+
+_SEPARATOR = "=" * 30
+_TS_FMT = "%Y-%m-%d %H:%M:%S"
+
+# Message template for show_detailed_location_info
+LOCATION_DETAILS_TMPL = (
+    "📍 <b>Sizning joylashuvingiz</b>\n"
+    + _SEPARATOR + "\n\n"
+    "🌍 <b>Geografik ma'lumotlar:</b>\n"
+    "• <b>Kenglik (latitude):</b> {lat:.6f}\n"
+    "• <b>Uzunlik (longitude):</b> {lon:.6f}\n"
+    "• <b>Aniqlik:</b> {accuracy} metr\n\n"
+    "🏙️ <b>Manzil ma'lumotlari:</b>\n"
+    "• <b>Shahar:</b> {city}\n"
+    "{state_block}"
+    "• <b>Mamlakat:</b> {country}\n\n"
+    "📌 <b>To'liq manzil:</b>\n"
+    "{display_name}\n\n"
+    "{accuracy_block}"
+    "📋 <b>Mavjud xizmatlar:</b>\n"
+    "Endi quyidagi joylashuvga asoslangan xizmatlardan foydalanishingiz mumkin:\n"
+    "• 🕋 <b>Namoz vaqtlari</b> - Namoz vaqtlarini biling\n"
+    "• 📍 <b>Yaqin-atrofim</b> - Yonizdagi joylarni toping\n"
+    "• ⭐ <b>Sevimli joylarim</b> - O'z sevgan joylaringizni saqlang\n\n"
+    "🕒 <b>Ma'lumotlar yangilangan vaqti:</b> {timestamp}\n"
+)
+
+# Single shared instance to maintain state across interactions
+@functools.lru_cache(maxsize=1)
+def get_location_handler() -> "LocationFeatureHandler":
     """Get or create a singleton instance of LocationFeatureHandler"""
-    global _location_handler_instance
-    if _location_handler_instance is None:
-        _location_handler_instance = LocationFeatureHandler()
-    return _location_handler_instance
+    return LocationFeatureHandler()
 
 class LocationFeatureHandler:
     """Main handler for all location-based features with improved organization"""
     
+    # Fixed attribute set of this long-lived singleton
+    __slots__ = (
+        "store", "location_data", "user_favorites", "cached_data",
+        "_reverse_cache", "_search_cache", "_inflight", "_chat_locks", "geocoder",
+        "_geo_queue", "_geo_queued", "_geo_worker_task",
+        "favorites_handler", "nearby_handler", "prayer_handler",
+        "_text_dispatch", "_fav_simple", "_callback_dispatch", "_fav_item_dispatch", "_param_cb", "_nearby_item_dispatch", "_cb_root",
+    )
+    
+    # Geocoding cache limits (Nominatim responses)
+    GEOCODE_CACHE_MAX = 4096
+    GEOCODE_CACHE_TTL = 6 * 60 * 60  # 6 hours
+    
+    # API response cache limits (nearby search results)
+    RESPONSE_CACHE_MAX = 2048
+    RESPONSE_CACHE_TTL = 10 * 60  # 10 minutes
+    
+    # Persistent store settings
+    HOT_CACHE_SIZE = 1024  # Users kept in memory per table
+    STORE_GC_INTERVAL = 10 * 60  # 10 minutes
+    STORE_FLUSH_INTERVAL = 2.0  # Seconds between commits of queued store writes
+    GEOCODE_MIN_INTERVAL = 1.0  # Seconds between outbound Nominatim requests (Nominatim usage policy)
+    GEOCODE_FETCH_TIMEOUT = 8.0  # Budget of one geocoding request, retries included (seconds)
+    CITY_SEARCH_EDIT_AFTER = 0.5  # Show the interim "found" edit only for lookups slower than this (seconds)
+    
     def __init__(self):
+        # Persistent storage (SQLite) with bounded in-memory hot caches in front
+        try:
+            self.store = LocationStore(Config.LOCATION_DB_PATH)
+        except Exception as e:
+            logger.error(f"Joylashuv bazasini ochishda xatolik, xotirada ishlanadi: {e}")
+            self.store = LocationStore(":memory:")
+        
         # Shared data structures
-        self.location_data = {}  # In-memory storage for user locations
-        self.user_favorites = {}  # In-memory storage for user favorite places
-        self.cached_data = {}  # Cache for API responses
+        self.location_data = PersistentLRUDict(  # User locations
+            self.store.get_location, self.store.put_location, self.store.delete_location,
+            maxsize=self.HOT_CACHE_SIZE
+        )
+        self.user_favorites = PersistentLRUDict(  # User favorite places
+            self._load_favorites, self._save_favorites, self.store.delete_favorites,
+            maxsize=self.HOT_CACHE_SIZE
+        )
+        self.cached_data = TTLCache(  # Cache for API responses
+            maxsize=self.RESPONSE_CACHE_MAX, ttl=self.RESPONSE_CACHE_TTL,
+            loader=self.store.get_response, saver=self.store.put_response
+        )
+        self._reverse_cache = OrderedDict()  # S2 cell token (or rounded grid cell) -> (stored_at, location_info)
+        self._search_cache = OrderedDict()  # normalized city name -> (stored_at, location_info)
+        self._inflight = {}  # (kind, cache_key) -> asyncio.Future shared by concurrent identical lookups
+        self._chat_locks = KeyedLocks()  # chat_id -> lock ordering that chat's location writes and replies
+        self.geocoder = get_geocode_backend(Config.GEOCODE_BACKEND)
+        self._geo_queue = asyncio.Queue()  # (key, future, fetch) waiting for the rate-limited Nominatim worker
+        self._geo_queued = {}  # key -> future of a Nominatim request that is queued or running
+        self._geo_worker_task = None  # Started on first lookup, once an event loop is running
         
         # Initialize feature handlers
         self.favorites_handler = FavoritesHandler(self.location_data, self.user_favorites)
         self.nearby_handler = NearbyHandler(self.location_data, self.cached_data)
-        self.prayer_handler = PrayerTimesHandler(self.location_data)
+        self.prayer_handler = PrayerTimesHandler(
+            self.location_data, self._get_location_info, self.store
+        )
+        
+        # Reply keyboard button text -> handler
+        self._text_dispatch = {
+            "🏙️ Shahar bo'yicha qidirish": self._prompt_city_name,
+            "🕋 Namoz vaqtlari": self.prayer_handler.show_prayer_times,
+            "📍 Yaqin-atrofim": self.nearby_handler.show_nearby_menu,
+            "⭐ Sevimli joylarim": self.favorites_handler.show_favorites_menu,
+            "⬅️ Orqaga": self._show_location_start_menu,
+            "🏠 Bosh menyu": self._show_main_menu_keyboard,
+        }
+        
+        # Argument-less favorites actions, shared by exact and long-form callbacks
+        self._fav_simple = {
+            "add": self.favorites_handler.add_favorite,
+            "list": self.favorites_handler.list_favorites,
+            "menu": self.favorites_handler.show_favorites_menu,
+            "stats": self.favorites_handler.show_statistics,
+        }
+        
+        # Exact callback_data -> handler
+        self._callback_dispatch = {
+            "prayer_refresh": self.prayer_handler.show_prayer_times,
+            "location_search": self._prompt_city_name_inline,
+            "nearby_menu": self.nearby_handler.show_nearby_menu,
+            "favorites_delete": self.favorites_handler.delete_favorite_menu,
+            **{f"favorites_{action}": handler for action, handler in self._fav_simple.items()},
+            "location_menu": self._show_location_menu,
+            "main_menu": self._show_main_menu,
+        }
+        
+        # Compact favorites token action -> handler taking the favorite index (or page)
+        self._fav_item_dispatch = {
+            "view": self.favorites_handler.view_favorite,
+            "map": self.favorites_handler.show_map,
+            "dir": self.favorites_handler.show_directions,
+            "delC": self.favorites_handler.confirm_delete,
+            "delF": self.favorites_handler.delete_favorite,
+            "page": lambda u, c, n: self.favorites_handler.list_favorites(u, c, max(1, n)),
+            "delP": lambda u, c, n: self.favorites_handler.delete_favorite_menu(u, c, max(1, n)),
+        }
+        
+        # Prefix before the first "_" of parameterized callback_data -> handler taking the rest
+        self._param_cb = {
+            "nearby": self._handle_nearby_callback,
+            "favorites": self._handle_favorites_callback,
+        }
+        
+        # action of nearby_{action}_{place_type}_{index} callbacks -> handler
+        self._nearby_item_dispatch = {
+            "detail": self.nearby_handler.show_place_detail,
+            "map": self.nearby_handler.show_place_map,
+            "directions": self.nearby_handler.show_directions,
+        }
+        
+        # Token trie over _callback_dispatch and _param_cb, walked once per callback
+        self._cb_root = self._build_callback_trie()
     
     # ─── LOCATION MANAGEMENT ──────────────────────────────────────────────────────
     
@@ -44,36 +225,76 @@ class LocationFeatureHandler:
         if not update.message or not update.effective_chat:
             return
         
-        from modules.utils import location_initial_keyboard
         await update.message.reply_text(
             "🌍 <b>Joylashuv xizmatlari</b>\n\n"
             "Joylashuvingizni ulashish uchun quyidagi variantlardan birini tanlang:",
             parse_mode=ParseMode.HTML,
-            reply_markup=location_initial_keyboard()
+            reply_markup=_MAIN_KB
         )
     
-    def _main_location_keyboard(self):
-        """Create main location menu keyboard - ONLY 3 options as requested"""
-        return ReplyKeyboardMarkup(
-            [
-                [KeyboardButton("📍 Mening joylashuvim", request_location=True)],
-                [KeyboardButton("🏙️ Shahar bo'yicha qidirish")],
-                [KeyboardButton("🏠 Bosh menyu")]
-            ],
-            resize_keyboard=True, one_time_keyboard=False,
-        )
+    def _load_favorites(self, chat_id: str):
+        """Load a user's favorites from the persistent store"""
+        favorites = self.store.get_favorites(chat_id)
+        if favorites is None:
+            return None
+        return [Favorite.from_json(favorite) for favorite in favorites]
     
-    def _location_services_keyboard(self):
-        """Create location services menu keyboard after location is provided"""
-        return ReplyKeyboardMarkup(
-            [
-                [KeyboardButton("📍 Mening joylashuvim", request_location=True)],
-                [KeyboardButton("🏙️ Shahar bo'yicha qidirish"), KeyboardButton("🕋 Namoz vaqtlari")],
-                [KeyboardButton("📍 Yaqin-atrofim"), KeyboardButton("⭐ Sevimli joylarim")],
-                [KeyboardButton("🏠 Bosh menyu")]
-            ],
-            resize_keyboard=True, one_time_keyboard=False,
-        )
+    def _save_favorites(self, chat_id: str, favorites):
+        """Write a user's favorites to the persistent store"""
+        self.store.put_favorites(chat_id, [favorite.to_json() for favorite in favorites])
+    
+    def _persist_favorites(self, chat_id: str):
+        """Snapshot a user's favorites now and queue them for the store's next flush"""
+        try:
+            self.store.put_favorites(chat_id, [favorite.to_json() for favorite in self.user_favorites[chat_id]])
+        except Exception as e:
+            logger.error(f"Sevimli joylarni saqlashda xatolik ({chat_id}): {e}")
+    
+    async def _gc_loop(self):
+        """Commit queued store writes off the event loop and periodically drop expired entries"""
+        last_gc = time.monotonic()
+        while True:
+            await asyncio.sleep(self.STORE_FLUSH_INTERVAL)
+            try:
+                await asyncio.to_thread(self.store.flush)
+            except Exception as e:
+                logger.error(f"Error flushing location store: {e}")
+            if time.monotonic() - last_gc < self.STORE_GC_INTERVAL:
+                continue
+            last_gc = time.monotonic()
+            try:
+                swept = self._sweep_expired()
+                removed = await asyncio.to_thread(self.store.delete_expired)
+                if swept or removed:
+                    logger.info(f"Removed {swept} expired in-memory entries and {removed} expired location rows")
+            except Exception as e:
+                logger.error(f"Error cleaning up location store: {e}")
+    
+    async def close(self):
+        """Commit pending store writes and close the store (on shutdown)"""
+        try:
+            await asyncio.to_thread(self.store.close)
+        except Exception as e:
+            logger.error(f"Error closing location store: {e}")
+    
+    def _sweep_expired(self) -> int:
+        """Evict expired hot user locations and cached API responses, returning how many were dropped"""
+        now_ts = time.time()
+        expired_locations = [k for k, v in self.location_data.hot_items() if expiry_epoch(v) < now_ts]
+        for chat_id in expired_locations:
+            # Stored rows expire on their own via store.delete_expired
+            self.location_data.evict(chat_id)
+        return len(expired_locations) + self.cached_data.expire()
+    
+    def _store_user_location(self, chat_id: str, location_entry: dict):
+        """Store user location and bump its version so derived caches are invalidated"""
+        location_entry.update(location_radians(location_entry["latitude"], location_entry["longitude"]))
+        location_entry["version"] = next_location_version(self.location_data, chat_id)
+        self.location_data[chat_id] = location_entry
+    
+    def _lock(self, chat_id: str):
+        """Hold the lock serializing location updates of one chat (async context manager)"""
+        return self._chat_locks(chat_id)
     
     async def handle_location_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle location messages from users"""
@@ -82,6 +303,7 @@ class LocationFeatureHandler:
         
         chat_id = str(update.effective_chat.id)
         location = update.message.location
+        now = time.time()
         
         # Check if we're in favorite location mode
         if context.user_data and context.user_data.get('adding_favorite'):
@@ -107,19 +329,21 @@ class LocationFeatureHandler:
         if location_info is not None:
             city_name = location_info.get("city", "Noma'lum shahar")
         
-        self.location_data[chat_id] = {
-            "latitude": location.latitude,
-            "longitude": location.longitude,
-            "horizontal_accuracy": location.horizontal_accuracy,
-            "city": city_name,
-            "timestamp": datetime.now().isoformat(),
-            "expires_at": (datetime.now() + timedelta(hours=24)).isoformat()
-        }
-        
-        # Show detailed location information
-        await self.show_detailed_location_info(update, context, location, location_info, accuracy_message)
+        # Only the write and reply are serialized per chat; the lookup above runs unlocked
+        async with self._lock(chat_id):
+            self._store_user_location(chat_id, {
+                "latitude": location.latitude,
+                "longitude": location.longitude,
+                "horizontal_accuracy": location.horizontal_accuracy,
+                "city": city_name,
+                "timestamp": now,
+                "expires_at": now + LOCATION_TTL
+            })
+            
+            # Show detailed location information
+            await self.show_detailed_location_info(update, context, location, location_info, accuracy_message, now=now)
 
-    async def show_detailed_location_info(self, update: Update, context: ContextTypes.DEFAULT_TYPE, location, location_info, accuracy_message):
+    async def show_detailed_location_info(self, update: Update, context: ContextTypes.DEFAULT_TYPE, location, location_info, accuracy_message, now=None):
         """Show detailed information about the user's location"""
         # Format location details
         lat = location.latitude
@@ -132,66 +356,36 @@ class LocationFeatureHandler:
         state = location_info.get("state", "") if location_info else ""
         display_name = location_info.get("display_name", f"Koordinatalar: {lat:.4f}, {lon:.4f}") if location_info else f"Koordinatalar: {lat:.4f}, {lon:.4f}"
         
-        # Create detailed message with improved formatting
-        location_details = f"📍 <b>Sizning joylashuvingiz</b>\n"
-        location_details += "=" * 30 + "\n\n"
-        
-        location_details += f"🌍 <b>Geografik ma'lumotlar:</b>\n"
-        location_details += f"• <b>Kenglik (latitude):</b> {lat:.6f}\n"
-        location_details += f"• <b>Uzunlik (longitude):</b> {lon:.6f}\n"
-        location_details += f"• <b>Aniqlik:</b> {accuracy} metr\n\n"
-        
-        location_details += f"🏙️ <b>Manzil ma'lumotlari:</b>\n"
-        location_details += f"• <b>Shahar:</b> {city}\n"
-        if state:
-            location_details += f"• <b>Viloyat:</b> {state}\n"
-        location_details += f"• <b>Mamlakat:</b> {country}\n\n"
-        
-        location_details += f"📌 <b>To'liq manzil:</b>\n"
-        location_details += f"{display_name}\n\n"
-        
-        # Add accuracy warning if needed
-        if accuracy_message:
-            location_details += f"{accuracy_message}\n\n"
-        
-        location_details += "📋 <b>Mavjud xizmatlar:</b>\n"
-        location_details += "Endi quyidagi joylashuvga asoslangan xizmatlardan foydalanishingiz mumkin:\n"
-        location_details += "• 🕋 <b>Namoz vaqtlari</b> - Namoz vaqtlarini biling\n"
-        location_details += "• 📍 <b>Yaqin-atrofim</b> - Yonizdagi joylarni toping\n"
-        location_details += "• ⭐ <b>Sevimli joylarim</b> - O'z sevgan joylaringizni saqlang\n\n"
-        
-        # Add timestamp for freshness indicator
-        from datetime import datetime
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        location_details += f"🕒 <b>Ma'lumotlar yangilangan vaqti:</b> {timestamp}\n"
+        # Fill the pre-built message template in one pass
+        location_details = LOCATION_DETAILS_TMPL.format_map({
+            "lat": lat,
+            "lon": lon,
+            "accuracy": accuracy,
+            "city": city,
+            "state_block": f"• <b>Viloyat:</b> {state}\n" if state else "",
+            "country": country,
+            "display_name": display_name,
+            "accuracy_block": f"{accuracy_message}\n\n" if accuracy_message else "",
+            "timestamp": time.strftime(_TS_FMT, time.localtime(now))
+        })
         
         # Send location on map and detailed information
         if update.message:
-            # Send location on map
-            location_msg = Location(longitude=lon, latitude=lat)
-            await update.message.reply_location(location=location_msg)
+            # Pick the keyboard first; no services keyboard while a favorite is being added or named
+            reply_markup = None
+            if not (context.user_data and (context.user_data.get('adding_favorite') or context.user_data.get('awaiting_favorite_name'))):
+                reply_markup = _SERVICES_KB
             
-            # Check if we're in the middle of adding a favorite
-            if context.user_data and context.user_data.get('adding_favorite'):
-                # Don't show location services keyboard, just show the location info
-                await update.message.reply_text(
-                    location_details,
-                    parse_mode=ParseMode.HTML
-                )
-            elif context.user_data and context.user_data.get('awaiting_favorite_name'):
-                # We're waiting for the favorite name, don't show location services keyboard
-                await update.message.reply_text(
-                    location_details,
-                    parse_mode=ParseMode.HTML
-                )
-            else:
-                # Send detailed information with location services keyboard (without location input options)
-                from modules.utils import location_services_keyboard
-                await update.message.reply_text(
+            # Map pin and details are independent Bot API calls - send them concurrently
+            location_msg = Location(longitude=lon, latitude=lat)
+            await asyncio.gather(
+                update.message.reply_location(location=location_msg),
+                update.message.reply_text(
                     location_details,
                     parse_mode=ParseMode.HTML,
-                    reply_markup=location_services_keyboard()
+                    reply_markup=reply_markup
                 )
+            )
 
     async def handle_favorite_location(self, update: Update, context: ContextTypes.DEFAULT_TYPE, location):
         """Handle location for favorite creation"""
@@ -215,18 +409,13 @@ class LocationFeatureHandler:
         # Ask for favorite name
         context.user_data['awaiting_favorite_name'] = True
         # Remove the adding_favorite flag since we're now waiting for the name
-        if 'adding_favorite' in context.user_data:
-            del context.user_data['adding_favorite']
+        context.user_data.pop('adding_favorite', None)
         
         # Show simple keyboard with just the back option
         if update.message:
             await update.message.reply_text(
                 "⭐ Iltimos, ushbu joy uchun nom kiriting:",
-                reply_markup=ReplyKeyboardMarkup(
-                    [[KeyboardButton("⬅️ Orqaga")]],
-                    resize_keyboard=True,
-                    one_time_keyboard=True
-                )
+                reply_markup=_BACK_KB
             )
     
     async def handle_text_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -251,8 +440,7 @@ class LocationFeatureHandler:
             if text == "⬅️ Orqaga":
                 # Clear the state and show the favorites menu
                 del context.user_data['awaiting_favorite_name']
-                if 'temp_favorite_location' in context.user_data:
-                    del context.user_data['temp_favorite_location']
+                context.user_data.pop('temp_favorite_location', None)
                 await self.favorites_handler.show_favorites_menu(update, context)
                 return
             else:
@@ -268,53 +456,48 @@ class LocationFeatureHandler:
 
         
         # Handle location menu options
-        if text == "🏙️ Shahar bo'yicha qidirish":
-            await safe_reply(update, "🏙️ Iltimos, shahar nomini kiriting:")
-            # Check if user is in favorites flow
-            if context.user_data.get('adding_favorite'):
-                # User is in favorites flow, set the appropriate state
-                context.user_data['awaiting_favorite_location'] = True
-            else:
-                # User is in general location flow, set awaiting_city_name state
-                context.user_data['awaiting_city_name'] = True
-            return  # Important: return immediately after setting state
-        elif text == "🕋 Namoz vaqtlari":
-            await self.prayer_handler.show_prayer_times(update, context)
-            return
-        elif text == "📍 Yaqin-atrofim":
-            await self.nearby_handler.show_nearby_menu(update, context)
-            return
-        elif text == "⭐ Sevimli joylarim":
-            await self.favorites_handler.show_favorites_menu(update, context)
-            return
-        elif text == "⬅️ Orqaga":  # Added back button handling
-            from modules.utils import location_initial_keyboard
-            if update.message:
-                await update.message.reply_text(
-                    "🌍 <b>Joylashuv xizmatlari</b>",
-                    parse_mode=ParseMode.HTML,
-                    reply_markup=location_initial_keyboard()
-                )
-            return
-        elif text == "🏠 Bosh menyu":
-            from modules.utils import main_menu_keyboard
-            if update.message:
-                await update.message.reply_text(
-                    "🏠 <b>Bosh menyu</b>",
-                    parse_mode=ParseMode.HTML,
-                    reply_markup=main_menu_keyboard()
-                )
+        handler = self._text_dispatch.get(text)
+        if handler:
+            await handler(update, context)
             return
         
         # If we reach here, it's an unexpected text message in location context
         # Send a helpful message and show the location menu again
-        from modules.utils import location_initial_keyboard
         if update.message:
             await update.message.reply_text(
                 "❌ Kechirasiz, bu buyruq tushunarsiz.\n\n"
                 "Iltimos, quyidagi variantlardan birini tanlang:",
                 parse_mode=ParseMode.HTML,
-                reply_markup=location_initial_keyboard()
+                reply_markup=_MAIN_KB
+            )
+    
+    async def _prompt_city_name(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Ask for a city name and remember which flow it belongs to"""
+        await safe_reply(update, "🏙️ Iltimos, shahar nomini kiriting:")
+        # Check if user is in favorites flow
+        if context.user_data.get('adding_favorite'):
+            # User is in favorites flow, set the appropriate state
+            context.user_data['awaiting_favorite_location'] = True
+        else:
+            # User is in general location flow, set awaiting_city_name state
+            context.user_data['awaiting_city_name'] = True
+    
+    async def _show_location_start_menu(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Go back to the initial location keyboard"""
+        if update.message:
+            await update.message.reply_text(
+                "🌍 <b>Joylashuv xizmatlari</b>",
+                parse_mode=ParseMode.HTML,
+                reply_markup=_MAIN_KB
+            )
+    
+    async def _show_main_menu_keyboard(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Go back to the bot's main menu keyboard"""
+        if update.message:
+            await update.message.reply_text(
+                "🏠 <b>Bosh menyu</b>",
+                parse_mode=ParseMode.HTML,
+                reply_markup=_MAIN_MENU_KB
             )
     
     async def show_prayer_times(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -349,35 +532,41 @@ class LocationFeatureHandler:
             processing_msg = await safe_reply(update, "🏙️ Shahar qidirilmoqda...")
 
             # Using Nominatim for geocoding
+            started = time.monotonic()
             location_info = await self._get_location_info_by_name(cleaned_city)
+            lookup_was_slow = time.monotonic() - started > self.CITY_SEARCH_EDIT_AFTER
             
             if location_info:
-                # Store location with expiration
                 chat_id = str(update.effective_chat.id)
-                self.location_data[chat_id] = {
-                    "latitude": location_info["latitude"],
-                    "longitude": location_info["longitude"],
-                    "city": location_info.get("city", city_name) if location_info is not None else city_name,
-                    "timestamp": datetime.now().isoformat(),
-                    "expires_at": (datetime.now() + timedelta(hours=24)).isoformat()
-                }
+                now_ts = time.time()
+                async with self._lock(chat_id):
+                    # Store location with expiration
+                    self._store_user_location(chat_id, {
+                        "latitude": location_info["latitude"],
+                        "longitude": location_info["longitude"],
+                        "city": location_info.get("city", city_name) if location_info is not None else city_name,
+                        "timestamp": now_ts,
+                        "expires_at": now_ts + LOCATION_TTL
+                    })
                 
-                # Update processing message with more details
-                if processing_msg:
-                    state_text = location_info.get('state', "Noma'lum")
-                    await safe_edit_message(processing_msg, f"✅ {city_name} topildi!\n\n"
-                                                          f"🏙️ <b>Shahar:</b> {location_info['city']}\n"
-                                                          f"🌍 <b>Mamlakat:</b> {location_info['country']}\n"
-                                                          f"🏛️ <b>Viloyat:</b> {state_text}",
-                                                          parse_mode=ParseMode.HTML)
+                    # Slow lookups get the interim summary; fast ones drop the processing message
+                    # and go straight to the details, saving an edit round trip
+                    if processing_msg and not lookup_was_slow:
+                        try:
+                            await processing_msg.delete()
+                        except Exception as e:
+                            logger.warning(f"Could not delete city search message: {e}")
+                    elif processing_msg:
+                        state_text = location_info.get('state', "Noma'lum")
+                        await safe_edit_message(processing_msg, f"✅ {city_name} topildi!\n\n"
+                                                              f"🏙️ <b>Shahar:</b> {location_info['city']}\n"
+                                                              f"🌍 <b>Mamlakat:</b> {location_info['country']}\n"
+                                                              f"🏛️ <b>Viloyat:</b> {state_text}",
+                                                              parse_mode=ParseMode.HTML)
                 
-                # Show detailed location information for searched city
-                fake_location = type('Location', (), {
-                    'latitude': location_info["latitude"],
-                    'longitude': location_info["longitude"],
-                    'horizontal_accuracy': None
-                })()
-                await self.show_detailed_location_info(update, context, fake_location, location_info, "")
+                    # Show detailed location information for searched city
+                    fake_location = FakeLocation(location_info["latitude"], location_info["longitude"], None)
+                    await self.show_detailed_location_info(update, context, fake_location, location_info, "")
             else:
                 error_message = (f"❌ {city_name} topilmadi. Iltimos, boshqa nom kiriting.\n\n"
                                f"<i>Maslahatlar:</i>\n"
@@ -396,46 +585,137 @@ class LocationFeatureHandler:
             if update.effective_message:
                 await update.effective_message.reply_text(error_message, parse_mode=ParseMode.HTML)
     
+    def _geocode_cache_get(self, cache: OrderedDict, kind: str, key):
+        """Return a cached geocoding result if present and not expired"""
+        entry = cache.get(key)
+        if entry is None:
+            # Fall back to the persistent copy (e.g. after a restart)
+            try:
+                value = self.store.get_geocode(f"{kind}:{key}")
+            except Exception as e:
+                logger.error(f"Geocode store read failed: {e}")
+                value = None
+            if value is not None:
+                self._geocode_cache_remember(cache, key, value)
+            return value
+        stored_at, value = entry
+        if time.monotonic() - stored_at >= self.GEOCODE_CACHE_TTL:
+            del cache[key]
+            return None
+        cache.move_to_end(key)
+        return value
+    
+    def _geocode_cache_remember(self, cache: OrderedDict, key, value):
+        """Keep a geocoding result in memory, evicting the least recently used entries"""
+        cache[key] = (time.monotonic(), value)
+        cache.move_to_end(key)
+        while len(cache) > self.GEOCODE_CACHE_MAX:
+            cache.popitem(last=False)
+    
+    def _geocode_cache_put(self, cache: OrderedDict, kind: str, key, value):
+        """Store a geocoding result in memory and in the persistent store"""
+        self._geocode_cache_remember(cache, key, value)
+        try:
+            self.store.put_geocode(f"{kind}:{key}", value, self.GEOCODE_CACHE_TTL)
+        except Exception as e:
+            logger.error(f"Geocode store write failed: {e}")
+    
+    async def _coalesced(self, key, fetch):
+        """Run fetch() once per key; concurrent callers with the same key await the same result"""
+        pending = self._inflight.get(key)
+        if pending is not None:
+            # Shield so a cancelled waiter does not cancel the shared lookup
+            return await asyncio.shield(pending)
+        
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            result = await fetch()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Mark the exception as retrieved when nobody else is waiting on it
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            self._inflight.pop(key, None)
+    
+    async def _geo_request(self, key, fetch):
+        """Queue a Nominatim-bound fetch() for the paced worker and wait for its result"""
+        future = self._geo_queued.get(key)
+        if future is None:
+            if self._geo_worker_task is None or self._geo_worker_task.done():
+                self._geo_worker_task = asyncio.create_task(self._geo_worker())
+            future = asyncio.get_running_loop().create_future()
+            self._geo_queued[key] = future
+            self._geo_queue.put_nowait((key, future, fetch))
+        # Shield so one cancelled caller does not fail the request for the others
+        return await asyncio.shield(future)
+    
+    async def _geo_worker(self):
+        """Issue queued Nominatim requests one at a time, at most one per GEOCODE_MIN_INTERVAL"""
+        while True:
+            key, future, fetch = await self._geo_queue.get()
+            try:
+                result = await asyncio.wait_for(fetch(), self.GEOCODE_FETCH_TIMEOUT)
+            except Exception as e:
+                future.set_exception(e)
+                # Mark the exception as retrieved when every caller already gave up
+                future.exception()
+            else:
+                future.set_result(result)
+            finally:
+                self._geo_queued.pop(key, None)
+            await asyncio.sleep(self.GEOCODE_MIN_INTERVAL)
+    
+    async def _reverse_geocode(self, latitude: float, longitude: float, cache_key):
+        """Reverse-geocode coordinates, asking Places directly and pacing only Nominatim lookups"""
+        nominatim = self.geocoder
+        if isinstance(self.geocoder, PlacesBackend):
+            try:
+                location_info = await asyncio.wait_for(
+                    self.geocoder.reverse_places(latitude, longitude), self.GEOCODE_FETCH_TIMEOUT
+                )
+            except asyncio.TimeoutError:
+                logger.warning("Places reverse geocoding timed out, using fallback")
+                location_info = None
+            if location_info:
+                return location_info
+            nominatim = self.geocoder.fallback
+        return await self._geo_request(
+            ("reverse", cache_key), lambda: nominatim.reverse(latitude, longitude)
+        )
+    
     async def _get_location_info(self, latitude: float, longitude: float):
         """Get location information using Nominatim"""
+        cache_key = cell_key(latitude, longitude, Config.GEOCODE_S2_LEVEL)
+        cached = self._geocode_cache_get(self._reverse_cache, "reverse", cache_key)
+        if cached is not None:
+            return dict(cached, latitude=latitude, longitude=longitude)
+        
+        location_info = await self._coalesced(
+            ("reverse", cache_key),
+            lambda: self._fetch_location_info(latitude, longitude, cache_key)
+        )
+        if location_info is not None:
+            # Coalesced callers may sit elsewhere in the same cell - keep their own coordinates
+            location_info = dict(location_info, latitude=latitude, longitude=longitude)
+        return location_info
+    
+    async def _fetch_location_info(self, latitude: float, longitude: float, cache_key):
+        """Reverse-geocode coordinates with the configured backend and cache successful results"""
         try:
-            NOMINATIM_URL = "https://nominatim.openstreetmap.org"
-            
-            url = f"{NOMINATIM_URL}/reverse"
-            params = {
-                "format": "json",
-                "lat": latitude,
-                "lon": longitude,
-                "accept-language": "uz"
-            }
-            
-            headers = {
-                "User-Agent": "AQLJON-bot/1.0 (https://t.me/AQLJON_bot)"
-            }
-            
-            data = await http_get_with_retry(url, params=params, headers=headers, timeout=15)
-            if data:
-                address = data.get("address", {})
-
-                city = (address.get("city") or
-                       address.get("town") or
-                       address.get("village") or
-                       "Noma'lum shahar")
-
-                country = address.get("country", "Noma'lum mamlakat")
-                state = address.get("state", "")
-                display_name = data.get("display_name", "Noma'lum joylashuv")
-
-                return {
-                    "city": city,
-                    "country": country,
-                    "state": state,
-                    "display_name": display_name,
-                    "latitude": latitude,
-                    "longitude": longitude
-                }
+            location_info = await self._reverse_geocode(latitude, longitude, cache_key)
+            if location_info:
+                self._geocode_cache_put(self._reverse_cache, "reverse", cache_key, location_info)
+                return location_info
         except Exception as e:
-            logger.error(f"Nominatimdan joylashuv ma'lumotlarini olishda xatolik: {e}")
+            logger.error(f"Joylashuv ma'lumotlarini olishda xatolik: {e}")
             return {
                 "city": "Noma'lum shahar",
                 "country": "Noma'lum mamlakat",
@@ -447,52 +727,25 @@ class LocationFeatureHandler:
     
     async def _get_location_info_by_name(self, city_name: str):
         """Get location information by city name using Nominatim"""
+        cache_key = " ".join(city_name.split()).casefold()  # "  TOSHKENT " and "toshkent" share an entry
+        cached = self._geocode_cache_get(self._search_cache, "search", cache_key)
+        if cached is not None:
+            return cached
+        
+        return await self._coalesced(
+            ("search", cache_key),
+            lambda: self._fetch_location_info_by_name(city_name, cache_key)
+        )
+    
+    async def _fetch_location_info_by_name(self, city_name: str, cache_key: str):
+        """Forward-geocode a city name with the configured backend and cache successful results"""
         try:
-            NOMINATIM_URL = "https://nominatim.openstreetmap.org"
-            
-            url = f"{NOMINATIM_URL}/search"
-            params = {
-                "format": "json",
-                "q": city_name,
-                "addressdetails": 1,
-                "limit": 5
-            }
-            
-            headers = {
-                "User-Agent": "AQLJON-bot/1.0 (https://t.me/AQLJON_bot)"
-            }
-            
-            data = await http_get_with_retry(url, params=params, headers=headers, timeout=15)
-            if data and len(data) > 0:
-                # Get the most relevant result
-                location = data[0]
-                lat = float(location["lat"])
-                lon = float(location["lon"])
-
-                # Validate coordinates
-                if not validate_coordinates(lat, lon):
-                    logger.error(f"Invalid coordinates from Nominatim: {lat}, {lon}")
-                    return None
-
-                address = location.get("address", {})
-                city = (address.get("city") or
-                       address.get("town") or
-                       address.get("village") or
-                       city_name)
-
-                country = address.get("country", "Noma'lum mamlakat")
-                state = address.get("state", "")
-
-                return {
-                    "city": city,
-                    "country": country,
-                    "state": state,
-                    "display_name": location.get("display_name", city_name),
-                    "latitude": lat,
-                    "longitude": lon
-                }
+            location_info = await self._geo_request(("search", cache_key), lambda: self.geocoder.search(city_name))
+            if location_info:
+                self._geocode_cache_put(self._search_cache, "search", cache_key, location_info)
+                return location_info
         except Exception as e:
-            logger.error(f"Nominatimdan shahar ma'lumotlarini olishda xatolik: {e}")
+            logger.error(f"Shahar ma'lumotlarini olishda xatolik: {e}")
             return {
                 "city": "Noma'lum shahar",
                 "country": "Noma'lum mamlakat",
@@ -516,190 +769,203 @@ class LocationFeatureHandler:
         if context.user_data is None:
             context.user_data = {}
         
+        # Interned so the exact lookup below compares against the literal keys by identity
+        data = sys.intern(query.data) if query.data else ""
+        handler, args = None, ()
+        
+        # Exact callbacks (menus, buttons without arguments) skip the trie walk
+        exact_handler = self._callback_dispatch.get(data)
+        if exact_handler:
+            handler = exact_handler
+        
+        # Compact favorites tokens (e.g. fv3, fx0, fp2)
+        elif data[:2] in FAV_CB_ACTIONS and data[2:].isdigit():
+            handler, args = self._fav_item_dispatch[FAV_CB_ACTIONS[data[:2]]], (int(data[2:]),)
+        
+        # Exact and parameterized callbacks through the token trie
+        else:
+            route = self._route_callback(data)
+            if route:
+                handler, args = route
+        
+        if handler is None:
+            return
+        
+        # Handlers send several messages, so they are not re-run here - flood waits are already
+        # retried per request by the application's AIORateLimiter. This runs in a detached task
+        # (see concurrent_callback_handler), so nothing may escape: the error handler never sees it
         try:
-            # Handle different callback actions
-            if query.data == "prayer_refresh":
-                await self.prayer_handler.show_prayer_times(update, context)
-            elif query.data == "location_search":
-                # Prompt for city name
-                if query.message:
-                    await safe_edit_message(query.message, "🏙️ Iltimos, shahar nomini kiriting:")
-                context.user_data['awaiting_city_name'] = True
-            
-            # Nearby places handling
-            elif query.data == "nearby_menu":
-                await self.nearby_handler.show_nearby_menu(update, context)
-            elif query.data and query.data.startswith("nearby_page_"):
-                try:
-                    page_num = int(query.data.split("_")[-1])
-                    await self.nearby_handler.show_nearby_menu(update, context, page=page_num)
-                except (ValueError, IndexError):
-                    await query.answer("❌ Noto'g'ri sahifa", show_alert=True)
-            elif query.data and query.data.startswith("nearby_"):
-                parts = query.data.split("_")
-                if len(parts) >= 2:
-                    # Handle different callback patterns more precisely
-                    if len(parts) >= 4 and parts[0] == "nearby" and parts[1] == "detail":
-                        # Format: nearby_detail_{place_type}_{place_index} or nearby_detail_{part1}_{part2}_{place_index}
-                        # Extract place_type and place_index
-                        if len(parts) == 5:  # nearby_detail_fast_food_0
-                            detail_place_type = f"{parts[2]}_{parts[3]}"
-                            place_index = int(parts[4]) if parts[4].isdigit() else 0
-                        else:  # nearby_detail_cafe_0
-                            detail_place_type = parts[2]
-                            place_index = int(parts[3]) if parts[3].isdigit() else 0
-                        await self.nearby_handler.show_place_detail(update, context, detail_place_type, place_index)
-                    elif len(parts) >= 4 and parts[0] == "nearby" and parts[1] == "map":
-                        # Format: nearby_map_{place_type}_{place_index}
-                        if len(parts) == 5:  # nearby_map_fast_food_0
-                            map_place_type = f"{parts[2]}_{parts[3]}"
-                            place_index = int(parts[4]) if parts[4].isdigit() else 0
-                        else:  # nearby_map_cafe_0
-                            map_place_type = parts[2]
-                            place_index = int(parts[3]) if parts[3].isdigit() else 0
-                        await self.nearby_handler.show_place_map(update, context, map_place_type, place_index)
-                    elif len(parts) >= 4 and parts[0] == "nearby" and parts[1] == "directions":
-                        # Format: nearby_directions_{place_type}_{place_index}
-                        if len(parts) == 5:  # nearby_directions_fast_food_0
-                            directions_place_type = f"{parts[2]}_{parts[3]}"
-                            place_index = int(parts[4]) if parts[4].isdigit() else 0
-                        else:  # nearby_directions_cafe_0
-                            directions_place_type = parts[2]
-                            place_index = int(parts[3]) if parts[3].isdigit() else 0
-                        await self.nearby_handler.show_directions(update, context, directions_place_type, place_index)
-                    elif len(parts) >= 2 and parts[0] == "nearby" and parts[1] not in ["page", "menu", "info", "search"]:
-                        # This is a place type selection or pagination for specific place types
-                        # Check if it's pagination: nearby_{place_type}_{page}
-                        if len(parts) >= 3 and parts[-1].isdigit():
-                            # Format: nearby_{place_type}_{page}
-                            if len(parts) == 3:  # nearby_fast_food_2
-                                place_type = parts[1]
-                                page = int(parts[2]) if parts[2].isdigit() else 1
-                            else:  # Handle cases with underscores like nearby_fast_food_2
-                                # Combine all middle parts as place_type except the last digit part
-                                place_type = "_".join(parts[1:-1])
-                                page = int(parts[-1]) if parts[-1].isdigit() else 1
-                            await self.nearby_handler.search_nearby_places(update, context, place_type, page)
-                        else:
-                            # This is a place type selection, could be with underscores
-                            # Format: nearby_fast_food or nearby_cafe
-                            place_type = "_".join(parts[1:])  # Join all parts after "nearby" with underscores
-                                
-                            if place_type in ["cafe", "restaurant", "pizza", "fast_food", "confectionery", "tea_shop", 
-                                            "bakery", "takeaway", "grocery", "marketplace", "supermarket", "books", 
-                                            "clothes", "electronics", "bank", "hairdresser", "mobile_phone_repair", 
-                                            "fuel", "car_service", "post_office", "doctor", "pharmacy", "hotel", 
-                                            "school", "university", "bus_stop", "train_station", "aerodrome", 
-                                            "taxi_stand", "bicycle_rental"]:
-                                await self.nearby_handler.search_nearby_places(update, context, place_type, 1)
-                    elif len(parts) >= 3 and parts[1] == "page":
-                        # Handle pagination: nearby_page_2
-                        page_num = int(parts[2]) if len(parts) > 2 and parts[2].isdigit() else 1
-                        await self.nearby_handler.show_nearby_menu(update, context, page=page_num)
-                    elif parts[1] == "menu":
-                        # Back to nearby menu
-                        await self.nearby_handler.show_nearby_menu(update, context)
-                    elif parts[1] == "info":
-                        await query.answer("Sahifa raqami", show_alert=False)
-                    elif len(parts) >= 3 and parts[1] == "search":
-                        # Handle search with place type and page
-                        search_place_type = parts[2]
-                        page = 1
-                        if len(parts) > 3 and parts[3].isdigit():
-                            page = int(parts[3])
-                        await self.nearby_handler.search_nearby_places(update, context, search_place_type, page)
-            
-            # Favorites handling
-            elif query.data == "favorites_add":
-                await self.favorites_handler.add_favorite(update, context)
-            elif query.data == "favorites_list":
-                await self.favorites_handler.list_favorites(update, context)
-            elif query.data == "favorites_delete":
-                await self.favorites_handler.delete_favorite_menu(update, context)
-            elif query.data == "favorites_menu":
-                await self.favorites_handler.show_favorites_menu(update, context)
-            elif query.data == "favorites_stats":
-                await self.favorites_handler.show_statistics(update, context)
-            elif query.data and query.data.startswith("favorites_"):
-                parts = query.data.split("_")
-                if len(parts) >= 3:
-                    action = parts[1]
-                    
-                    if action == "view":
-                        index = int(parts[2]) if parts[2].isdigit() else 0
-                        await self.favorites_handler.view_favorite(update, context, index)
-                    elif action == "map":
-                        index = int(parts[2]) if parts[2].isdigit() else 0
-                        await self.favorites_handler.show_map(update, context, index)
-                    elif action == "directions":
-                        index = int(parts[2]) if parts[2].isdigit() else 0
-                        await self.favorites_handler.show_directions(update, context, index)
-                    elif action == "delete" and len(parts) >= 4:
-                        # Handle delete actions with proper index parsing
-                        if parts[2] == "confirm":
-                            index = int(parts[3]) if parts[3].isdigit() else 0
-                            await self.favorites_handler.confirm_delete(update, context, index)
-                        elif parts[2] == "final":
-                            index = int(parts[3]) if parts[3].isdigit() else 0
-                            await self.favorites_handler.delete_favorite(update, context, index)
-                    elif action == "page":
-                        # Handle pagination for favorites
-                        page = int(parts[2]) if parts[2].isdigit() else 1
-                        await self.favorites_handler.list_favorites(update, context, page)
-                    elif action in ["add", "list", "menu", "stats"]:
-                        # Handle simple favorites actions
-                        if action == "add":
-                            await self.favorites_handler.add_favorite(update, context)
-                        elif action == "list":
-                            await self.favorites_handler.list_favorites(update, context)
-                        elif action == "menu":
-                            await self.favorites_handler.show_favorites_menu(update, context)
-                        elif action == "stats":
-                            await self.favorites_handler.show_statistics(update, context)
-            
-            # Location menu handling
-            elif query.data == "location_menu":
-                # Show location services keyboard
-                from modules.utils import location_services_keyboard
-                if query.message:
-                    await safe_edit_message(
-                        query.message,
-                        "🌍 <b>Joylashuv xizmatlari</b>\n\n"
-                        "Endi quyidagi joylashuv xizmatlaridan foydalanishingiz mumkin:",
-                        parse_mode=ParseMode.HTML
-                    )
-                # Send location services keyboard separately
-                if update.effective_message:
-                    await update.effective_message.reply_text(
-                        "Joylashuv xizmatlari", 
-                        reply_markup=location_services_keyboard()
-                    )
-            
-            # Main menu
-            elif query.data == "main_menu":
-                from modules.utils import main_menu_keyboard
-                if query.message:
-                    await safe_edit_message(
-                        query.message,
-                        "🏠 <b>Bosh menyu</b>",
-                        parse_mode=ParseMode.HTML
-                    )
-                # Send main menu keyboard separately
-                if update.effective_message:
-                    await update.effective_message.reply_text(
-                        "Bosh menyu", 
-                        reply_markup=main_menu_keyboard()
-                    )
-            
-        except Exception as e:
-            logger.error(f"Callback query handlingda xatolik: {e}")
-            await query.answer("❌ Xatolik yuz berdi. Qaytadan urinib ko'ring.", show_alert=True)
+            await handler(update, context, *args)
+        except (TimedOut, RetryAfter, aiohttp.ClientError) as e:
+            logger.error(f"Callback query handlingda xatolik: data={data!r} chat={update.effective_chat.id if update.effective_chat else None} error={e!r}")
+            await self._report_callback_error(query)
+        except Exception:
+            logger.exception(f"Callback query handlerida kutilmagan xatolik: data={data!r}")
+            await self._report_callback_error(query)
+    
+    async def _report_callback_error(self, query):
+        """Tell the user a callback failed (the query was already answered, so as a message)"""
+        if not query.message:
+            return
+        try:
+            await query.message.reply_text("❌ Xatolik yuz berdi. Qaytadan urinib ko'ring.")
+        except TelegramError as reply_error:
+            logger.error(f"Xatolik xabarini yuborib bo'lmadi: {reply_error}")
+    
+    def _build_callback_trie(self) -> dict:
+        """Build the callback_data trie from the exact and prefix tables, one level per '_' token"""
+        root = {}
+        for data, handler in self._callback_dispatch.items():
+            node = root
+            for token in data.split("_"):
+                node = node.setdefault(token, {})
+            node[_CB_EXACT] = handler
+        for prefix, handler in self._param_cb.items():
+            root.setdefault(prefix, {})[_CB_PARAM] = handler
+        return root
+    
+    def _route_callback(self, data: str):
+        """
+        Walk the callback trie with str.partition
+        
+        Returns (handler, extra_args): an exact match wins, otherwise the deepest
+        prefix handler gets the unconsumed tail. None when nothing matches.
+        """
+        node = self._cb_root
+        fallback = None
+        rest = data
+        while True:
+            param = node.get(_CB_PARAM)
+            if param is not None:
+                fallback = (param, (rest,))
+            head, sep, rest = rest.partition("_")
+            node = node.get(head)
+            if node is None:
+                return fallback
+            if not sep:
+                if _CB_EXACT in node:
+                    return node[_CB_EXACT], ()
+                param = node.get(_CB_PARAM)
+                return (param, ("",)) if param is not None else fallback
+    
+    @staticmethod
+    def _safe_int(value: str, default: int = 0) -> int:
+        """Parse an index/page from callback_data, falling back to default"""
+        try:
+            return int(value)
+        except (ValueError, TypeError):
+            return default
+    
+    async def _handle_nearby_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE, tail: str):
+        """Handle nearby_[{action}_]{place_type}[_{number}] callbacks"""
+        head, _, rest = tail.partition("_")
+        if head == "search":
+            # nearby_search_{place_type}[_{page}]
+            match = _CB_RE.match(rest)
+            if match and not match.group(1):
+                await self.nearby_handler.search_nearby_places(update, context, match.group("type"), int(match.group("page") or 1))
+            return
+        
+        match = _CB_RE.match(tail)
+        if not match:
+            return
+        
+        action, place_type, number = match.group(1), match.group("type"), match.group("page")
+        if action:
+            if number is not None:
+                await self._nearby_item_dispatch[action](update, context, place_type, int(number))
+        elif place_type in NEARBY_PLACE_TYPES:
+            await self.nearby_handler.search_nearby_places(update, context, place_type, int(number or 1))
+        elif place_type == "page":
+            await self.nearby_handler.show_nearby_menu(update, context, page=int(number or 1))
+        elif place_type == "info":
+            await update.callback_query.answer("Sahifa raqami", show_alert=False)
+    
+    async def _handle_favorites_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE, tail: str):
+        """Handle long-form favorites_{action}_{...} callbacks still sent by buttons in older messages"""
+        action, _, rest = tail.partition("_")
+        if not rest:
+            return
+        
+        if item_action := FAV_LEGACY_ACTIONS.get(action):
+            await self._fav_item_dispatch[item_action](update, context, self._safe_int(rest))
+        elif action == "delete" and "_" in rest:
+            # favorites_delete_{confirm|final|page}_{number}
+            step, _, number = rest.partition("_")
+            if step == "confirm":
+                await self.favorites_handler.confirm_delete(update, context, self._safe_int(number))
+            elif step == "final":
+                await self.favorites_handler.delete_favorite(update, context, self._safe_int(number))
+            elif step == "page":
+                await self.favorites_handler.delete_favorite_menu(update, context, self._safe_int(number, 1))
+        elif action == "page":
+            await self.favorites_handler.list_favorites(update, context, self._safe_int(rest, 1))
+        elif simple_handler := self._fav_simple.get(action):
+            await simple_handler(update, context)
+    
+    async def _prompt_city_name_inline(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Prompt for city name from an inline button"""
+        query = update.callback_query
+        if query.message:
+            await safe_edit_message(query.message, "🏙️ Iltimos, shahar nomini kiriting:")
+        context.user_data['awaiting_city_name'] = True
+    
+    async def _show_location_menu(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Show location services keyboard from an inline button"""
+        qmsg = update.callback_query.message
+        msg = update.effective_message
+        # The edit and the keyboard message are independent - send them concurrently
+        sends = []
+        if qmsg:
+            sends.append(safe_edit_message(
+                qmsg,
+                "🌍 <b>Joylashuv xizmatlari</b>\n\n"
+                "Endi quyidagi joylashuv xizmatlaridan foydalanishingiz mumkin:",
+                parse_mode=ParseMode.HTML
+            ))
+        # Send location services keyboard separately
+        if msg:
+            sends.append(msg.reply_text(
+                "Joylashuv xizmatlari", 
+                reply_markup=_SERVICES_KB
+            ))
+        await asyncio.gather(*sends)
+    
+    async def _show_main_menu(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Show main menu keyboard from an inline button"""
+        qmsg = update.callback_query.message
+        msg = update.effective_message
+        # The edit and the keyboard message are independent - send them concurrently
+        sends = []
+        if qmsg:
+            sends.append(safe_edit_message(
+                qmsg,
+                "🏠 <b>Bosh menyu</b>",
+                parse_mode=ParseMode.HTML
+            ))
+        # Send main menu keyboard separately
+        if msg:
+            sends.append(msg.reply_text(
+                "Bosh menyu", 
+                reply_markup=_MAIN_MENU_KB
+            ))
+        await asyncio.gather(*sends)
 
+    @staticmethod
+    def _clear_favorite_flow_state(user_data: dict):
+        """Drop every add-favorite flow key so stale flags don't linger in user_data"""
+        for key in FAVORITE_FLOW_KEYS:
+            user_data.pop(key, None)
+    
     async def handle_favorite_city_search(self, update: Update, context: ContextTypes.DEFAULT_TYPE, city_name: str):
         """Handle city search for favorite location"""
         if not update.effective_chat:
             return
         
+        user_data = context.user_data if context.user_data is not None else {}
+        context.user_data = user_data
+        message = update.effective_message
+        
         try:
             # Show processing message
             processing_msg = await safe_reply(update, "🏙️ Shahar qidirilmoqda...")
@@ -709,13 +975,11 @@ class LocationFeatureHandler:
             
             if location_info:
                 # Store temporary location info
-                chat_id = str(update.effective_chat.id)
-                if context.user_data is None:
-                    context.user_data = {}
-                context.user_data['temp_favorite_location'] = {
+                city = location_info.get("city", city_name)
+                user_data['temp_favorite_location'] = {
                     "latitude": location_info["latitude"],
                     "longitude": location_info["longitude"],
-                    "city": location_info.get("city", city_name) if location_info is not None else city_name,
+                    "city": city,
                     "timestamp": datetime.now().isoformat()
                 }
                 
@@ -724,26 +988,19 @@ class LocationFeatureHandler:
                     await safe_edit_message(processing_msg, f"✅ {city_name} topildi!")
                 
                 # Automatically use city name as favorite name instead of asking user
-                favorite_name = location_info.get("city", city_name) if location_info is not None else city_name
-                await self.save_favorite_with_location(update, context, favorite_name)
-                
-                # Remove the adding_favorite and awaiting_favorite_location flags
-                if 'adding_favorite' in context.user_data:
-                    del context.user_data['adding_favorite']
-                if 'awaiting_favorite_location' in context.user_data:
-                    del context.user_data['awaiting_favorite_location']
-                
-    
+                await self.save_favorite_with_location(update, context, city)
             else:
                 if processing_msg:
                     await safe_edit_message(processing_msg, f"❌ {city_name} topilmadi. Iltimos, boshqa nom kiriting.")
                 else:
-                    if update.effective_message:
-                        await update.effective_message.reply_text(f"❌ {city_name} topilmadi. Iltimos, boshqa nom kiriting.")
+                    if message:
+                        await message.reply_text(f"❌ {city_name} topilmadi. Iltimos, boshqa nom kiriting.")
         except Exception as e:
             logger.error(f"Shahar qidirishda xatolik: {e}")
-            if update.effective_message:
-                await update.effective_message.reply_text("❌ Shahar qidirishda xatolik. Qaytadan urinib ko'ring.")
+            if message:
+                await message.reply_text("❌ Shahar qidirishda xatolik. Qaytadan urinib ko'ring.")
+        finally:
+            self._clear_favorite_flow_state(user_data)
 
     async def save_favorite_with_location(self, update: Update, context: ContextTypes.DEFAULT_TYPE, favorite_name: str):
         """Save a new favorite place with location"""
@@ -751,48 +1008,43 @@ class LocationFeatureHandler:
             return
             
         chat_id = str(update.effective_chat.id)
+        user_data = context.user_data if context.user_data is not None else {}
+        context.user_data = user_data
+        message = update.effective_message
         
-        # Check if we have temporary location info
-        if context.user_data is None or 'temp_favorite_location' not in context.user_data:
-            if update.effective_message:
-                await update.effective_message.reply_text("❌ Xatolik yuz berdi. Iltimos, qaytadan urinib ko'ring.")
+        # Take the temporary location info; whatever happens next, the add-favorite flow ends here
+        location_info = user_data.pop('temp_favorite_location', None)
+        self._clear_favorite_flow_state(user_data)
+        if location_info is None:
+            if message:
+                await message.reply_text("❌ Xatolik yuz berdi. Iltimos, qaytadan urinib ko'ring.")
             return
         
-        # Get location info
-        location_info = context.user_data['temp_favorite_location']
-        del context.user_data['temp_favorite_location']
-        
-        # Create favorite object
-        favorite = {
-            "id": f"fav_{int(datetime.now().timestamp())}",
-            "name": favorite_name,
-            "latitude": location_info["latitude"],
-            "longitude": location_info["longitude"],
-            "created_at": datetime.now().isoformat(),
-            "category": "Umumiy",
-            "notes": ""
-        }
+        # Create favorite object (id and created_at come from the same clock reading)
+        now = datetime.now()
+        favorite = Favorite(
+            id=f"fav_{int(now.timestamp())}",
+            name=favorite_name,
+            latitude=location_info["latitude"],
+            longitude=location_info["longitude"],
+            created_at=now.isoformat(),
+            category="Umumiy",
+            notes=""
+        )
         
         # Store favorite
-        if chat_id not in self.user_favorites:
-            self.user_favorites[chat_id] = []
-        self.user_favorites[chat_id].append(favorite)
+        self.user_favorites.setdefault(chat_id, []).append(favorite)
+        self._persist_favorites(chat_id)
         
         # Send confirmation with detailed location info
         lat = location_info["latitude"]
         lon = location_info["longitude"]
         city = location_info.get("city", "Noma'lum shahar")
         
-        confirmation_message = f"✅ <b>Sevimli joyingiz saqlandi!</b>\n\n"
-        confirmation_message += f"⭐ <b>Nom:</b> {favorite_name}\n"
-        confirmation_message += f"🏙️ <b>Shahar:</b> {city}\n"
-        confirmation_message += f"📍 <b>Koordinatalar:</b>\n"
-        confirmation_message += f"• <b>Kenglik:</b> {lat:.6f}\n"
-        confirmation_message += f"• <b>Uzunlik:</b> {lon:.6f}\n\n"
-        confirmation_message += "Endi bu joyga tezda qaytish uchun 'Sevimli joylarim' menyusidan foydalanishingiz mumkin."
+        confirmation_message = FAV_CONFIRM_TMPL.format(name=favorite_name, city=city, lat=lat, lon=lon)
         
-        if update.effective_message:
-            await update.effective_message.reply_text(
+        if message:
+            await message.reply_text(
                 confirmation_message,
                 parse_mode=ParseMode.HTML
             )
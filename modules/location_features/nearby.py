@@ -1,146 +1,575 @@
+"""
+Nearby places for location features
+Searches OpenStreetMap through Overpass; edits and replies rely on the bot's AIORateLimiter (see main.py) for Telegram flood control
+"""
+import asyncio
+import functools
 import logging
-from datetime import datetime, timedelta
+import math
+import time
+from typing import Optional
+import aiohttp
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, Location
 from telegram.ext import ContextTypes
 from telegram.constants import ParseMode
+from telegram.error import BadRequest
 from modules.utils import safe_reply
 from modules.retry_utils import http_post_with_retry
-from modules.location_features.utils import calculate_distance
+from modules.location_features.utils import calculate_distances_batch, distance_from_location, NUMPY_AVAILABLE, SEPARATOR
+from .store import TTLCache, expiry_epoch
+
+if NUMPY_AVAILABLE:
+    import numpy as np
 
 logger = logging.getLogger(__name__)
 
+
+# Nearby categories (button label, callback data) - exactly 30 categories, 10 per menu page
+_CATEGORIES: tuple[tuple[str, str], ...] = (
+    # Page 1 - Food & Dining (10 categories)
+    ("☕ Kafelar", "nearby_cafe"),
+    ("🍽️ Restoranlar", "nearby_restaurant"),
+    ("🍕 Pitsa do'konlar", "nearby_pizza"),
+    ("🍔 Fast food", "nearby_fast_food"),
+    ("🍦 Shirinliklar", "nearby_confectionery"),
+    ("🧋 Choyxonalar", "nearby_tea_shop"),
+    ("🍞 Non do'konlari", "nearby_bakery"),
+    ("🥡 Takeaway", "nearby_takeaway"),
+    ("🛒 Oziq-ovqat do'konlari", "nearby_grocery"),
+    ("🏪 Bozorlar", "nearby_marketplace"),
+
+    # Page 2 - Shopping & Services (10 categories)
+    ("🏪 Supermarketlar", "nearby_supermarket"),
+    ("👕 Kiyim do'konlari", "nearby_clothes"),
+    ("💻 Elektronika do'konlari", "nearby_electronics"),
+    ("📚 Kitob do'konlari", "nearby_books"),
+    ("🏦 Banklar", "nearby_bank"),
+    ("💇 Salonlar", "nearby_hairdresser"),
+    ("📱 Mobil telefon ustalari", "nearby_mobile_phone_repair"),
+    ("⛽ Avto zapravkalar", "nearby_fuel"),
+    ("🚗 Avtoservis", "nearby_car_service"),
+    ("📦 Pochta", "nearby_post_office"),
+
+    # Page 3 - Health, Education & Transportation (10 categories)
+    ("🏥 Shifokorlar/Klinika", "nearby_doctor"),
+    ("⚕️ Dorixonalar", "nearby_pharmacy"),
+    ("🏨 Mehmonxonalar", "nearby_hotel"),
+    ("🏫 Maktablar", "nearby_school"),
+    ("🏢 Universitetlar", "nearby_university"),
+    ("🚌 Avtobus bekati", "nearby_bus_stop"),
+    ("🚉 Temir yo'l stansiyasi", "nearby_train_station"),
+    ("✈️ Aeroportlar", "nearby_aerodrome"),
+    ("🚖 Taksi turargohi", "nearby_taxi_stand"),
+    ("🚲 Velosiped ijarasi", "nearby_bicycle_rental"),
+)
+
+_PAGE_SLICES = [_CATEGORIES[0:10], _CATEGORIES[10:20], _CATEGORIES[20:30]]
+_MENU_GROUPS = ("Food & Dining", "Shopping & Services", "Health, Education & Transportation")
+_MENU_TOTAL_PAGES = len(_PAGE_SLICES)
+
+
+def _build_menu_page(page: int) -> tuple[str, InlineKeyboardMarkup]:
+    """Text and keyboard of one nearby category menu page (1-based)"""
+    page_categories = _PAGE_SLICES[page - 1]
+
+    message_text = (
+        "📍 <b>Yaqin-atrofdagi joylar</b>\n"
+        "==============================\n\n"
+        "<i>Qaysi turdagi joylarni qidirmoqchisiz?</i>\n\n"
+        f"🔷 <b>{_MENU_GROUPS[page - 1]}:</b>\n"
+        + "".join(f"   • {category_name}\n" for category_name, _ in page_categories)
+        + "\n"
+        f"🔷 <b>Jami kategoriyalar:</b> {len(_CATEGORIES)}\n"
+        f"📄 <b>Jami sahifalar:</b> {_MENU_TOTAL_PAGES}\n\n"
+    )
+
+    # Category buttons (2 per row)
+    keyboard = [
+        [InlineKeyboardButton(name, callback_data=data) for name, data in page_categories[i:i + 2]]
+        for i in range(0, len(page_categories), 2)
+    ]
+
+    # Pagination controls
+    pagination_row = []
+    if page > 1:
+        pagination_row.append(InlineKeyboardButton("⬅️ Oldingi", callback_data=f"nearby_page_{page-1}"))
+    pagination_row.append(InlineKeyboardButton(f"{page}/{_MENU_TOTAL_PAGES}", callback_data="nearby_info"))
+    if page < _MENU_TOTAL_PAGES:
+        pagination_row.append(InlineKeyboardButton("Keyingi ➡️", callback_data=f"nearby_page_{page+1}"))
+    keyboard.append(pagination_row)
+
+    # Back to main menu
+    keyboard.append([InlineKeyboardButton("🏠 Bosh menyu", callback_data="nearby_menu")])
+
+    return message_text, InlineKeyboardMarkup(keyboard)
+
+
+# Built once at import - the menu never changes
+_MENU_PAGES: dict[int, tuple[str, InlineKeyboardMarkup]] = {
+    page: _build_menu_page(page) for page in range(1, _MENU_TOTAL_PAGES + 1)
+}
+
+# Map place types to display names - all 30 categories
+_PLACE_NAMES: dict[str, str] = {
+    "cafe": "Kafelar",
+    "restaurant": "Restoranlar",
+    "pizza": "Pitsa do'konlar",
+    "fast_food": "Fast food",
+    "confectionery": "Shirinliklar",
+    "tea_shop": "Choyxonalar",
+    "bakery": "Non do'konlari",
+    "takeaway": "Ovqat olib ketish",
+    "grocery": "Oziq-ovqat do'konlari",
+    "marketplace": "Bozorlar",
+    "supermarket": "Supermarketlar",
+    "clothes": "Kiyim do'konlari",
+    "electronics": "Elektronika do'konlari",
+    "books": "Kitob do'konlari",
+    "bank": "Banklar",
+    "hairdresser": "Salonlar",
+    "mobile_phone_repair": "Mobil telefon ustalari",
+    "fuel": "Avto zapravkalar",
+    "car_service": "Avtoservis",
+    "post_office": "Pochta",
+    "doctor": "Shifokorlar/Klinika",
+    "pharmacy": "Dorixonalar",
+    "hotel": "Mehmonxonalar",
+    "school": "Maktablar",
+    "university": "Universitetlar",
+    "bus_stop": "Avtobus bekati",
+    "train_station": "Temir yo'l stansiyasi",
+    "aerodrome": "Aeroportlar",
+    "taxi_stand": "Taksi turargohi",
+    "bicycle_rental": "Velosiped ijarasi",
+}
+
+# OSM tag filters per place type - only the tags that actually carry it, instead of trying
+# amenity/shop/tourism for every type
+_OVERPASS_KINDS: dict[str, tuple[tuple[str, str], ...]] = {
+    "cafe": (("amenity", "cafe"),),
+    "restaurant": (("amenity", "restaurant"),),
+    "pizza": (("cuisine", "pizza"),),
+    "fast_food": (("amenity", "fast_food"),),
+    "confectionery": (("shop", "confectionery"),),
+    "tea_shop": (("shop", "tea"), ("cuisine", "tea")),
+    "bakery": (("shop", "bakery"),),
+    "takeaway": (("takeaway", "only"), ("takeaway", "yes")),
+    "grocery": (("shop", "grocery"), ("shop", "convenience")),
+    "marketplace": (("amenity", "marketplace"),),
+    "supermarket": (("shop", "supermarket"),),
+    "clothes": (("shop", "clothes"),),
+    "electronics": (("shop", "electronics"),),
+    "books": (("shop", "books"),),
+    "bank": (("amenity", "bank"),),
+    "hairdresser": (("shop", "hairdresser"), ("shop", "beauty")),
+    "mobile_phone_repair": (("shop", "mobile_phone"), ("craft", "electronics_repair")),
+    "fuel": (("amenity", "fuel"),),
+    "car_service": (("shop", "car_repair"),),
+    "post_office": (("amenity", "post_office"),),
+    "doctor": (("amenity", "doctors"), ("amenity", "clinic")),
+    "pharmacy": (("amenity", "pharmacy"),),
+    "hotel": (("tourism", "hotel"),),
+    "school": (("amenity", "school"),),
+    "university": (("amenity", "university"),),
+    "bus_stop": (("highway", "bus_stop"),),
+    "train_station": (("railway", "station"),),
+    "aerodrome": (("aeroway", "aerodrome"),),
+    "taxi_stand": (("amenity", "taxi"),),
+    "bicycle_rental": (("amenity", "bicycle_rental"),),
+}
+
+
+# Tags the nearby views read - Overpass returns just these as tab-separated columns
+_CSV_TAGS = (
+    "name", "phone", "website", "opening_hours",
+    "addr:street", "addr:housenumber", "addr:city", "addr:postcode",
+    "cuisine", "brand", "operator",
+)
+_CSV_HEADER = f'[out:csv(::type,::id,::lat,::lon,{",".join(_CSV_TAGS)};false;"\\t")][timeout:25];'
+
+
+def _build_overpass_query(place_type: str, radius: int, lat: float, lon: float) -> str:
+    """OverpassQL for named places of one type around a point (one nwr clause per tag filter)"""
+    kinds = _OVERPASS_KINDS.get(place_type) or tuple((key, place_type) for key in ("amenity", "shop", "tourism"))
+    around = f"(around:{radius},{lat},{lon});"
+    # Unnamed places only showed up as "Noma'lum" entries - filter them out on the server
+    clauses = "".join(f'nwr["{key}"="{value}"]["name"]{around}' for key, value in kinds)
+    return f"{_CSV_HEADER}({clauses});out center;"
+
+
+def _parse_overpass_csv(text: str) -> list:
+    """Element dicts (type, id, lat, lon, tags) from an Overpass CSV response, shaped like its JSON elements"""
+    elements = []
+    for line in text.splitlines():
+        fields = line.split("\t")
+        if len(fields) < 4 or not fields[2] or not fields[3]:
+            continue
+        try:
+            lat, lon = float(fields[2]), float(fields[3])
+        except ValueError:
+            continue
+        elements.append({
+            "type": fields[0],
+            "id": fields[1],
+            "lat": lat,
+            "lon": lon,
+            "tags": {tag: value for tag, value in zip(_CSV_TAGS, fields[4:]) if value},
+        })
+    return elements
+
+
+def _element_coords(element):
+    """(lat, lon) of an Overpass element (ways and relations carry a center)"""
+    point = element.get("center", element)
+    return point["lat"], point["lon"]
+
+
+def _place_columns(elements) -> dict:
+    """Names, coordinates and tags of Overpass elements as parallel lists - the user-independent part of a search"""
+    coords = [_element_coords(e) for e in elements]
+    tags = [e.get("tags", {}) for e in elements]
+    return {
+        "names": [t.get("name", "Noma'lum") for t in tags],
+        "lats": [c[0] for c in coords],
+        "lons": [c[1] for c in coords],
+        "tags": tags,
+    }
+
+
+_KM_PER_DEGREE = 6371 * math.pi / 180  # Degree of latitude on the haversine sphere
+
+
+def _bbox_candidates(lats, lons, user_lat, user_lon, radius_km):
+    """Indices of points inside the lat/lon box enclosing radius_km around the user (no trig per point)"""
+    max_dlat = radius_km / _KM_PER_DEGREE
+    # Use the box edge nearest the pole so points on a bending great circle are not cut off
+    cos_lat = math.cos(math.radians(min(90.0, abs(user_lat) + max_dlat)))
+    max_dlon = radius_km / (_KM_PER_DEGREE * cos_lat) if cos_lat > 1e-9 else 360.0
+    if NUMPY_AVAILABLE:
+        dlon = np.abs(np.asarray(lons, dtype=np.float64) - user_lon)
+        mask = (np.abs(np.asarray(lats, dtype=np.float64) - user_lat) <= max_dlat) & (np.minimum(dlon, 360 - dlon) <= max_dlon)
+        return np.flatnonzero(mask).tolist()
+    candidates = []
+    for i, (lat, lon) in enumerate(zip(lats, lons)):
+        dlon = abs(lon - user_lon)
+        if abs(lat - user_lat) <= max_dlat and min(dlon, 360 - dlon) <= max_dlon:
+            candidates.append(i)
+    return candidates
+
+
+def _ranked_rows(places: dict, user_lat, user_lon, radius_km: Optional[float] = None) -> tuple[list, list]:
+    """
+    Row indices into the place columns and their distances (km), nearest to the user first
+
+    With radius_km, points outside the enclosing bounding box are dropped before any haversine is computed
+    (callers still cut the exact radius with _within_radius).
+    """
+    lats, lons = places["lats"], places["lons"]
+    if radius_km is None:
+        rows = range(len(lats))
+    else:
+        rows = _bbox_candidates(lats, lons, user_lat, user_lon, radius_km)
+        if len(rows) < len(lats):
+            lats, lons = [lats[i] for i in rows], [lons[i] for i in rows]
+    if not rows:
+        return [], []
+    dist_km = calculate_distances_batch(user_lat, user_lon, lats, lons)
+    if NUMPY_AVAILABLE:
+        order = np.argsort(dist_km, kind="stable").tolist()
+        dist_km = dist_km.tolist()
+    else:
+        order = sorted(range(len(dist_km)), key=dist_km.__getitem__)
+    return [rows[i] for i in order], [dist_km[i] for i in order]
+
+
+def _place_row(places: dict, row: int, distance: float) -> tuple:
+    """(element, name, distance_km, lat, lon) of one row of the place columns"""
+    # Views only read element["tags"], so the element is rebuilt from the tags column
+    return {"tags": places["tags"][row]}, places["names"][row], distance, places["lats"][row], places["lons"][row]
+
+
+def _places_by_distance(places: dict, user_lat, user_lon, radius_km: Optional[float] = None):
+    """(element, name, distance_km, lat, lon) tuples from place columns, nearest to the user first"""
+    rows, dists = _ranked_rows(places, user_lat, user_lon, radius_km)
+    return [_place_row(places, row, dist) for row, dist in zip(rows, dists)]
+
+
+def _nearest_columns(places: dict, lat: float, lon: float, limit: int) -> dict:
+    """Place columns trimmed to the limit places nearest to a point"""
+    if len(places["names"]) <= limit:
+        return places
+    nearest = _places_by_distance(places, lat, lon)[:limit]
+    return {
+        "names": [p[1] for p in nearest],
+        "lats": [p[3] for p in nearest],
+        "lons": [p[4] for p in nearest],
+        "tags": [p[0]["tags"] for p in nearest],
+    }
+
+
+def _process_elements(elements, lat: float, lon: float, limit: int) -> dict:
+    """Columns of the limit Overpass elements nearest to a point (CPU-bound, run in a worker thread)"""
+    return _nearest_columns(_place_columns(elements), lat, lon, limit)
+
+
+def _bucket(place_type: str, lat: float, lon: float) -> tuple[str, float, float]:
+    """Shared cache key of a search plus its anchor - a ~100 m grid cell, so neighbours reuse one Overpass result"""
+    lat_q, lon_q = round(lat, 3), round(lon, 3)
+    return f"nb_{place_type}_{lat_q}_{lon_q}", lat_q, lon_q
+
+
+def _fmt(tpl: str, **kw) -> str:
+    """Format an optional message line - empty when any value is missing"""
+    return tpl.format(**kw) if all(kw.values()) else ""
+
+
+def _place_address(tags: dict) -> str:
+    """Street address of an OSM place from its addr:* tags ("" when unknown)"""
+    return ", ".join(
+        part for part in (tags.get("addr:street"), tags.get("addr:housenumber"),
+                          tags.get("addr:city"), tags.get("addr:postcode")) if part
+    )
+
+
+# Fixed message blocks of the place list / detail / map / directions views
+_LIST_FOOTER_TMPL = (
+    "<i>Qo'shimcha ma'lumot olish uchun quyidagi tugmalardan birini tanlang</i>\n\n"
+    "<i>Har bir tugma mos raqamli joy haqida ma'lumot beradi</i>\n\n"
+    "🔷 <b>Kategoriya:</b> {place_name}\n"
+    "📄 <b>Sahifa:</b> {page}/{total_pages}\n\n"
+)
+_PLACE_FOOTER_TMPL = (
+    "🔷 <b>Joy nomi:</b> {name}\n"
+    "📄 <b>Raqam:</b> {number}\n\n"
+)
+_DETAIL_ACTIONS = (
+    "📋 <b>Mavjud amallar:</b>\n"
+    "<i>Quyidagi tugmalardan birini tanlang:</i>\n\n"
+    "• 🗺️ <b>Xaritada ko'rish</b> - Joylashuvni xaritada ko'ring\n"
+    "• 🧭 <b>Yo'nalish olish</b> - Google Maps orqali yo'nalish oling\n"
+    "• ⬅️ <b>Orqaga</b> - Ro'yxatga qayting\n"
+    "• 🏠 <b>Bosh menyu</b> - Asosiy menyuga qayting\n\n"
+)
+_MAP_HINT = (
+    "<i>Xaritada ko'rish uchun yuqoridagi joylashuv xabarini oching</i>\n\n"
+    "<i>Joylashuvni Google Maps ilovasida ochish uchun xabarni bosing</i>\n\n"
+)
+_DIRECTIONS_TMPL = (
+    "🧭 <b>{name} ga yo'nalish</b>\n"
+    f"{SEPARATOR}\n\n"
+    "📍 <b>Manzil:</b>\n"
+    "• <b>Joy nomi:</b> {name}\n"
+    "{address_line}"
+    "• <b>Koordinatalar:</b> {lat:.6f}, {lon:.6f}\n\n"
+    "{contact_block}"
+    "🧭 <b>Yo'nalish:</b>\n"
+    "<a href='{directions_url}'>Google Maps orqali yo'nalish olish</a>\n\n"
+    "<i>Yo'nalishni ochish uchun havolani bosing</i>\n\n"
+    "<i>Yo'nalishni Google Maps ilovasida ochish uchun havolani bosing</i>\n\n"
+    "🔷 <b>Joy nomi:</b> {name}\n"
+    "📄 <b>Raqam:</b> {number}\n\n"
+)
+
+
+def _tier_radius(places_with_distance, search_radii):
+    """Smallest radius tier that has any place in it (the nearest place decides)"""
+    nearest_m = places_with_distance[0][2] * 1000
+    return next((r for r in search_radii if nearest_m <= r), nearest_m)
+
+
+@functools.lru_cache(maxsize=1024)
+def _render_detail(tags_frozen: frozenset, name: str, distance: float, lat: float, lon: float, place_index: int) -> str:
+    """HTML of the place detail view (tags passed as a frozenset of items to be hashable)"""
+    tags = dict(tags_frozen)
+    address = _place_address(tags)
+    phone = tags.get("phone")
+    website = tags.get("website")
+    opening_hours = tags.get("opening_hours")
+    cuisine = tags.get("cuisine")
+    brand = tags.get("brand")
+    operator = tags.get("operator")
+
+    # Create detailed message with better formatting
+    parts = [
+        f"📍 <b>{name}</b>\n", SEPARATOR, "\n\n",
+        # Location information
+        f"📍 <b>Joylashuv ma'lumotlari:</b>\n📏 <b>Masofa:</b> {distance:.2f} km\n",
+        _fmt("🏠 <b>Manzil:</b> {address}\n", address=address),
+        "\n",
+    ]
+
+    # Contact information
+    if phone or website or opening_hours:
+        parts += [
+            "📱 <b>Aloqa ma'lumotlari:</b>\n",
+            _fmt("• 📞 Telefon: {phone}\n", phone=phone),
+            _fmt("• 🌐 Vebsayt: {website}\n", website=website),
+            _fmt("• 🕒 Ish vaqti: {opening_hours}\n", opening_hours=opening_hours),
+            "\n",
+        ]
+
+    # Coordinates
+    parts.append(f"🧭 <b>Koordinatalar:</b>\n• <b>Kenglik (latitude):</b> {lat:.6f}\n• <b>Uzunlik (longitude):</b> {lon:.6f}\n\n")
+
+    # Additional details if available
+    if cuisine or brand or operator:
+        parts += [
+            "📋 <b>Qo'shimcha ma'lumotlar:</b>\n",
+            _fmt("• <b>Ovqat turi:</b> {cuisine}\n", cuisine=cuisine),
+            _fmt("• <b>Brend:</b> {brand}\n", brand=brand),
+            _fmt("• <b>Operator:</b> {operator}\n", operator=operator),
+            "\n",
+        ]
+
+    # Available actions and footer with place information
+    parts.append(_DETAIL_ACTIONS)
+    parts.append(_PLACE_FOOTER_TMPL.format(name=name, number=place_index + 1))
+    return "".join(parts)
+
+
+@functools.lru_cache(maxsize=1024)
+def _render_map(tags_frozen: frozenset, name: str, lat: float, lon: float, place_index: int) -> str:
+    """HTML sent under the map pin of a place"""
+    tags = dict(tags_frozen)
+    address = _place_address(tags)
+    phone = tags.get("phone")
+    website = tags.get("website")
+
+    # Create detailed map message
+    parts = [
+        f"📍 <b>{name}</b> joylashuvi xaritada ko'rsatilgan\n", SEPARATOR, "\n\n",
+        f"📍 <b>Joylashuv ma'lumotlari:</b>\n• <b>Kenglik (latitude):</b> {lat:.6f}\n• <b>Uzunlik (longitude):</b> {lon:.6f}\n",
+        _fmt("• <b>Manzil:</b> {address}\n", address=address),
+        "\n",
+    ]
+
+    # Contact information if available
+    if phone or website:
+        parts += [
+            "📱 <b>Aloqa ma'lumotlari:</b>\n",
+            _fmt("• 📞 <b>Telefon:</b> {phone}\n", phone=phone),
+            _fmt("• 🌐 <b>Vebsayt:</b> {website}\n", website=website),
+            _fmt("• 🕒 <b>Ish vaqti:</b> {opening_hours}\n", opening_hours=tags.get("opening_hours")),
+            "\n",
+        ]
+
+    # Hint and footer with place information
+    parts.append(_MAP_HINT)
+    parts.append(_PLACE_FOOTER_TMPL.format(name=name, number=place_index + 1))
+    return "".join(parts)
+
+
+@functools.lru_cache(maxsize=512)
+def _places_keyboard(place_type: str, page: int, total_pages: int, start_index: int, names: tuple) -> InlineKeyboardMarkup:
+    """Keyboard of one place list page: numbered place buttons (2 per row), pagination and navigation"""
+    buttons = [
+        InlineKeyboardButton(
+            f"{index + 1}. {name[:17]}..." if len(name) > 20 else f"{index + 1}. {name}",
+            # Include place_type in callback data to identify the correct cache
+            callback_data=f"nearby_detail_{place_type}_{index}"
+        )
+        for index, name in enumerate(names, start_index)
+    ]
+    keyboard = [buttons[i:i + 2] for i in range(0, len(buttons), 2)]
+
+    # Pagination controls
+    pagination_row = []
+    if page > 1:
+        pagination_row.append(InlineKeyboardButton("⬅️ Oldingi", callback_data=f"nearby_{place_type}_{page-1}"))
+    pagination_row.append(InlineKeyboardButton(f"{page}/{total_pages}", callback_data="nearby_info"))
+    if page < total_pages:
+        pagination_row.append(InlineKeyboardButton("Keyingi ➡️", callback_data=f"nearby_{place_type}_{page+1}"))
+    keyboard.append(pagination_row)
+
+    # Navigation buttons
+    keyboard.append([
+        InlineKeyboardButton("⬅️ Orqaga", callback_data="nearby_menu"),
+        InlineKeyboardButton("🏠 Bosh menyu", callback_data="nearby_menu")
+    ])
+    return InlineKeyboardMarkup(keyboard)
+
+
+def _within_radius(places_with_distance, radius_m):
+    """Places of a distance-sorted list that lie within radius_m (a prefix, so indices stay valid)"""
+    return [p for p in places_with_distance if p[2] * 1000 <= radius_m]
+
+
 class NearbyHandler:
     """Handles nearby places functionality with improved UI/UX"""
     
+    OVERPASS_CONCURRENCY = 2
+    MAX_PLACES = 80  # Nearest places kept per search (8 list pages)
+    
     def __init__(self, location_data, cached_data):
         self.location_data = location_data
         self.cached_data = cached_data
         self.OVERPASS_URL = "https://overpass-api.de/api/interpreter"
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._overpass_slots = asyncio.Semaphore(self.OVERPASS_CONCURRENCY)  # Overpass allows only a couple of parallel queries per IP
+        self._inflight: dict[str, asyncio.Task] = {}  # bucket key -> Overpass query shared by concurrent identical searches
+        self._last_msg_hash = TTLCache(maxsize=4096, ttl=24 * 60 * 60)  # (chat_id, message_id) -> hash of the last edit we sent
+
+    async def _get_session(self) -> aiohttp.ClientSession:
+        """Get the keep-alive Overpass session, creating it on first use"""
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=32, ttl_dns_cache=300, keepalive_timeout=60),
+                timeout=aiohttp.ClientTimeout(total=30)
+            )
+        return self._session
+
+    async def close(self):
+        """Close the Overpass session (call on shutdown)"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+    
+    async def _query_overpass(self, bucket_key: str, place_type: str, lat: float, lon: float, radius: int) -> list:
+        """Overpass elements around a point; concurrent searches of the same bucket share one request"""
+        task = self._inflight.get(bucket_key)
+        if task is None:
+            task = asyncio.create_task(self._fetch_overpass(place_type, lat, lon, radius))
+            self._inflight[bucket_key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(bucket_key, None))
+        # Shielded so one cancelled waiter does not cancel the request for the others
+        return await asyncio.shield(task)
+    
+    async def _fetch_overpass(self, place_type: str, lat: float, lon: float, radius: int) -> list:
+        """Run one Overpass query, at most OVERPASS_CONCURRENCY at a time"""
+        overpass_query = _build_overpass_query(place_type, radius, lat, lon)
+        async with self._overpass_slots:
+            data = await http_post_with_retry(
+                self.OVERPASS_URL,
+                data={"data": overpass_query},
+                timeout=30,
+                session=await self._get_session(),
+                text=True
+            )
+        # Parsing a large response is CPU work - keep it off the event loop
+        return await asyncio.to_thread(_parse_overpass_csv, data) if data else []
+    
+    async def _edit(self, query, text: str, reply_markup: InlineKeyboardMarkup):
+        """Edit the callback's message unless it already shows exactly this text and keyboard"""
+        key = (query.message.chat.id, query.message.message_id)
+        h = hash((text, repr(reply_markup)))
+        # The keyboard check catches edits made by other handlers since our last one
+        if self._last_msg_hash.get(key) == h and query.message.reply_markup == reply_markup:
+            return
+        try:
+            await query.edit_message_text(text, parse_mode=ParseMode.HTML, reply_markup=reply_markup)
+        except BadRequest as e:
+            if "Message is not modified" not in str(e):
+                raise
+        self._last_msg_hash[key] = h
     
     async def show_nearby_menu(self, update: Update, context: ContextTypes.DEFAULT_TYPE, page=1):
         """Show nearby places category menu with pagination"""
-        # Define categories with better organization - exactly 30 categories total
-        categories = [
-            # Page 1 - Food & Dining (10 categories)
-            ("☕ Kafelar", "nearby_cafe"),
-            ("🍽️ Restoranlar", "nearby_restaurant"),
-            ("🍕 Pitsa do'konlar", "nearby_pizza"),
-            ("🍔 Fast food", "nearby_fast_food"),
-            ("🍦 Shirinliklar", "nearby_confectionery"),
-            ("🧋 Choyxonalar", "nearby_tea_shop"),
-            ("🍞 Non do'konlari", "nearby_bakery"),
-            ("🥡 Takeaway", "nearby_takeaway"),
-            ("🛒 Oziq-ovqat do'konlari", "nearby_grocery"),
-            ("🏪 Bozorlar", "nearby_marketplace"),
-            
-            # Page 2 - Shopping & Services (10 categories)
-            ("🏪 Supermarketlar", "nearby_supermarket"),
-            ("👕 Kiyim do'konlari", "nearby_clothes"),
-            ("💻 Elektronika do'konlari", "nearby_electronics"),
-            ("📚 Kitob do'konlari", "nearby_books"),
-            ("🏦 Banklar", "nearby_bank"),
-            ("💇 Salonlar", "nearby_hairdresser"),
-            ("📱 Mobil telefon ustalari", "nearby_mobile_phone_repair"),
-            ("⛽ Avto zapravkalar", "nearby_fuel"),
-            ("🚗 Avtoservis", "nearby_car_service"),
-            ("📦 Pochta", "nearby_post_office"),
-            
-            # Page 3 - Health, Education & Transportation (10 categories)
-            ("🏥 Shifokorlar/Klinika", "nearby_doctor"),
-            ("⚕️ Dorixonalar", "nearby_pharmacy"),
-            ("🏨 Mehmonxonalar", "nearby_hotel"),
-            ("🏫 Maktablar", "nearby_school"),
-            ("🏢 Universitetlar", "nearby_university"),
-            ("🚌 Avtobus bekati", "nearby_bus_stop"),
-            ("🚉 Temir yo'l stansiyasi", "nearby_train_station"),
-            ("✈️ Aeroportlar", "nearby_aerodrome"),
-            ("🚖 Taksi turargohi", "nearby_taxi_stand"),
-            ("🚲 Velosiped ijarasi", "nearby_bicycle_rental"),
-        ]
-        
-        # Pagination settings - 3 pages with 10 categories each
-        items_per_page = 10
-        total_pages = 3  # Fixed to 3 pages as requested
-        
-        # Adjust page if out of range
-        page = max(1, min(page, total_pages))
-        
-        # Get items for current page
-        start_index = (page - 1) * items_per_page
-        end_index = min(start_index + items_per_page, len(categories))
-        page_categories = categories[start_index:end_index]
-        
-        # Create message with better formatting
-        message_text = "📍 <b>Yaqin-atrofdagi joylar</b>\n"
-        message_text += "==============================\n\n"
-        message_text += "<i>Qaysi turdagi joylarni qidirmoqchisiz?</i>\n\n"
-        
-        # Add category headers
-        current_category = None
-        for i, (category_name, callback_data) in enumerate(page_categories):
-            # Determine category group
-            if start_index < 10:  # Page 1 - Food & Dining
-                category_group = "Food & Dining"
-            elif start_index < 20:  # Page 2 - Shopping & Services
-                category_group = "Shopping & Services"
-            else:  # Page 3 - Health, Education & Transportation
-                category_group = "Health, Education & Transportation"
-            
-            # Add category header if it's a new group
-            if i == 0:  # First item on page
-                message_text += f"🔷 <b>{category_group}:</b>\n"
-            
-            message_text += f"   • {category_name}\n"
-        
-        message_text += "\n"
-   
-        # Add footer with navigation instructions
-        message_text += f"🔷 <b>Jami kategoriyalar:</b> {len(categories)}\n"
-        message_text += f"📄 <b>Jami sahifalar:</b> {total_pages}\n\n"
-        
-        # Create keyboard
-        keyboard = []
-        
-        # Add category buttons (2 per row)
-        for i in range(0, len(page_categories), 2):
-            row = []
-            row.append(InlineKeyboardButton(page_categories[i][0], callback_data=page_categories[i][1]))
-            if i + 1 < len(page_categories):
-                row.append(InlineKeyboardButton(page_categories[i + 1][0], callback_data=page_categories[i + 1][1]))
-            keyboard.append(row)
-        
-        # Add pagination controls
-        pagination_row = []
-        if page > 1:
-            pagination_row.append(InlineKeyboardButton("⬅️ Oldingi", callback_data=f"nearby_page_{page-1}"))
-        
-        # Add page indicator
-        pagination_row.append(InlineKeyboardButton(f"{page}/{total_pages}", callback_data="nearby_info"))
-        
-        if page < total_pages:
-            pagination_row.append(InlineKeyboardButton("Keyingi ➡️", callback_data=f"nearby_page_{page+1}"))
-        
-        if pagination_row:
-            keyboard.append(pagination_row)
-        
-        # Add back to main menu button
-        keyboard.append([InlineKeyboardButton("🏠 Bosh menyu", callback_data="nearby_menu")])
-        
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        # Pages are static - serve the prebuilt text and keyboard
+        message_text, reply_markup = _MENU_PAGES[max(1, min(page, _MENU_TOTAL_PAGES))]
         
         # Send or edit message
         if update.callback_query and update.callback_query.message:
-            try:
-                await update.callback_query.edit_message_text(
-                    message_text, 
-                    parse_mode=ParseMode.HTML, 
-                    reply_markup=reply_markup
-                )
-            except Exception as e:
-                if "Message is not modified" in str(e):
-                    await update.callback_query.answer("✅ Yangilangan", show_alert=False)
-                else:
-                    raise
+            await self._edit(update.callback_query, message_text, reply_markup)
         elif update.message:
             await update.message.reply_text(
                 message_text, 
@@ -164,8 +593,7 @@ class NearbyHandler:
         # Check if location data has expired
         location = self.location_data[chat_id]
         if "expires_at" in location:
-            expires_at = datetime.fromisoformat(location["expires_at"])
-            if datetime.now() > expires_at:
+            if time.time() > expiry_epoch(location):
                 await query.answer("📍 Joylashuv ma'lumotlari eskirgan. Iltimos, qaytadan jo'natish!", show_alert=True)
                 return
         
@@ -173,130 +601,53 @@ class NearbyHandler:
         user_lat = location["latitude"]
         user_lon = location["longitude"]
         
-        # Map place types to display names - all 30 categories
-        place_names = {
-            "cafe": "Kafelar",
-            "restaurant": "Restoranlar",
-            "pizza": "Pitsa do'konlar",
-            "fast_food": "Fast food",
-            "confectionery": "Shirinliklar",
-            "tea_shop": "Choyxonalar",
-            "bakery": "Non do'konlari",
-            "takeaway": "Ovqat olib ketish",
-            "grocery": "Oziq-ovqat do'konlari",
-            "marketplace": "Bozorlar",
-            "supermarket": "Supermarketlar",
-            "clothes": "Kiyim do'konlari",
-            "electronics": "Elektronika do'konlari",
-            "books": "Kitob do'konlari",
-            "bank": "Banklar",
-            "hairdresser": "Salonlar",
-            "mobile_phone_repair": "Mobil telefon ustalari",
-            "fuel": "Avto zapravkalar",
-            "car_service": "Avtoservis",
-            "post_office": "Pochta",
-            "doctor": "Shifokorlar/Klinika",
-            "pharmacy": "Dorixonalar",
-            "hotel": "Mehmonxonalar",
-            "school": "Maktablar",
-            "university": "Universitetlar",
-            "bus_stop": "Avtobus bekati",
-            "train_station": "Temir yo'l stansiyasi",
-            "aerodrome": "Aeroportlar",
-            "taxi_stand": "Taksi turargohi",
-            "bicycle_rental": "Velosiped ijarasi",
-        }
-        
-        place_name = place_names.get(place_type, place_type.capitalize())
+        place_name = _PLACE_NAMES.get(place_type, place_type.capitalize())
         
         try:
             await query.answer(f"🔍 {place_name} qidirilmoqda...")
             
-            # Check cache first
-            cache_key = f"nearby_{chat_id}_{place_type}"
-            if cache_key in self.cached_data:
-                cached_entry = self.cached_data[cache_key]
-                if datetime.now() < cached_entry["expires_at"]:
-                    places_with_distance = cached_entry["data"]
-                    await self._show_places_list(query, places_with_distance, place_name, page, place_type)
-                    return
-            
             # Adaptive search radius implementation
-            # Start with a smaller radius and increase if needed
+            # One query at the largest radius; the smaller tiers are subsets of it and are picked locally
             search_radii = [2000, 5000, 10000, 20000]  # 2km, 5km, 10km, 20km
-            elements = []
-            used_radius = 2000  # Default radius
+            radius = search_radii[-1]
+            used_radius = radius
             
-            # Try different radii until we find places or exhaust all options
-            for radius in search_radii:
-                # Using Overpass API to find nearby places with adaptive search radius
-                overpass_query = f"""
-                [out:json][timeout:25];
-                (
-                  node["amenity"="{place_type}"](around:{radius},{user_lat},{user_lon});
-                  way["amenity"="{place_type}"](around:{radius},{user_lat},{user_lon});
-                  relation["amenity"="{place_type}"](around:{radius},{user_lat},{user_lon});
-                  node["shop"="{place_type}"](around:{radius},{user_lat},{user_lon});
-                  way["shop"="{place_type}"](around:{radius},{user_lat},{user_lon});
-                  node["tourism"="{place_type}"](around:{radius},{user_lat},{user_lon});
-                  way["tourism"="{place_type}"](around:{radius},{user_lat},{user_lon});
-                );
-                out center;
-                """
-                
-                data = await http_post_with_retry(
-                    self.OVERPASS_URL,
-                    data={"data": overpass_query},
-                    timeout=30
-                )
-                if data:
-                    elements = data.get("elements", [])
-
-                    # If we found places or this is the largest radius, stop searching
-                    if elements or radius == search_radii[-1]:
-                        used_radius = radius
-                        break
-                    # If no places found and this isn't the largest radius, try a larger radius
-                    else:
-                        continue
-                else:
-                    # Try next radius on API error
-                    continue
+            # Results are shared by everyone in the same ~100 m cell
+            bucket_key, anchor_lat, anchor_lon = _bucket(place_type, user_lat, user_lon)
+            bucket = self.cached_data.get(bucket_key)
+            if bucket is None:
+                elements = await self._query_overpass(bucket_key, place_type, anchor_lat, anchor_lon, radius)
+                if elements:
+                    places = await asyncio.to_thread(_process_elements, elements, anchor_lat, anchor_lon, self.MAX_PLACES)
+                    bucket = {"anchor": [anchor_lat, anchor_lon], "places": places}
+                    self.cached_data[bucket_key] = bucket
             
-            if elements:
-                # Process elements
-                places_with_distance = []
-                for element in elements:
-                    tags = element.get("tags", {})
-                    name = tags.get("name", "Noma'lum")
-                    
-                    # Get coordinates
-                    if "center" in element:
-                        lat = element["center"]["lat"]
-                        lon = element["center"]["lon"]
-                    else:
-                        lat = element["lat"]
-                        lon = element["lon"]
-                    
-                    # Calculate distance
-                    distance = self._calculate_distance(user_lat, user_lon, lat, lon)
-                    places_with_distance.append((element, name, distance, lat, lon))
-                
-                # Sort by distance
-                places_with_distance.sort(key=lambda x: x[2])
+            if bucket:
+                # Distances from this user, nearest first
+                rows, dists = _ranked_rows(bucket["places"], user_lat, user_lon, radius / 1000)
+                places_with_distance = [_place_row(bucket["places"], row, dist) for row, dist in zip(rows, dists)]
+                if not places_with_distance:
+                    bucket = None
+            
+            if bucket:
+                used_radius = _tier_radius(places_with_distance, search_radii)
+                shown = _within_radius(places_with_distance, used_radius)
                 
-                # Cache results with place type
-                self.cached_data[cache_key] = {
-                    "data": places_with_distance,
-                    "expires_at": datetime.now() + timedelta(minutes=10),
-                    "place_type": place_type
+                # Remember which bucket rows this chat's list shows, in order, so detail views
+                # look a place up by index instead of re-sorting the bucket
+                self.cached_data[f"nearby_{chat_id}_{place_type}"] = {
+                    "bucket": bucket_key,
+                    "origin": [user_lat, user_lon],
+                    "radius": used_radius,
+                    "rows": rows[:len(shown)],
+                    "dists": dists[:len(shown)]
                 }
                 
-                await self._show_places_list(query, places_with_distance, place_name, page, place_type)
+                await self._show_places_list(query, shown, place_name, page, place_type)
             else:
                 error_message = (
                     f"❌ <b>{place_name} topilmadi</b>\n"
-                    f"{'=' * (len(place_name) + 15)}\n\n"
+                    f"{SEPARATOR}\n\n"
                     f"<i>Bu kategoriyada yaqin-atrofda joylar topilmadi.</i>\n"
                     f"<i>Qidiruv radiusi: {used_radius/1000:.1f} km</i>\n\n"
                     f"<i>Maslahatlar:</i>\n"
@@ -313,7 +664,7 @@ class NearbyHandler:
             logger.error(f"Yaqin-atrofdagi joylarni qidirishda xatolik: {e}")
             error_message = (
                 f"❌ <b>{place_name} topilmadi</b>\n"
-                f"{'=' * (len(place_name) + 15)}\n\n"
+                f"{SEPARATOR}\n\n"
                 f"<i>Xatolik yuz berdi. Keyinroq qayta urinib ko'ring.</i>\n\n"
                 f"<i>Maslahatlar:</i>\n"
                 f"• Boshqa joyda sinab ko'ring\n"
@@ -343,95 +694,45 @@ class NearbyHandler:
         page_places = places_with_distance[start_index:end_index]
         
         # Create message with better formatting
-        places_text = f"📍 <b>{place_name}</b>\n"
-        places_text += "=" * (len(place_name) + 2) + "\n\n"
+        parts = [f"📍 <b>{place_name}</b>\n", SEPARATOR, "\n\n"]
         
         for i, (element, name, distance, lat, lon) in enumerate(page_places, start_index + 1):
             # Get additional details for better UI
             tags = element.get("tags", {})
-            phone = tags.get("phone", "")
-            website = tags.get("website", "")
-            
-            # Add place info with better formatting
-            places_text += f"📍 <b>{i}. {name}</b>\n"
-            places_text += f"   📏 <i>Masofa:</i> {distance:.2f} km"
-            
-            # Add phone if available
-            if phone:
-                places_text += f"\n   📞 <i>Telefon:</i> {phone}"
-            
-            # Add website if available
-            if website:
-                places_text += f"\n   🌐 <i>Vebsayt:</i> {website}"
-            
-            places_text += "\n\n"
-        
-        # Add instructions
-        places_text += "<i>Qo'shimcha ma'lumot olish uchun quyidagi tugmalardan birini tanlang</i>\n\n"
-        places_text += "<i>Har bir tugma mos raqamli joy haqida ma'lumot beradi</i>\n\n"
-
-        # Add footer with category information
-        places_text += f"🔷 <b>Kategoriya:</b> {place_name}\n"
-        places_text += f"📄 <b>Sahifa:</b> {page}/{total_pages}\n\n"
-        
-        # Create keyboard
-        keyboard = []
-        
-        # Add place selection buttons (2 per row)
-        for i in range(0, len(page_places), 2):
-            row = []
-            # First button
-            place_index = start_index + i
-            name_1 = page_places[i][1]
-            if len(name_1) > 20:
-                button_text_1 = f"{place_index + 1}. {name_1[:17]}..."
-            else:
-                button_text_1 = f"{place_index + 1}. {name_1}"
-            # Include place_type in callback data to identify the correct cache
-            callback_data_1 = f"nearby_detail_{place_type}_{place_index}"
-            row.append(InlineKeyboardButton(button_text_1, callback_data=callback_data_1))
-            
-            # Second button if exists
-            if i + 1 < len(page_places):
-                place_index_2 = start_index + i + 1
-                name_2 = page_places[i + 1][1]
-                if len(name_2) > 20:
-                    button_text_2 = f"{place_index_2 + 1}. {name_2[:17]}..."
-                else:
-                    button_text_2 = f"{place_index_2 + 1}. {name_2}"
-                # Include place_type in callback data to identify the correct cache
-                callback_data_2 = f"nearby_detail_{place_type}_{place_index_2}"
-                row.append(InlineKeyboardButton(button_text_2, callback_data=callback_data_2))
-            
-            keyboard.append(row)
-        
-        # Add pagination controls
-        pagination_row = []
-        if page > 1:
-            pagination_row.append(InlineKeyboardButton("⬅️ Oldingi", callback_data=f"nearby_{place_type}_{page-1}"))
+            parts.append(f"📍 <b>{i}. {name}</b>\n   📏 <i>Masofa:</i> {distance:.2f} km")
+            parts.append(_fmt("\n   📞 <i>Telefon:</i> {phone}", phone=tags.get("phone")))
+            parts.append(_fmt("\n   🌐 <i>Vebsayt:</i> {website}", website=tags.get("website")))
+            parts.append("\n\n")
         
-        # Add page indicator
-        pagination_row.append(InlineKeyboardButton(f"{page}/{total_pages}", callback_data="nearby_info"))
+        # Instructions and footer with category information
+        parts.append(_LIST_FOOTER_TMPL.format(place_name=place_name, page=page, total_pages=total_pages))
+        places_text = "".join(parts)
         
-        if page < total_pages:
-            pagination_row.append(InlineKeyboardButton("Keyingi ➡️", callback_data=f"nearby_{place_type}_{page+1}"))
+        # Keyboards depend only on these inputs, so paging back and forth reuses them
+        reply_markup = _places_keyboard(place_type, page, total_pages, start_index, tuple(p[1] for p in page_places))
         
-        if pagination_row:
-            keyboard.append(pagination_row)
-        
-        # Add navigation buttons
-        keyboard.append([
-            InlineKeyboardButton("⬅️ Orqaga", callback_data="nearby_menu"),
-            InlineKeyboardButton("🏠 Bosh menyu", callback_data="nearby_menu")
-        ])
-        
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        await self._edit(query, places_text, reply_markup)
+    
+    async def _resolve_place(self, query, chat_id: str, place_type: str, place_index: int) -> Optional[tuple]:
+        """Cached (element, name, distance from the user now, lat, lon) of a listed place, or None after alerting the user"""
+        pointer = self.cached_data.get(f"nearby_{chat_id}_{place_type}")
+        bucket = self.cached_data.get(pointer["bucket"]) if pointer else None
+        if not bucket or not pointer.get("rows"):
+            await query.answer("❌ Ma'lumotlar topilmadi. Qayta qidiring.", show_alert=True)
+            return None
         
-        await query.edit_message_text(
-            places_text,
-            parse_mode=ParseMode.HTML,
-            reply_markup=reply_markup
-        )
+        if place_index < 0 or place_index >= len(pointer["rows"]):
+            await query.answer("❌ Noto'g'ri tanlov!", show_alert=True)
+            return None
+        
+        places, row = bucket["places"], pointer["rows"][place_index]
+        # The user may have moved since the list was built - measure from the current location
+        location = self.location_data.get(chat_id)
+        if location:
+            distance = distance_from_location(location, places["lats"][row], places["lons"][row])
+        else:
+            distance = pointer["dists"][place_index]
+        return _place_row(places, row, distance)
     
     async def show_place_detail(self, update: Update, context: ContextTypes.DEFAULT_TYPE, place_type: str, place_index: int):
         """Show detailed information for a specific place"""
@@ -441,94 +742,12 @@ class NearbyHandler:
             
         chat_id = str(query.message.chat.id)
         
-        # Find cached data for the specific place type
-        cache_key = f"nearby_{chat_id}_{place_type}"
-        places_with_distance = None
-        
-        if cache_key in self.cached_data:
-            cached_entry = self.cached_data[cache_key]
-            if datetime.now() < cached_entry["expires_at"]:
-                places_with_distance = cached_entry["data"]
-        
-        if not places_with_distance:
-            await query.answer("❌ Ma'lumotlar topilmadi. Qayta qidiring.", show_alert=True)
-            return
-        
-        # Check if index is valid
-        if place_index < 0 or place_index >= len(places_with_distance):
-            await query.answer("❌ Noto'g'ri tanlov!", show_alert=True)
+        result = await self._resolve_place(query, chat_id, place_type, place_index)
+        if result is None:
             return
-        
-        element, name, distance, lat, lon = places_with_distance[place_index]
-        tags = element.get("tags", {})
-        
-        # Get details
-        phone = tags.get("phone", "Noma'lum")
-        website = tags.get("website", "Noma'lum")
-        opening_hours = tags.get("opening_hours", "Noma'lum")
-        street = tags.get("addr:street", "")
-        housenumber = tags.get("addr:housenumber", "")
-        city = tags.get("addr:city", "")
-        postcode = tags.get("addr:postcode", "")
-        
-        # Build address
-        address_parts = [part for part in [street, housenumber, city, postcode] if part]
-        address = ", ".join(address_parts) if address_parts else "Noma'lum"
-        
-        # Create detailed message with better formatting
-        detail_text = f"📍 <b>{name}</b>\n"
-        detail_text += "=" * (len(name) + 2) + "\n\n"
-        
-        # Add location information header
-        detail_text += "📍 <b>Joylashuv ma'lumotlari:</b>\n"
-        detail_text += f"📏 <b>Masofa:</b> {distance:.2f} km\n"
-        if address and address != "Noma'lum":
-            detail_text += f"🏠 <b>Manzil:</b> {address}\n"
-        detail_text += "\n"
-        
-        # Add contact information header
-        if (phone and phone != "Noma'lum") or (website and website != "Noma'lum") or (opening_hours and opening_hours != "Noma'lum"):
-            detail_text += "📱 <b>Aloqa ma'lumotlari:</b>\n"
-            if phone and phone != "Noma'lum":
-                detail_text += f"• 📞 Telefon: {phone}\n"
-            if website and website != "Noma'lum":
-                detail_text += f"• 🌐 Vebsayt: {website}\n"
-            if opening_hours and opening_hours != "Noma'lum":
-                detail_text += f"• 🕒 Ish vaqti: {opening_hours}\n"
-            detail_text += "\n"
-        
-        # Add coordinates information
-        detail_text += "🧭 <b>Koordinatalar:</b>\n"
-        detail_text += f"• <b>Kenglik (latitude):</b> {lat:.6f}\n"
-        detail_text += f"• <b>Uzunlik (longitude):</b> {lon:.6f}\n"
-        detail_text += "\n"
-        
-        # Add additional details if available
-        cuisine = tags.get("cuisine", "")
-        brand = tags.get("brand", "")
-        operator = tags.get("operator", "")
-        
-        if cuisine or brand or operator:
-            detail_text += "📋 <b>Qo'shimcha ma'lumotlar:</b>\n"
-            if cuisine:
-                detail_text += f"• <b>Ovqat turi:</b> {cuisine}\n"
-            if brand:
-                detail_text += f"• <b>Brend:</b> {brand}\n"
-            if operator:
-                detail_text += f"• <b>Operator:</b> {operator}\n"
-            detail_text += "\n"
-        
-        # Add action buttons with better description
-        detail_text += "📋 <b>Mavjud amallar:</b>\n"
-        detail_text += "<i>Quyidagi tugmalardan birini tanlang:</i>\n\n"
-        detail_text += "• 🗺️ <b>Xaritada ko'rish</b> - Joylashuvni xaritada ko'ring\n"
-        detail_text += "• 🧭 <b>Yo'nalish olish</b> - Google Maps orqali yo'nalish oling\n"
-        detail_text += "• ⬅️ <b>Orqaga</b> - Ro'yxatga qayting\n"
-        detail_text += "• 🏠 <b>Bosh menyu</b> - Asosiy menyuga qayting\n\n"
-        
-        # Add footer with place information
-        detail_text += f"🔷 <b>Joy nomi:</b> {name}\n"
-        detail_text += f"📄 <b>Raqam:</b> {place_index + 1}\n\n"
+        element, name, distance, lat, lon = result
+        # Same place, same distance -> same HTML; re-clicks replay the memoized string
+        detail_text = _render_detail(frozenset(element.get("tags", {}).items()), name, round(distance, 2), lat, lon, place_index)
         
         # Create keyboard
         keyboard = [
@@ -540,11 +759,7 @@ class NearbyHandler:
         
         reply_markup = InlineKeyboardMarkup(keyboard)
         
-        await query.edit_message_text(
-            detail_text,
-            parse_mode=ParseMode.HTML,
-            reply_markup=reply_markup
-        )
+        await self._edit(query, detail_text, reply_markup)
     
     async def show_place_map(self, update: Update, context: ContextTypes.DEFAULT_TYPE, place_type: str, place_index: int):
         """Show place on map"""
@@ -554,25 +769,10 @@ class NearbyHandler:
             
         chat_id = str(query.message.chat.id)
         
-        # Find cached data for the specific place type
-        cache_key = f"nearby_{chat_id}_{place_type}"
-        places_with_distance = None
-        
-        if cache_key in self.cached_data:
-            cached_entry = self.cached_data[cache_key]
-            if datetime.now() < cached_entry["expires_at"]:
-                places_with_distance = cached_entry["data"]
-        
-        if not places_with_distance:
-            await query.answer("❌ Ma'lumotlar topilmadi. Qayta qidiring.", show_alert=True)
+        result = await self._resolve_place(query, chat_id, place_type, place_index)
+        if result is None:
             return
-        
-        # Check if index is valid
-        if place_index < 0 or place_index >= len(places_with_distance):
-            await query.answer("❌ Noto'g'ri tanlov!", show_alert=True)
-            return
-        
-        element, name, distance, lat, lon = places_with_distance[place_index]
+        element, name, distance, lat, lon = result
         
         # Send location
         location_msg = Location(longitude=lon, latitude=lat)
@@ -580,48 +780,7 @@ class NearbyHandler:
         # Create back button callback data
         back_callback = f"nearby_{place_type}_1"
         
-        # Get additional details for the map view
-        tags = element.get("tags", {})
-        phone = tags.get("phone", "Noma'lum")
-        website = tags.get("website", "Noma'lum")
-        opening_hours = tags.get("opening_hours", "Noma'lum")
-        street = tags.get("addr:street", "")
-        housenumber = tags.get("addr:housenumber", "")
-        city = tags.get("addr:city", "")
-        postcode = tags.get("addr:postcode", "")
-        
-        # Build address
-        address_parts = [part for part in [street, housenumber, city, postcode] if part]
-        address = ", ".join(address_parts) if address_parts else "Noma'lum"
-        
-        # Create detailed map message
-        map_text = f"📍 <b>{name}</b> joylashuvi xaritada ko'rsatilgan\n"
-        map_text += "=" * (len(name) + 20) + "\n\n"
-        
-        map_text += "📍 <b>Joylashuv ma'lumotlari:</b>\n"
-        map_text += f"• <b>Kenglik (latitude):</b> {lat:.6f}\n"
-        map_text += f"• <b>Uzunlik (longitude):</b> {lon:.6f}\n"
-        if address and address != "Noma'lum":
-            map_text += f"• <b>Manzil:</b> {address}\n"
-        map_text += "\n"
-        
-        # Add contact information if available
-        if (phone and phone != "Noma'lum") or (website and website != "Noma'lum"):
-            map_text += "📱 <b>Aloqa ma'lumotlari:</b>\n"
-            if phone and phone != "Noma'lum":
-                map_text += f"• 📞 <b>Telefon:</b> {phone}\n"
-            if website and website != "Noma'lum":
-                map_text += f"• 🌐 <b>Vebsayt:</b> {website}\n"
-            if opening_hours and opening_hours != "Noma'lum":
-                map_text += f"• 🕒 <b>Ish vaqti:</b> {opening_hours}\n"
-            map_text += "\n"
-        
-        map_text += "<i>Xaritada ko'rish uchun yuqoridagi joylashuv xabarini oching</i>\n\n"
-        map_text += "<i>Joylashuvni Google Maps ilovasida ochish uchun xabarni bosing</i>\n\n"
-        
-        # Add footer with place information
-        map_text += f"🔷 <b>Joy nomi:</b> {name}\n"
-        map_text += f"📄 <b>Raqam:</b> {place_index + 1}\n\n"
+        map_text = _render_map(frozenset(element.get("tags", {}).items()), name, lat, lon, place_index)
         
         if update.effective_message:
             await update.effective_message.reply_location(location=location_msg)
@@ -641,25 +800,10 @@ class NearbyHandler:
             
         chat_id = str(query.message.chat.id)
         
-        # Find cached data for the specific place type
-        cache_key = f"nearby_{chat_id}_{place_type}"
-        places_with_distance = None
-        
-        if cache_key in self.cached_data:
-            cached_entry = self.cached_data[cache_key]
-            if datetime.now() < cached_entry["expires_at"]:
-                places_with_distance = cached_entry["data"]
-        
-        if not places_with_distance:
-            await query.answer("❌ Ma'lumotlar topilmadi. Qayta qidiring.", show_alert=True)
-            return
-        
-        # Check if index is valid
-        if place_index < 0 or place_index >= len(places_with_distance):
-            await query.answer("❌ Noto'g'ri tanlov!", show_alert=True)
+        result = await self._resolve_place(query, chat_id, place_type, place_index)
+        if result is None:
             return
-        
-        element, name, distance, lat, lon = places_with_distance[place_index]
+        element, name, distance, lat, lon = result
         
         # Check if user has shared location
         if chat_id not in self.location_data:
@@ -669,8 +813,7 @@ class NearbyHandler:
         # Check if location data has expired
         location = self.location_data[chat_id]
         if "expires_at" in location:
-            expires_at = datetime.fromisoformat(location["expires_at"])
-            if datetime.now() > expires_at:
+            if time.time() > expiry_epoch(location):
                 await query.answer("📍 Joylashuv ma'lumotlari eskirgan. Iltimos, qaytadan jo'natish!", show_alert=True)
                 return
         
@@ -686,51 +829,31 @@ class NearbyHandler:
         
         # Get additional details for the directions view
         tags = element.get("tags", {})
-        phone = tags.get("phone", "")
-        website = tags.get("website", "")
-        street = tags.get("addr:street", "")
-        housenumber = tags.get("addr:housenumber", "")
-        city = tags.get("addr:city", "")
-        postcode = tags.get("addr:postcode", "")
-        
-        # Build address
-        address_parts = [part for part in [street, housenumber, city, postcode] if part]
-        address = ", ".join(address_parts) if address_parts else ""
-        
-        # Create detailed directions message
-        directions_text = f"🧭 <b>{name} ga yo'nalish</b>\n"
-        directions_text += "=" * (len(name) + 15) + "\n\n"
-        
-        directions_text += "📍 <b>Manzil:</b>\n"
-        directions_text += f"• <b>Joy nomi:</b> {name}\n"
-        if address:
-            directions_text += f"• <b>Manzil:</b> {address}\n"
-        directions_text += f"• <b>Koordinatalar:</b> {lat:.6f}, {lon:.6f}\n\n"
-        
-        # Add contact information if available
+        address = _place_address(tags)
+        phone = tags.get("phone")
+        website = tags.get("website")
+        
+        # Contact information if available; absent blocks render as empty strings
+        contact_block = ""
         if phone or website:
-            directions_text += "📱 <b>Aloqa ma'lumotlari:</b>\n"
-            if phone:
-                directions_text += f"• 📞 <b>Telefon:</b> {phone}\n"
-            if website:
-                directions_text += f"• 🌐 <b>Vebsayt:</b> {website}\n"
-            directions_text += "\n"
-        
-        directions_text += "🧭 <b>Yo'nalish:</b>\n"
-        directions_text += f"<a href='{directions_url}'>Google Maps orqali yo'nalish olish</a>\n\n"
-        directions_text += "<i>Yo'nalishni ochish uchun havolani bosing</i>\n\n"
-        directions_text += "<i>Yo'nalishni Google Maps ilovasida ochish uchun havolani bosing</i>\n\n"
-        
-        # Add footer with place information
-        directions_text += f"🔷 <b>Joy nomi:</b> {name}\n"
-        directions_text += f"📄 <b>Raqam:</b> {place_index + 1}\n\n"
-        
-        await query.edit_message_text(
-            directions_text,
-            parse_mode=ParseMode.HTML,
-            reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("⬅️ Orqaga", callback_data=back_callback), InlineKeyboardButton("🏠 Bosh menyu", callback_data="nearby_menu")]])
+            contact_block = (
+                "📱 <b>Aloqa ma'lumotlari:</b>\n"
+                + _fmt("• 📞 <b>Telefon:</b> {phone}\n", phone=phone)
+                + _fmt("• 🌐 <b>Vebsayt:</b> {website}\n", website=website)
+                + "\n"
+            )
+        
+        directions_text = _DIRECTIONS_TMPL.format_map({
+            "name": name,
+            "address_line": _fmt("• <b>Manzil:</b> {address}\n", address=address),
+            "lat": lat,
+            "lon": lon,
+            "contact_block": contact_block,
+            "directions_url": directions_url,
+            "number": place_index + 1,
+        })
+        
+        await self._edit(
+            query, directions_text,
+            InlineKeyboardMarkup([[InlineKeyboardButton("⬅️ Orqaga", callback_data=back_callback), InlineKeyboardButton("🏠 Bosh menyu", callback_data="nearby_menu")]])
         )
-    
-    def _calculate_distance(self, lat1, lon1, lat2, lon2):
-        """Calculate the distance between two points - delegates to shared utility"""
-        return calculate_distance(lat1, lon1, lat2, lon2)
\ No newline at end of file
@@ -1,21 +1,120 @@
+import asyncio
 import logging
+import time
+import aiohttp
 from datetime import datetime, timedelta
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, KeyboardButton, ReplyKeyboardMarkup
 from telegram.ext import ContextTypes
 from telegram.constants import ParseMode
 from modules.utils import safe_reply, safe_edit_message
 from modules.retry_utils import http_get_with_retry
-from modules.location_features.utils import calculate_distance, validate_coordinates
+from modules.location_features.utils import location_radians, SEPARATOR, KeyedLocks
+from .store import expiry_epoch, next_location_version, LOCATION_TTL
 
 logger = logging.getLogger(__name__)
 
+# Prayer times message, filled once with str.format_map instead of piecewise concatenation
+PRAYER_TEMPLATE = (
+    "🕌 <b>{city} uchun namoz vaqtlari</b>\n"
+    f"{SEPARATOR}\n\n"
+    "📍 <b>Joylashuv ma'lumotlari:</b>\n"
+    "🏙️ <b>Shahar:</b> {city}\n"
+    "🧭 <b>Koordinatalar:</b> {lat:.6f}, {lon:.6f}\n\n"
+    "📅 <b>Sanada:</b> {date}\n"
+    "🌙 <b>Hijriy sanada:</b> {hijri}\n"
+    "📚 <b>Mazhab:</b> Hanafiy\n\n"
+    "⋆｡ﾟ︎☪︎⋆｡ﾟ︎ <b>Namoz vaqtlari:</b>\n"
+    "🕌<b>Bomdod:</b> {fajr}\n"
+    "🕌<b>Quyosh:</b> {sunrise}\n"
+    "🕌<b>Peshin:</b> {dhuhr}\n"
+    "🕌<b>Asr:</b> {asr}\n"
+    "🕌<b>Shom:</b> {maghrib}\n"
+    "🕌<b>Xufton:</b> {isha}\n"
+    "\n"
+    "<i>Yangilash uchun quyidagi tugmani bosing</i>\n\n"
+    "🔷 <b>Joy nomi:</b> {city}\n"
+    "📄 <b>Sana:</b> {date}\n\n"
+)
+
 class PrayerTimesHandler:
     """Handles prayer times functionality with improved UI/UX"""
     
-    def __init__(self, location_data):
+    PRAYER_CACHE_MAX = 4096  # Cached (area, day) timings before expired ones are pruned
+    POOL_LIMITS = {"aladhan": 16}  # Keep-alive connections per upstream
+    HTTP_TIMEOUT = 8  # Seconds per request attempt
+    FALLBACK_METHODS = (1, 3)  # Karachi (University of Islamic Sciences), Muslim World League
+    
+    def __init__(self, location_data, reverse_lookup, store=None):
         self.location_data = location_data
+        # async (lat, lon) -> location_info: the location handler's cached, paced reverse geocoder
+        self._reverse_lookup = reverse_lookup
+        self.store = store  # Optional LocationStore; today's timings then survive restarts and are shared across processes
         self.ALADHAN_URL = "http://api.aladhan.com/v1"
-        self.NOMINATIM_URL = "https://nominatim.openstreetmap.org"
+        self._prayer_cache: dict[tuple, tuple[float, dict]] = {}  # (lat2, lon2, date, method, school) -> (monotonic deadline, Aladhan response)
+        self._sessions: dict[str, aiohttp.ClientSession] = {}  # pool name -> keep-alive session
+        self._chat_locks = KeyedLocks()  # chat_id -> lock serializing that chat's prayer time requests
+    
+    def _lock(self, chat_id: str):
+        """Hold the lock serializing prayer time requests of one chat (async context manager)"""
+        return self._chat_locks(chat_id)
+    
+    async def _get_session(self, pool: str) -> aiohttp.ClientSession:
+        """Get the keep-alive session of one upstream (see POOL_LIMITS), creating it on first use"""
+        session = self._sessions.get(pool)
+        if session is None or session.closed:
+            session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.POOL_LIMITS[pool], ttl_dns_cache=300, keepalive_timeout=60),
+                timeout=aiohttp.ClientTimeout(total=self.HTTP_TIMEOUT)
+            )
+            self._sessions[pool] = session
+        return session
+    
+    async def close(self):
+        """Close the HTTP sessions (call on shutdown)"""
+        for session in self._sessions.values():
+            if not session.closed:
+                await session.close()
+        self._sessions.clear()
+    
+    @staticmethod
+    def _store_key(key: tuple) -> str:
+        """response_cache key of an (area, day, method, school) timings key"""
+        return "aladhan_" + "_".join(map(str, key))
+    
+    def _cached_timings(self, key: tuple):
+        """Get a cached Aladhan response for today (memory first, then the store) or None"""
+        entry = self._prayer_cache.get(key)
+        if entry is None and self.store is not None:
+            try:
+                row = self.store.get_response(self._store_key(key))
+            except Exception as e:
+                logger.error(f"Prayer times cache read failed: {e}")
+                row = None
+            if row is not None:
+                data, expires_at = row
+                entry = (time.monotonic() + (expires_at - time.time()), data)
+                self._prayer_cache[key] = entry
+        if entry is None:
+            return None
+        if time.monotonic() >= entry[0]:
+            del self._prayer_cache[key]
+            return None
+        return entry[1]
+    
+    def _remember_timings(self, key: tuple, data: dict):
+        """Cache an Aladhan response until local midnight"""
+        now = datetime.now()
+        midnight = datetime.combine(now.date() + timedelta(days=1), datetime.min.time())
+        ttl = (midnight - now).total_seconds()
+        if len(self._prayer_cache) >= self.PRAYER_CACHE_MAX:
+            now_mono = time.monotonic()
+            self._prayer_cache = {k: v for k, v in self._prayer_cache.items() if v[0] > now_mono}
+        self._prayer_cache[key] = (time.monotonic() + ttl, data)
+        if self.store is not None:
+            try:
+                self.store.put_response(self._store_key(key), data, ttl)
+            except Exception as e:
+                logger.error(f"Prayer times cache write failed: {e}")
     
     async def show_prayer_times(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Show prayer times for user's location"""
@@ -24,19 +123,27 @@ class PrayerTimesHandler:
             
         chat_id = str(update.effective_chat.id)
         
+        # Rapid refresh taps wait for the running request and then answer from the timings cache
+        async with self._lock(chat_id):
+            await self._show_prayer_times(update, context, chat_id)
+    
+    async def _show_prayer_times(self, update: Update, context: ContextTypes.DEFAULT_TYPE, chat_id: str):
+        """Show prayer times for one chat (called with that chat's lock held)"""
         # Check if user has shared location
         if chat_id not in self.location_data:
             # Try to get location from message if available
             if update.message and update.message.location:
                 location = update.message.location
                 # Get location details for city name
-                location_info = await self._get_location_info(location.latitude, location.longitude)
+                location_info = await self._reverse_lookup(location.latitude, location.longitude)
                 if location_info:
                     self.location_data[chat_id] = {
                         "latitude": location.latitude,
                         "longitude": location.longitude,
                         "city": location_info.get("city", "Noma'lum shahar"),
-                        "timestamp": datetime.now().isoformat()
+                        "timestamp": time.time(),
+                        "version": next_location_version(self.location_data, chat_id),
+                        **location_radians(location.latitude, location.longitude)
                     }
             else:
                 # Offer user options to provide location
@@ -55,20 +162,21 @@ class PrayerTimesHandler:
         # Check if location data has expired
         location = self.location_data[chat_id]
         if "expires_at" in location:
-            expires_at = datetime.fromisoformat(location["expires_at"])
-            if datetime.now() > expires_at:
+            if time.time() > expiry_epoch(location):
                 # Try to get location from message if available
                 if update.message and update.message.location:
                     location_msg = update.message.location
                     # Get location details for city name
-                    location_info = await self._get_location_info(location_msg.latitude, location_msg.longitude)
+                    location_info = await self._reverse_lookup(location_msg.latitude, location_msg.longitude)
                     if location_info:
                         self.location_data[chat_id] = {
                             "latitude": location_msg.latitude,
                             "longitude": location_msg.longitude,
                             "city": location_info.get("city", "Noma'lum shahar"),
-                            "timestamp": datetime.now().isoformat(),
-                            "expires_at": (datetime.now() + timedelta(hours=24)).isoformat()
+                            "timestamp": time.time(),
+                            "expires_at": time.time() + LOCATION_TTL,
+                            "version": next_location_version(self.location_data, chat_id),
+                            **location_radians(location_msg.latitude, location_msg.longitude)
                         }
                         location = self.location_data[chat_id]
                 else:
@@ -106,42 +214,19 @@ class PrayerTimesHandler:
             # Using Aladhan API for prayer times with Hanafi school (school=1)
             today = datetime.now().strftime("%d-%m-%Y")
             
-            # Initialize best_result
-            best_result = None
-            
-            # Use method with Hanafi school (school=1) which affects Asr time calculation
-            # In Hanafi school, Asr time is when an object's shadow is twice its length plus the original shadow
-            url = f"{self.ALADHAN_URL}/timings/{today}"
-            params = {
-                "latitude": latitude,
-                "longitude": longitude,
-                "method": 2,  # ISNA method as default
-                "school": 1   # Hanafi school (0 = Shafi, 1 = Hanafi)
-            }
+            # Timings are the same for the whole day within ~1 km - reuse today's answer for the area
+            cache_key = (round(latitude, 2), round(longitude, 2), today, 2, 1)
+            best_result = self._cached_timings(cache_key)
             
-            data = await http_get_with_retry(url, params=params, timeout=25)
-            if data and data.get("code") == 200:
-                best_result = data
+            if not best_result:
+                best_result = await self._fetch_timings(today, latitude, longitude, 2)  # ISNA method as default
+                if best_result:
+                    self._remember_timings(cache_key, best_result)
             
-            # If primary method failed, try fallback methods
+            # If primary method failed, answer with a fallback method; it is cached under its own key,
+            # so the next request tries ISNA again instead of getting the fallback for the rest of the day
             if not best_result:
-                methods = [
-                    {"method": 1, "name": "Karachi"},  # University of Islamic Sciences, Karachi
-                    {"method": 3, "name": "MWL"}  # Muslim World League
-                ]
-                
-                for method_info in methods:
-                    fallback_params = {
-                        "latitude": latitude,
-                        "longitude": longitude,
-                        "method": method_info["method"],
-                        "school": 1  # Still use Hanafi school
-                    }
-                    
-                    fallback_data = await http_get_with_retry(url, params=fallback_params, timeout=25)
-                    if fallback_data and fallback_data.get("code") == 200:
-                        best_result = fallback_data
-                        break
+                best_result = await self._fallback_timings(today, latitude, longitude)
             
             if best_result:
                 timings = best_result["data"]["timings"]
@@ -149,39 +234,21 @@ class PrayerTimesHandler:
                 readable_date = date_info["readable"]
                 hijri_date = date_info["hijri"]
                 
-                # Format prayer times
-                prayer_times = {
-                    "Bomdod": timings['Fajr'],
-                    "Quyosh": timings['Sunrise'],
-                    "Peshin": timings['Dhuhr'],
-                    "Asr": timings['Asr'],  # This will now use Hanafi calculation
-                    "Shom": timings['Maghrib'],
-                    "Xufton": timings['Isha']
-                }
-                
                 # Create message with detailed location information
                 city_name = location.get('city', 'Sizning joylashuvingiz')
-                prayer_text = f"🕌 <b>{city_name} uchun namoz vaqtlari</b>\n"
-                prayer_text += "=" * (len(city_name) + 25) + "\n\n"
-                
-                prayer_text += "📍 <b>Joylashuv ma'lumotlari:</b>\n"
-                prayer_text += f"🏙️ <b>Shahar:</b> {city_name}\n"
-                prayer_text += f"🧭 <b>Koordinatalar:</b> {latitude:.6f}, {longitude:.6f}\n\n"
-                
-                prayer_text += f"📅 <b>Sanada:</b> {readable_date}\n"
-                prayer_text += f"🌙 <b>Hijriy sanada:</b> {hijri_date['date']}\n"
-                prayer_text += f"📚 <b>Mazhab:</b> Hanafiy\n\n"
-                
-                prayer_text += "⋆｡ﾟ︎☪︎⋆｡ﾟ︎ <b>Namoz vaqtlari:</b>\n"
-                for prayer, time in prayer_times.items():
-                    prayer_text += f"🕌<b>{prayer}:</b> {time}\n"
-                
-                prayer_text += "\n"
-                prayer_text += "<i>Yangilash uchun quyidagi tugmani bosing</i>\n\n"
-                
-                # Add footer with location information
-                prayer_text += f"🔷 <b>Joy nomi:</b> {city_name}\n"
-                prayer_text += f"📄 <b>Sana:</b> {readable_date}\n\n"
+                prayer_text = PRAYER_TEMPLATE.format_map({
+                    "city": city_name,
+                    "lat": latitude,
+                    "lon": longitude,
+                    "date": readable_date,
+                    "hijri": hijri_date["date"],
+                    "fajr": timings["Fajr"],
+                    "sunrise": timings["Sunrise"],
+                    "dhuhr": timings["Dhuhr"],
+                    "asr": timings["Asr"],  # Hanafi calculation (school=1)
+                    "maghrib": timings["Maghrib"],
+                    "isha": timings["Isha"],
+                })
                 
                 # Add refresh button
                 keyboard = [[InlineKeyboardButton("🔄 Yangilash", callback_data="prayer_refresh")]]
@@ -225,101 +292,48 @@ class PrayerTimesHandler:
             else:
                 await safe_reply(update, error_message)
     
-    async def _get_location_info(self, latitude: float, longitude: float):
-        """Get location information using Nominatim"""
+    async def _fallback_timings(self, today: str, latitude: float, longitude: float):
+        """Get today's timings by the first fallback method that answers (cached per method) or None"""
+        keys = {method: (round(latitude, 2), round(longitude, 2), today, method, 1) for method in self.FALLBACK_METHODS}
+        for key in keys.values():
+            cached = self._cached_timings(key)
+            if cached:
+                return cached
+        
+        # Try the fallback methods in parallel and take the first answer
+        tasks = {
+            asyncio.create_task(self._fetch_timings(today, latitude, longitude, method)): method
+            for method in self.FALLBACK_METHODS
+        }
+        pending = set(tasks)
         try:
-            url = f"{self.NOMINATIM_URL}/reverse"
-            params = {
-                "format": "json",
-                "lat": latitude,
-                "lon": longitude,
-                "accept-language": "uz"
-            }
-            
-            headers = {
-                "User-Agent": "AQLJON-bot/1.0 (https://t.me/AQLJON_bot)"
-            }
-            
-            data = await http_get_with_retry(url, params=params, headers=headers, timeout=15)
-            if data:
-                address = data.get("address", {})
-
-                city = (address.get("city") or
-                       address.get("town") or
-                       address.get("village") or
-                       "Noma'lum shahar")
-
-                country = address.get("country", "Noma'lum mamlakat")
-                state = address.get("state", "")
-                display_name = data.get("display_name", "Noma'lum joylashuv")
-
-                return {
-                    "city": city,
-                    "country": country,
-                    "state": state,
-                    "display_name": display_name,
-                    "latitude": latitude,
-                    "longitude": longitude
-                }
-        except Exception as e:
-            logger.error(f"Nominatimdan joylashuv ma'lumotlarini olishda xatolik: {e}")
-            return {
-                "city": "Noma'lum shahar",
-                "country": "Noma'lum mamlakat",
-                "state": "",
-                "display_name": f"Koordinatalar: {latitude:.4f}, {longitude:.4f}",
-                "latitude": latitude,
-                "longitude": longitude
-            }
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    data = task.result()
+                    if data:
+                        self._remember_timings(keys[tasks[task]], data)
+                        return data
+        finally:
+            for task in pending:
+                task.cancel()
+        return None
     
-    async def _get_location_info_by_name(self, city_name: str):
-        """Get location information by city name using Nominatim"""
+    async def _fetch_timings(self, today: str, latitude: float, longitude: float, method: int):
+        """Aladhan timings for one calculation method (Hanafi Asr), or None on failure"""
+        # In Hanafi school, Asr time is when an object's shadow is twice its length plus the original shadow
+        params = {
+            "latitude": latitude,
+            "longitude": longitude,
+            "method": method,
+            "school": 1   # Hanafi school (0 = Shafi, 1 = Hanafi)
+        }
         try:
-            url = f"{self.NOMINATIM_URL}/search"
-            params = {
-                "format": "json",
-                "q": city_name,
-                "addressdetails": 1,
-                "limit": 5
-            }
-            
-            headers = {
-                "User-Agent": "AQLJON-bot/1.0 (https://t.me/AQLJON_bot)"
-            }
-            
-            data = await http_get_with_retry(url, params=params, headers=headers, timeout=15)
-            if data and len(data) > 0:
-                # Get the most relevant result
-                location = data[0]
-                lat = float(location["lat"])
-                lon = float(location["lon"])
-
-                # Validate coordinates
-                if not validate_coordinates(lat, lon):
-                    logger.error(f"Invalid coordinates from Nominatim: {lat}, {lon}")
-                    return None
-
-                address = location.get("address", {})
-                city = (address.get("city") or
-                       address.get("town") or
-                       address.get("village") or
-                       location.get("display_name", city_name))
-
-                country = address.get("country", "Noma'lum mamlakat")
-                state = address.get("state", "")
-
-                return {
-                    "city": city,
-                    "country": country,
-                    "state": state,
-                    "display_name": location.get("display_name", city_name),
-                    "latitude": lat,
-                    "longitude": lon
-                }
+            data = await http_get_with_retry(
+                f"{self.ALADHAN_URL}/timings/{today}", params=params,
+                timeout=self.HTTP_TIMEOUT, session=await self._get_session("aladhan")
+            )
         except Exception as e:
-            logger.error(f"Nominatimdan shahar ma'lumotlarini olishda xatolik: {e}")
+            logger.warning(f"Aladhan method {method} failed: {e}")
             return None
-    
-    def _calculate_distance(self, lat1, lon1, lat2, lon2):
-        """Calculate the distance between two points - delegates to shared utility"""
-        return calculate_distance(lat1, lon1, lat2, lon2)
\ No newline at end of file
+        return data if data and data.get("code") == 200 else None
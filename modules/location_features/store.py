@@ -0,0 +1,431 @@
+"""
+SQLite persistence for location features
+Keeps user locations, favorites and geocoding results across restarts
+"""
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from datetime import datetime
+
+# orjson is optional - it (de)serializes the large cached API responses several times faster
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+LOCATION_TTL = 24 * 60 * 60  # Default lifetime of a shared location (seconds)
+
+
+def _dumps(value) -> str:
+    """Serialize a cached value to JSON text (orjson when available)"""
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(value).decode()
+    return json.dumps(value)
+
+
+def _loads(text):
+    """Parse JSON text of a cached value (orjson when available)"""
+    if ORJSON_AVAILABLE:
+        return orjson.loads(text)
+    return json.loads(text)
+
+
+def expiry_epoch(location_entry: dict) -> float:
+    """Get the expiry of a location entry as epoch seconds (accepts legacy ISO strings)"""
+    expires_at = location_entry.get("expires_at")
+    # Entries are written (and normalized on load) with float expiries, so this is the common path
+    if isinstance(expires_at, (int, float)):
+        return float(expires_at)
+    if isinstance(expires_at, str):
+        try:
+            return datetime.fromisoformat(expires_at).timestamp()
+        except ValueError:
+            pass
+    return time.time() + LOCATION_TTL
+
+
+def next_location_version(location_data, chat_id: str) -> int:
+    """Version of a new location entry of a chat: one above the entry it replaces"""
+    # Kept on the entry itself, so it is bounded and persisted together with the location
+    previous = location_data.get(chat_id)
+    return (previous.get("version", 0) if previous else 0) + 1
+
+
+class LocationStore:
+    """
+    Thread-safe SQLite store for location data
+
+    Writes are write-behind: put/delete only queue the latest statement per row
+    and flush() applies and commits them (from a worker thread, see
+    LocationFeatureHandler._gc_loop). Reads see queued and in-flight writes first
+    and use their own WAL connection, so they never wait on a commit.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()  # Guards the queued and in-flight write maps only
+        self._write_lock = threading.Lock()  # Serializes flushes and maintenance on the write connection
+        self._pending = {}  # (table, key) -> (sql, params, row as a read would return it; None once deleted)
+        self._inflight = {}  # Batch flush() is committing right now, same layout as _pending
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._write_lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS user_location (
+                    chat_id TEXT PRIMARY KEY,
+                    json TEXT NOT NULL,
+                    expires_at REAL NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS favorites (
+                    chat_id TEXT PRIMARY KEY,
+                    json TEXT NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS geocache (
+                    key TEXT PRIMARY KEY,
+                    json TEXT NOT NULL,
+                    expires_at REAL NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS response_cache (
+                    key TEXT PRIMARY KEY,
+                    json TEXT NOT NULL,
+                    expires_at REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_user_location_expires ON user_location(expires_at);
+                CREATE INDEX IF NOT EXISTS idx_geocache_expires ON geocache(expires_at);
+                CREATE INDEX IF NOT EXISTS idx_response_cache_expires ON response_cache(expires_at);
+                """
+            )
+            self._conn.commit()
+        if path == ":memory:":
+            # An in-memory database exists once per connection - share it, and its lock
+            self._read_conn, self._read_lock = self._conn, self._write_lock
+        else:
+            # WAL lets this connection read while the write connection commits
+            self._read_conn, self._read_lock = sqlite3.connect(path, check_same_thread=False), threading.Lock()
+
+    def _fetch_one(self, slot: tuple, sql: str, params: tuple, now: float = None):
+        """Read one row, preferring a write of the same row that is queued or being committed"""
+        with self._lock:
+            for writes in (self._pending, self._inflight):
+                if slot in writes:
+                    row = writes[slot][2]
+                    # Queued rows carry expires_at last; apply the same cutoff the SELECT would
+                    if row is not None and now is not None and row[-1] < now:
+                        return None
+                    return row
+        with self._read_lock:
+            return self._read_conn.execute(sql, params).fetchone()
+
+    def _write(self, slot: tuple, sql: str, params: tuple, row: tuple = None):
+        """Queue a write for the next flush, replacing any queued write of the same row"""
+        with self._lock:
+            self._pending.pop(slot, None)  # Re-append so flush keeps the order of last writes
+            self._pending[slot] = (sql, params, row)
+
+    # ─── USER LOCATIONS ──────────────────────────────────────────────────────────
+
+    def get_location(self, chat_id: str):
+        """Get a stored, unexpired user location or None"""
+        now = time.time()
+        row = self._fetch_one(
+            ("user_location", chat_id),
+            "SELECT json FROM user_location WHERE chat_id = ? AND expires_at >= ?",
+            (chat_id, now), now
+        )
+        if not row:
+            return None
+        location_entry = json.loads(row[0])
+        if isinstance(location_entry.get("expires_at"), str):
+            # Legacy ISO expiry: rewrite it as epoch seconds once so reads compare floats
+            location_entry["expires_at"] = expiry_epoch(location_entry)
+            self.put_location(chat_id, location_entry)
+        return location_entry
+
+    def put_location(self, chat_id: str, location_entry: dict):
+        """Insert or replace a user location"""
+        text, expires_at = json.dumps(location_entry), expiry_epoch(location_entry)
+        self._write(
+            ("user_location", chat_id),
+            "INSERT OR REPLACE INTO user_location (chat_id, json, expires_at) VALUES (?, ?, ?)",
+            (chat_id, text, expires_at), (text, expires_at)
+        )
+
+    def delete_location(self, chat_id: str):
+        """Remove a user location"""
+        self._write(("user_location", chat_id), "DELETE FROM user_location WHERE chat_id = ?", (chat_id,))
+
+    # ─── FAVORITES ───────────────────────────────────────────────────────────────
+
+    def get_favorites(self, chat_id: str):
+        """Get the stored favorites of a user as a list of dicts, or None"""
+        row = self._fetch_one(("favorites", chat_id), "SELECT json FROM favorites WHERE chat_id = ?", (chat_id,))
+        return json.loads(row[0]) if row else None
+
+    def put_favorites(self, chat_id: str, favorites: list):
+        """Insert or replace the favorites of a user (list of dicts)"""
+        text = json.dumps(favorites)
+        self._write(
+            ("favorites", chat_id),
+            "INSERT OR REPLACE INTO favorites (chat_id, json) VALUES (?, ?)",
+            (chat_id, text), (text,)
+        )
+
+    def delete_favorites(self, chat_id: str):
+        """Remove all favorites of a user"""
+        self._write(("favorites", chat_id), "DELETE FROM favorites WHERE chat_id = ?", (chat_id,))
+
+    # ─── GEOCODING CACHE ─────────────────────────────────────────────────────────
+
+    def get_geocode(self, key: str):
+        """Get an unexpired geocoding result or None"""
+        now = time.time()
+        row = self._fetch_one(
+            ("geocache", key),
+            "SELECT json FROM geocache WHERE key = ? AND expires_at >= ?",
+            (key, now), now
+        )
+        return json.loads(row[0]) if row else None
+
+    def put_geocode(self, key: str, value: dict, ttl: float):
+        """Insert or replace a geocoding result"""
+        text, expires_at = json.dumps(value), time.time() + ttl
+        self._write(
+            ("geocache", key),
+            "INSERT OR REPLACE INTO geocache (key, json, expires_at) VALUES (?, ?, ?)",
+            (key, text, expires_at), (text, expires_at)
+        )
+
+    # ─── API RESPONSE CACHE ──────────────────────────────────────────────────────
+
+    def get_response(self, key: str):
+        """Get an unexpired cached API response as (value, expires_at epoch), or None"""
+        now = time.time()
+        row = self._fetch_one(
+            ("response_cache", key),
+            "SELECT json, expires_at FROM response_cache WHERE key = ? AND expires_at >= ?",
+            (key, now), now
+        )
+        return (_loads(row[0]), row[1]) if row else None
+
+    def put_response(self, key: str, value, ttl: float):
+        """Insert or replace a cached API response"""
+        text, expires_at = _dumps(value), time.time() + ttl
+        self._write(
+            ("response_cache", key),
+            "INSERT OR REPLACE INTO response_cache (key, json, expires_at) VALUES (?, ?, ?)",
+            (key, text, expires_at), (text, expires_at)
+        )
+
+    # ─── MAINTENANCE ─────────────────────────────────────────────────────────────
+
+    def flush(self) -> int:
+        """Apply and commit all queued writes in one transaction, returning how many were written"""
+        with self._write_lock:
+            # Readers keep seeing the batch through _inflight while it is committed without _lock
+            with self._lock:
+                batch, self._pending = self._pending, {}
+                self._inflight = batch
+            if not batch:
+                return 0
+            try:
+                for sql, params, _ in batch.values():
+                    self._conn.execute(sql, params)
+                self._conn.commit()
+            except Exception:
+                self._conn.rollback()
+                with self._lock:
+                    # Retry the batch on the next flush; writes queued meanwhile are newer and win
+                    batch.update(self._pending)
+                    self._pending = batch
+                raise
+            finally:
+                with self._lock:
+                    self._inflight = {}
+        return len(batch)
+
+    def delete_expired(self) -> int:
+        """Delete expired locations, geocoding results and API responses, returning the number of removed rows"""
+        now = time.time()
+        with self._write_lock:
+            removed = self._conn.execute("DELETE FROM user_location WHERE expires_at < ?", (now,)).rowcount
+            removed += self._conn.execute("DELETE FROM geocache WHERE expires_at < ?", (now,)).rowcount
+            removed += self._conn.execute("DELETE FROM response_cache WHERE expires_at < ?", (now,)).rowcount
+            self._conn.commit()
+        return removed
+
+    def close(self):
+        """Flush queued writes and close the database connections"""
+        self.flush()
+        with self._write_lock:
+            if self._read_conn is not self._conn:
+                self._read_conn.close()
+            self._conn.close()
+
+
+class PersistentLRUDict(MutableMapping):
+    """
+    Bounded in-memory LRU in front of a LocationStore table
+
+    Reads hit memory first and fall back to SQLite on a miss; writes update memory
+    and are queued in the store for its next flush.
+    Iteration and len() only cover the in-memory (hot) entries.
+    """
+
+    def __init__(self, loader, saver, deleter, maxsize: int = 1024):
+        self._hot = OrderedDict()
+        self._loader = loader
+        self._saver = saver
+        self._deleter = deleter
+        self.maxsize = maxsize
+
+    def _remember(self, key, value):
+        self._hot[key] = value
+        self._hot.move_to_end(key)
+        while len(self._hot) > self.maxsize:
+            self._hot.popitem(last=False)
+
+    def __getitem__(self, key):
+        try:
+            value = self._hot[key]
+        except KeyError:
+            try:
+                value = self._loader(key)
+            except Exception as e:
+                logger.error(f"Location store read failed for {key}: {e}")
+                value = None
+            if value is None:
+                raise KeyError(key)
+            self._remember(key, value)
+            return value
+        self._hot.move_to_end(key)
+        return value
+
+    def __setitem__(self, key, value):
+        self._remember(key, value)
+        self.persist(key)
+
+    def __delitem__(self, key):
+        self._hot.pop(key, None)
+        try:
+            self._deleter(key)
+        except Exception as e:
+            logger.error(f"Location store delete failed for {key}: {e}")
+
+    def __contains__(self, key):
+        try:
+            self[key]
+        except KeyError:
+            return False
+        return True
+
+    def __iter__(self):
+        return iter(list(self._hot))
+
+    def __len__(self):
+        return len(self._hot)
+
+    def persist(self, key):
+        """Queue the current in-memory value of key for the store (after in-place mutation)"""
+        if key not in self._hot:
+            return
+        try:
+            self._saver(key, self._hot[key])
+        except Exception as e:
+            logger.error(f"Location store write failed for {key}: {e}")
+
+    def hot_items(self):
+        """Snapshot of the in-memory entries without touching their LRU order"""
+        return list(self._hot.items())
+
+    def evict(self, key):
+        """Drop key from memory only, keeping the stored copy"""
+        self._hot.pop(key, None)
+
+
+class TTLCache:
+    """
+    Bounded in-memory LRU whose entries expire ttl seconds after being stored
+
+    Expired entries read as missing; expire() drops them eagerly.
+    With a loader/saver pair (e.g. LocationStore.get_response/put_response)
+    misses fall back to SQLite and writes are queued for the store's next flush,
+    so entries survive restarts.
+    """
+
+    def __init__(self, maxsize: int = 2048, ttl: float = 600, loader=None, saver=None):
+        self._data = OrderedDict()  # key -> (stored_at, value)
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._loader = loader
+        self._saver = saver
+
+    def _load(self, key):
+        """Pull an unexpired entry from the backing store into memory"""
+        try:
+            row = self._loader(key)
+        except Exception as e:
+            logger.error(f"Response cache read failed for {key}: {e}")
+            return None
+        if row is None:
+            return None
+        value, expires_at = row
+        # Keep the stored expiry: age the entry by the part of its TTL already used
+        entry = (time.monotonic() - (self.ttl - (expires_at - time.time())), value)
+        self._data[key] = entry
+        self._trim()
+        return entry
+
+    def _trim(self):
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def get(self, key, default=None):
+        """Get an unexpired value (refreshing its LRU position) or default"""
+        entry = self._data.get(key)
+        if entry is None and self._loader is not None:
+            entry = self._load(key)
+        if entry is None:
+            return default
+        if time.monotonic() - entry[0] >= self.ttl:
+            del self._data[key]
+            return default
+        self._data.move_to_end(key)
+        return entry[1]
+
+    def __setitem__(self, key, value):
+        self._data[key] = (time.monotonic(), value)
+        self._data.move_to_end(key)
+        self._trim()
+        if self._saver is not None:
+            try:
+                self._saver(key, value, self.ttl)
+            except Exception as e:
+                logger.error(f"Response cache write failed for {key}: {e}")
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def __len__(self):
+        return len(self._data)
+
+    def pop(self, key, default=None):
+        """Remove key, returning its value (expired or not) or default"""
+        entry = self._data.pop(key, None)
+        return default if entry is None else entry[1]
+
+    def expire(self) -> int:
+        """Drop all expired entries, returning how many were removed"""
+        cutoff = time.monotonic() - self.ttl
+        expired = [k for k, (stored_at, _) in self._data.items() if stored_at <= cutoff]
+        for key in expired:
+            del self._data[key]
+        return len(expired)
@@ -2,8 +2,41 @@
 Shared utilities for location features
 Centralized functions to avoid code duplication
 """
+import asyncio
+import contextlib
+import functools
 import math
 
+# numpy is optional - without it batch distances are computed point by point
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+# numba is optional (and needs numpy) - it compiles the batch haversine loop for large result sets
+try:
+    import numba
+    NUMBA_AVAILABLE = NUMPY_AVAILABLE
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+# Title divider of the location feature messages (fixed width - len() miscounts emoji and wide glyphs)
+SEPARATOR = "═" * 24
+
+NUMBA_MIN_POINTS = 64  # Below this the numpy kernel is as fast as the compiled one
+
+if NUMBA_AVAILABLE:
+    @numba.njit(fastmath=True, cache=True)
+    def _haversine_nb(lat0_rad, lon0_rad, cos_lat0, lats, lons):
+        """Compiled haversine from one point (radians) to float64 degree arrays, in kilometers"""
+        out = np.empty(lats.shape[0], dtype=np.float64)
+        for i in range(lats.shape[0]):
+            lat_rad = math.radians(lats[i])
+            a = math.sin((lat_rad - lat0_rad) / 2) ** 2 + cos_lat0 * math.cos(lat_rad) * math.sin((math.radians(lons[i]) - lon0_rad) / 2) ** 2
+            out[i] = 2 * 6371 * math.asin(math.sqrt(min(a, 1.0)))
+        return out
+
 def calculate_distance(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
     """
     Calculate the distance between two points using the haversine formula
@@ -29,17 +62,111 @@ def calculate_distance(lat1: float, lon1: float, lat2: float, lon2: float) -> fl
     dlat = lat2_rad - lat1_rad
     dlon = lon2_rad - lon1_rad
 
-    # Haversine formula
+    # Haversine formula (min() guards against rounding overshoot near antipodal points)
     a = math.sin(dlat/2)**2 + math.cos(lat1_rad) * math.cos(lat2_rad) * math.sin(dlon/2)**2
-    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
+    c = 2 * math.asin(math.sqrt(min(1.0, a)))
 
     # Distance in kilometers
     distance = R * c
     return distance
 
+def location_radians(latitude: float, longitude: float) -> dict:
+    """
+    Radian-space fields to cache on a stored location entry
+
+    Args:
+        latitude: Latitude in degrees
+        longitude: Longitude in degrees
+
+    Returns:
+        Dict with lat_rad, lon_rad and cos_lat
+    """
+    lat_rad = math.radians(latitude)
+    return {"lat_rad": lat_rad, "lon_rad": math.radians(longitude), "cos_lat": math.cos(lat_rad)}
+
+def calculate_distance_prepped(lat1_rad: float, cos_lat1: float, lon1_rad: float, lat2: float, lon2: float) -> float:
+    """
+    Haversine distance from a point whose radians and cosine are already known
+
+    Args:
+        lat1_rad: Latitude of first point in radians
+        cos_lat1: Cosine of lat1_rad
+        lon1_rad: Longitude of first point in radians
+        lat2: Latitude of second point in degrees
+        lon2: Longitude of second point in degrees
+
+    Returns:
+        Distance in kilometers
+    """
+    lat2_rad = math.radians(lat2)
+    a = math.sin((lat2_rad - lat1_rad)/2)**2 + cos_lat1 * math.cos(lat2_rad) * math.sin((math.radians(lon2) - lon1_rad)/2)**2
+    return 2 * 6371 * math.asin(math.sqrt(min(1.0, a)))
+
+def distance_from_location(location_entry: dict, lat2: float, lon2: float) -> float:
+    """
+    Distance from a stored location entry to a point, using its cached radians when present
+
+    Args:
+        location_entry: Entry with latitude/longitude (and optionally the location_radians fields)
+        lat2: Latitude of the point
+        lon2: Longitude of the point
+
+    Returns:
+        Distance in kilometers
+    """
+    if "cos_lat" in location_entry:
+        return calculate_distance_prepped(
+            location_entry["lat_rad"], location_entry["cos_lat"], location_entry["lon_rad"], lat2, lon2
+        )
+    return calculate_distance(location_entry["latitude"], location_entry["longitude"], lat2, lon2)
+
+def calculate_distances_batch(lat0: float, lon0: float, lats, lons):
+    """
+    Haversine distances from one point to many points
+
+    Args:
+        lat0: Latitude of the origin
+        lon0: Longitude of the origin
+        lats: Latitudes of the points
+        lons: Longitudes of the points
+
+    Returns:
+        Distances in kilometers - a float64 array with numpy (compiled by numba for
+        large inputs when available), otherwise a list
+    """
+    R = 6371  # Earth radius in kilometers
+
+    if NUMBA_AVAILABLE and len(lats) >= NUMBA_MIN_POINTS:
+        lat0_rad = math.radians(lat0)
+        return _haversine_nb(
+            lat0_rad, math.radians(lon0), math.cos(lat0_rad),
+            np.asarray(lats, dtype=np.float64), np.asarray(lons, dtype=np.float64)
+        )
+
+    if NUMPY_AVAILABLE:
+        lat_a = np.radians(np.asarray(lats, dtype=np.float64))
+        lon_a = np.radians(np.asarray(lons, dtype=np.float64))
+        lat0_rad = math.radians(lat0)
+        a = np.sin((lat_a - lat0_rad) / 2) ** 2 + math.cos(lat0_rad) * np.cos(lat_a) * np.sin((lon_a - math.radians(lon0)) / 2) ** 2
+        return 2 * R * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+    # The origin's trig is computed once; the loop only does per-point work
+    lat0_rad = math.radians(lat0)
+    lon0_rad = math.radians(lon0)
+    cos_lat0 = math.cos(lat0_rad)
+    radians, sin, cos, asin, sqrt = math.radians, math.sin, math.cos, math.asin, math.sqrt
+
+    distances = []
+    for lat, lon in zip(lats, lons):
+        lat_rad = radians(lat)
+        a = sin((lat_rad - lat0_rad) / 2) ** 2 + cos_lat0 * cos(lat_rad) * sin((radians(lon) - lon0_rad) / 2) ** 2
+        distances.append(2 * R * asin(sqrt(min(a, 1.0))))
+    return distances
+
+@functools.lru_cache(maxsize=4096)
 def validate_city_name(city_name: str) -> tuple[bool, str]:
     """
-    Validate city name input
+    Validate city name input (memoized - names repeat heavily within a chat)
 
     Args:
         city_name: City name to validate
@@ -76,12 +203,36 @@ def validate_coordinates(latitude: float, longitude: float) -> bool:
         lat = float(latitude)
         lon = float(longitude)
 
-        # Check ranges
-        if lat < -90 or lat > 90:
-            return False
-        if lon < -180 or lon > 180:
-            return False
-
-        return True
+        # Check ranges (a chained compare is cheaper than any cache lookup here)
+        return -90 <= lat <= 90 and -180 <= lon <= 180
     except (ValueError, TypeError):
         return False
+
+
+class KeyedLocks:
+    """
+    Per-key asyncio locks (e.g. one per chat) that are dropped again once unused
+
+    `async with locks(key):` serializes the holders of one key; the lock is removed
+    when its last holder or waiter leaves, so the table only holds keys in use.
+    """
+
+    def __init__(self):
+        self._locks = {}  # key -> [asyncio.Lock, holders + waiters]
+
+    @contextlib.asynccontextmanager
+    async def __call__(self, key):
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._locks[key]
+
+    def __len__(self):
+        return len(self._locks)
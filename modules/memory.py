@@ -1,10 +1,95 @@
 import time
 import json
 import os
+from collections import OrderedDict, deque
+from itertools import islice
 from datetime import datetime, timedelta
 import firebase_admin
 from firebase_admin import credentials, firestore
 
+# ─── 📊 Activity Counters ─────────────────────────────────────────────────
+ACTIVITY_TYPES = ("messages", "photos", "voice_audio", "documents", "videos", "search_queries",
+                  "pdf_generated", "excel_generated", "word_generated", "ppt_generated")
+# Counters summed by get_user_activity_period
+PERIOD_ACTIVITY_TYPES = ACTIVITY_TYPES[:6]
+
+
+class _Counters:
+    """Fixed counters in __slots__ with dict-style access; unknown keys go to a small overflow dict"""
+    __slots__ = ("extra",)
+    _FIELDS: tuple = ()
+    _FIELD_SET: frozenset = frozenset()
+
+    def __init__(self):
+        for field in self._FIELDS:
+            setattr(self, field, 0)
+        self.extra = None
+
+    def __getitem__(self, key):
+        if key in self._FIELD_SET:
+            return getattr(self, key)
+        if self.extra is None:
+            raise KeyError(key)
+        return self.extra[key]
+
+    def __setitem__(self, key, value):
+        if key in self._FIELD_SET:
+            setattr(self, key, value)
+        else:
+            if self.extra is None:
+                self.extra = {}
+            self.extra[key] = value
+
+    def __contains__(self, key):
+        return key in self._FIELD_SET or (self.extra is not None and key in self.extra)
+
+    def get(self, key, default=None):
+        """Dict-style get"""
+        if key in self._FIELD_SET:
+            return getattr(self, key)
+        return self.extra.get(key, default) if self.extra else default
+
+    def increment(self, key, amount=1):
+        """Add amount to a counter, creating unknown ones at zero"""
+        if key in self._FIELD_SET:
+            setattr(self, key, getattr(self, key) + amount)
+        else:
+            self[key] = self.get(key, 0) + amount
+
+    def to_dict(self) -> dict:
+        """Plain dict copy (for Firestore)"""
+        data = {field: getattr(self, field) for field in self._FIELDS}
+        if self.extra:
+            data.update(self.extra)
+        return data
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        """Build from a plain dict; missing counters start at zero"""
+        counters = cls()
+        for key, value in data.items():
+            counters[key] = value
+        return counters
+
+
+class UserStats(_Counters):
+    """All-time statistics of one user"""
+    __slots__ = ACTIVITY_TYPES + ("total_characters", "first_interaction", "last_active")
+    _FIELDS = __slots__
+    _FIELD_SET = frozenset(__slots__)
+
+    def __init__(self):
+        super().__init__()
+        self.first_interaction = self.last_active = time.time()
+
+
+class DailyActivity(_Counters):
+    """Activity counters of one user for one day"""
+    __slots__ = ACTIVITY_TYPES
+    _FIELDS = __slots__
+    _FIELD_SET = frozenset(__slots__)
+
+
 # ─── 🧠 Enhanced Memory Management ─────────────────────────────────────────────────
 class MemoryManager:
     """Manages user memory, history, and statistics"""
@@ -20,7 +105,7 @@ class MemoryManager:
         self._init_firebase()
 
         # Initialize data structures
-        self.user_history = {}
+        self.user_history = OrderedDict()  # LRU order: least recently active chat first
         self.user_content_memory = {}
         self.user_contact_messages = {}
         self.user_daily_activity = {}
@@ -37,6 +122,10 @@ class MemoryManager:
         self.BATCH_SAVE_INTERVAL = 300  # 5 minutes
         self.BATCH_SAVE_THRESHOLD = 50  # Save when 50 users pending
 
+        # Cached "%Y-%m-%d" of today, recomputed only after local midnight
+        self._today_str = ""
+        self._today_expires = 0.0
+
         # Load persistent data from Firestore
         self._load_from_firestore()
 
@@ -93,7 +182,7 @@ class MemoryManager:
 
                 # Load user stats
                 if 'stats' in data:
-                    self.user_stats[chat_id] = data['stats']
+                    self.user_stats[chat_id] = UserStats.from_dict(data['stats'])
 
                 # Load user info
                 if 'info' in data:
@@ -126,7 +215,7 @@ class MemoryManager:
             data = {}
 
             if chat_id in self.user_stats:
-                data['stats'] = self.user_stats[chat_id]
+                data['stats'] = self.user_stats[chat_id].to_dict()
 
             if chat_id in self.user_info:
                 data['info'] = self.user_info[chat_id]
@@ -164,7 +253,7 @@ class MemoryManager:
                     data = {}
 
                     if chat_id in self.user_stats:
-                        data['stats'] = self.user_stats[chat_id]
+                        data['stats'] = self.user_stats[chat_id].to_dict()
 
                     if chat_id in self.user_info:
                         data['info'] = self.user_info[chat_id]
@@ -224,7 +313,7 @@ class MemoryManager:
                 data = {'last_updated': firestore.SERVER_TIMESTAMP}
 
                 if chat_id in self.user_stats:
-                    data['stats'] = self.user_stats[chat_id]
+                    data['stats'] = self.user_stats[chat_id].to_dict()
 
                 if chat_id in self.user_info:
                     data['info'] = self.user_info[chat_id]
@@ -267,44 +356,20 @@ class MemoryManager:
                 self.check_memory_limits()
 
             # Initialize user stats ONLY if they don't exist (NEVER reset existing stats)
-            if chat_id not in self.user_stats:
-                self.user_stats[chat_id] = {
-                    "messages": 0,
-                    "photos": 0,
-                    "voice_audio": 0,
-                    "documents": 0,
-                    "videos": 0,
-                    "search_queries": 0,
-                    "pdf_generated": 0,
-                    "excel_generated": 0,
-                    "word_generated": 0,
-                    "ppt_generated": 0,
-                    "first_interaction": time.time(),  # Set ONCE and NEVER change
-                    "last_active": time.time(),
-                    "total_characters": 0
-                }
+            stats = self.user_stats.get(chat_id)
+            if stats is None:
+                stats = self.user_stats[chat_id] = UserStats()
             else:
                 # CRITICAL: Preserve ALL existing stats - only update last_active time
-                # NEVER reset first_interaction or any counters
-                self.user_stats[chat_id]["last_active"] = time.time()
+                # (first_interaction and the counters always exist on UserStats)
+                stats.last_active = time.time()
 
-                # Ensure first_interaction exists and is never reset
-                if "first_interaction" not in self.user_stats[chat_id]:
-                    self.user_stats[chat_id]["first_interaction"] = time.time()
+            # Increment activity counter (unknown activity types are added on first use)
+            stats.increment(activity_type)
 
-                # Ensure all stat counters exist with defaults if missing
-                for key in ["messages", "photos", "voice_audio", "documents", "videos",
-                           "search_queries", "pdf_generated", "excel_generated",
-                           "word_generated", "ppt_generated", "total_characters"]:
-                    if key not in self.user_stats[chat_id]:
-                        self.user_stats[chat_id][key] = 0
-
-            # Increment activity counter - safely handle missing keys
-            if activity_type in self.user_stats[chat_id]:
-                self.user_stats[chat_id][activity_type] += 1
-            else:
-                # If the activity type doesn't exist in stats, add it
-                self.user_stats[chat_id][activity_type] = 1
+            # Keep the history LRU in activity order so check_memory_limits evicts from the front
+            if chat_id in self.user_history:
+                self.user_history.move_to_end(chat_id)
 
             # Ensure user is also in user_info if update is provided
             if update and update.effective_user:
@@ -320,29 +385,16 @@ class MemoryManager:
                 }
 
             # Track daily activity for analytics
-            today = datetime.now().strftime("%Y-%m-%d")
+            today = self._today()
             if chat_id not in self.user_daily_activity:
                 self.user_daily_activity[chat_id] = {}
 
-            if today not in self.user_daily_activity[chat_id]:
-                self.user_daily_activity[chat_id][today] = {
-                    "messages": 0,
-                    "photos": 0,
-                    "voice_audio": 0,
-                    "documents": 0,
-                    "videos": 0,
-                    "search_queries": 0,
-                    "pdf_generated": 0,
-                    "excel_generated": 0,
-                    "word_generated": 0,
-                    "ppt_generated": 0
-                }
+            day_activity = self.user_daily_activity[chat_id].get(today)
+            if day_activity is None:
+                day_activity = self.user_daily_activity[chat_id][today] = DailyActivity()
 
             # Safely increment daily activity
-            if activity_type in self.user_daily_activity[chat_id][today]:
-                self.user_daily_activity[chat_id][today][activity_type] += 1
-            else:
-                self.user_daily_activity[chat_id][today][activity_type] = 1
+            day_activity.increment(activity_type)
 
             # Optimized batch write - mark user for pending save
             self._pending_writes.add(chat_id)
@@ -356,6 +408,16 @@ class MemoryManager:
             # Log error but don't crash - statistics are not critical
             print(f"Error tracking user activity for {chat_id}: {e}")
     
+    def _today(self) -> str:
+        """Today's date as "%Y-%m-%d", formatted once per day"""
+        now = time.time()
+        if now >= self._today_expires:
+            current = datetime.now()
+            self._today_str = current.strftime("%Y-%m-%d")
+            midnight = current.replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
+            self._today_expires = midnight.timestamp()
+        return self._today_str
+    
     def track_document_generation(self, chat_id: str, doc_type: str, update=None):
         """Track document generation statistics"""
         try:
@@ -378,49 +440,27 @@ class MemoryManager:
     
     def get_user_activity_period(self, chat_id: str, days: int) -> dict:
         """Get user activity for the last N days"""
+        activity = dict.fromkeys(PERIOD_ACTIVITY_TYPES, 0)
         try:
-            if not chat_id or not isinstance(chat_id, str):
-                return {
-                    "messages": 0,
-                    "photos": 0,
-                    "voice_audio": 0,
-                    "documents": 0,
-                    "videos": 0,
-                    "search_queries": 0
-                }
-            
-            activity = {
-                "messages": 0,
-                "photos": 0,
-                "voice_audio": 0,
-                "documents": 0,
-                "videos": 0,
-                "search_queries": 0
-            }
+            if not chat_id or not isinstance(chat_id, str) or days <= 0:
+                return activity
             
-            if chat_id not in self.user_daily_activity:
+            daily = self.user_daily_activity.get(chat_id)
+            if not daily:
                 return activity
             
-            # Calculate date range
-            today = datetime.now()
-            for i in range(days):
-                check_date = (today - timedelta(days=i)).strftime("%Y-%m-%d")
-                if check_date in self.user_daily_activity[chat_id]:
-                    day_activity = self.user_daily_activity[chat_id][check_date]
-                    for key in activity.keys():
+            # "%Y-%m-%d" strings sort like dates: one cutoff string replaces a strftime per day,
+            # and only the (at most 30) stored days are visited
+            cutoff = (datetime.now() - timedelta(days=days - 1)).strftime("%Y-%m-%d")
+            for date, day_activity in daily.items():
+                if date >= cutoff:
+                    for key in PERIOD_ACTIVITY_TYPES:
                         activity[key] += day_activity.get(key, 0)
             
             return activity
         except Exception as e:
             print(f"Error getting user activity period for {chat_id}: {e}")
-            return {
-                "messages": 0,
-                "photos": 0,
-                "voice_audio": 0,
-                "documents": 0,
-                "videos": 0,
-                "search_queries": 0
-            }
+            return dict.fromkeys(PERIOD_ACTIVITY_TYPES, 0)
     
     def cleanup_old_daily_activity(self, max_days: int = 30):
         """Clean up daily activity data older than max_days to prevent memory bloat"""
@@ -462,9 +502,6 @@ class MemoryManager:
             if not chat_id or not isinstance(chat_id, str):
                 return
             
-            if chat_id not in self.user_content_memory:
-                self.user_content_memory[chat_id] = []
-            
             # Store both summary and full content for better context
             memory_item = {
                 "type": content_type,
@@ -475,11 +512,11 @@ class MemoryManager:
                 "stored_at": time.time()  # Add timestamp for better tracking
             }
             
-            self.user_content_memory[chat_id].append(memory_item)
-            
-            # Keep more content memories (increase from 30 to 50 for better context)
-            if len(self.user_content_memory[chat_id]) > 50:
-                self.user_content_memory[chat_id] = self.user_content_memory[chat_id][-50:]
+            # Keep the last 50 content memories - the bounded deque drops the oldest on append
+            memories = self.user_content_memory.get(chat_id)
+            if memories is None:
+                memories = self.user_content_memory[chat_id] = deque(maxlen=50)
+            memories.append(memory_item)
         except Exception as e:
             print(f"Error storing content memory for {chat_id}: {e}")
     
@@ -494,7 +531,8 @@ class MemoryManager:
             
             context_parts = []
             # Only send last 5 items, truncated, to minimize token usage
-            recent_content = self.user_content_memory[chat_id][-5:]
+            memories = self.user_content_memory[chat_id]
+            recent_content = islice(memories, max(0, len(memories) - 5), None)
             
             for item in recent_content:
                 item_type = item.get("type", "")
@@ -533,7 +571,7 @@ class MemoryManager:
                 return [item for item in self.user_content_memory[chat_id] if item.get("type") == content_type]
             else:
                 # Return all content
-                return self.user_content_memory[chat_id]
+                return list(self.user_content_memory[chat_id])
         except Exception as e:
             print(f"Error getting specific content for {chat_id}: {e}")
             return []
@@ -550,26 +588,25 @@ class MemoryManager:
             # Find inactive users (excluding blocked users)
             # Create a copy of items to avoid RuntimeError during iteration
             inactive_users = []
+            blocked = self.blocked_users
+            user_stats = self.user_stats
             for chat_id in list(self.user_history.keys()):  # Only check users with history
                 # Skip blocked users - they should never be cleaned up
-                if chat_id in self.blocked_users:
+                if chat_id in blocked:
                     continue
 
                 # Get last_active from user_stats if exists
                 last_active = 0
-                if chat_id in self.user_stats:
-                    last_active = self.user_stats[chat_id].get("last_active", 0)
-                    # Convert "now" to actual timestamp for comparison
-                    if last_active == "now":
+                stats = user_stats.get(chat_id)
+                if stats is not None:
+                    last_active = stats.get("last_active", 0)
+                    # Convert "now" (or any other invalid string) to the current time to avoid accidental deletion
+                    if isinstance(last_active, str):
                         last_active = current_time
-                        self.user_stats[chat_id]["last_active"] = current_time
-                    # If last_active is a string (invalid), treat as current time to avoid accidental deletion
-                    elif isinstance(last_active, str):
-                        last_active = current_time
-                        self.user_stats[chat_id]["last_active"] = current_time
+                        stats["last_active"] = current_time
 
                 # Only mark as inactive if they haven't been active for MAX_INACTIVE_DAYS
-                if last_active > 0 and last_active < inactive_threshold:
+                if 0 < last_active < inactive_threshold:
                     inactive_users.append(chat_id)
 
             # Remove inactive users' history and content memory ONLY - NEVER TOUCH stats and info
@@ -620,42 +657,30 @@ class MemoryManager:
                 # If still over limit, remove oldest users' HISTORY and CONTENT only (excluding blocked users)
                 # After cleanup, check if we still have too many users with active history
                 if len(self.user_history) > self.MAX_USERS_IN_MEMORY:
-                    # Sort by last activity and remove oldest
-                    user_activity = []
-                    # Create a copy to avoid modification during iteration
-                    for chat_id in list(self.user_history.keys()):
+                    # user_history is an LRU (least recently active first): pop from the front
+                    # until under the limit, with extra removed for buffer - O(removed), no sort
+                    target = self.MAX_USERS_IN_MEMORY - 100
+                    blocked = self.blocked_users
+                    kept_blocked = []
+                    removed = 0
+                    while self.user_history and len(self.user_history) + len(kept_blocked) > target:
+                        chat_id, history = self.user_history.popitem(last=False)
                         # Skip blocked users - never remove their data
-                        if chat_id in self.blocked_users:
+                        if chat_id in blocked:
+                            kept_blocked.append((chat_id, history))
                             continue
 
-                        # Get last active time from stats (with fallback)
-                        last_active = 0
-                        if chat_id in self.user_stats:
-                            last_active = self.user_stats[chat_id].get("last_active", 0)
-                            # Convert string timestamps to current time to avoid accidental deletion
-                            if isinstance(last_active, str):
-                                last_active = time.time()
-                                self.user_stats[chat_id]["last_active"] = last_active
-
-                        user_activity.append((chat_id, last_active))
-
-                    user_activity.sort(key=lambda x: x[1])  # Sort by last_active (oldest first)
-
-                    # Remove oldest users until under limit
-                    to_remove = max(0, len(self.user_history) - self.MAX_USERS_IN_MEMORY + 100)  # Remove extra for buffer
-                    removed = 0
-                    for i in range(min(to_remove, len(user_activity))):
-                        chat_id = user_activity[i][0]
-
                         # ONLY delete history and content_memory, NEVER TOUCH user_stats and user_info
-                        if chat_id in self.user_history:
-                            del self.user_history[chat_id]
-                            removed += 1
-                        if chat_id in self.user_content_memory:
-                            del self.user_content_memory[chat_id]
+                        removed += 1
+                        self.user_content_memory.pop(chat_id, None)
 
                         # NEVER DELETE user_stats or user_info - these MUST persist forever for admin panel
 
+                    # Put skipped blocked users back at the front in their original order
+                    for chat_id, history in reversed(kept_blocked):
+                        self.user_history[chat_id] = history
+                        self.user_history.move_to_end(chat_id, last=False)
+
                     print(f"Removed history for {removed} oldest users (stats/info preserved forever)")
         except Exception as e:
             print(f"Error in check_memory_limits: {e}")
@@ -671,6 +696,7 @@ class MemoryManager:
                 return
             
             history = self.user_history.setdefault(chat_id, [])
+            self.user_history.move_to_end(chat_id)
             history.append({"role": role, "content": content})
             # Keep history within limits
             self.user_history[chat_id] = history[-self.MAX_HISTORY * 2:]
@@ -701,6 +727,9 @@ class MemoryManager:
     def block_user(self, chat_id: str):
         """Mark user as blocked - blocked users' stats and info are PERMANENTLY preserved"""
         try:
+            # Telegram ids may arrive as ints; every key in this class is the str form
+            if isinstance(chat_id, int):
+                chat_id = str(chat_id)
             if not chat_id or not isinstance(chat_id, str):
                 return
 
@@ -711,21 +740,7 @@ class MemoryManager:
                 self.user_stats[chat_id]["last_active"] = time.time()
             else:
                 # If user doesn't have stats yet, create them to ensure they're tracked
-                self.user_stats[chat_id] = {
-                    "messages": 0,
-                    "photos": 0,
-                    "voice_audio": 0,
-                    "documents": 0,
-                    "videos": 0,
-                    "search_queries": 0,
-                    "pdf_generated": 0,
-                    "excel_generated": 0,
-                    "word_generated": 0,
-                    "ppt_generated": 0,
-                    "first_interaction": time.time(),
-                    "last_active": time.time(),
-                    "total_characters": 0
-                }
+                self.user_stats[chat_id] = UserStats()
 
             # Blocked users MUST be in admin stats - their stats are NEVER deleted
             # Save to Firestore immediately
@@ -736,6 +751,9 @@ class MemoryManager:
     def unblock_user(self, chat_id: str):
         """Unmark user as blocked and restore their activity timestamp - stats always preserved"""
         try:
+            # Telegram ids may arrive as ints; every key in this class is the str form
+            if isinstance(chat_id, int):
+                chat_id = str(chat_id)
             if not chat_id or not isinstance(chat_id, str):
                 return
 
@@ -747,21 +765,7 @@ class MemoryManager:
                 self.user_stats[chat_id]["last_active"] = time.time()
             else:
                 # If user doesn't have stats, create them
-                self.user_stats[chat_id] = {
-                    "messages": 0,
-                    "photos": 0,
-                    "voice_audio": 0,
-                    "documents": 0,
-                    "videos": 0,
-                    "search_queries": 0,
-                    "pdf_generated": 0,
-                    "excel_generated": 0,
-                    "word_generated": 0,
-                    "ppt_generated": 0,
-                    "first_interaction": time.time(),
-                    "last_active": time.time(),
-                    "total_characters": 0
-                }
+                self.user_stats[chat_id] = UserStats()
 
             # Stats are ALWAYS preserved regardless of block status
             # Save to Firestore immediately
@@ -772,6 +776,9 @@ class MemoryManager:
     def is_blocked(self, chat_id: str) -> bool:
         """Check if user is blocked"""
         try:
+            # Telegram ids may arrive as ints; every key in this class is the str form
+            if isinstance(chat_id, int):
+                chat_id = str(chat_id)
             if not chat_id or not isinstance(chat_id, str):
                 return False
             return chat_id in self.blocked_users
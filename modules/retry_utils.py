@@ -3,6 +3,7 @@ Retry utilities with exponential backoff for API calls
 Based on 2025 best practices using tenacity library
 """
 import asyncio
+import json
 import logging
 import aiohttp
 from tenacity import (
@@ -14,8 +15,18 @@ from tenacity import (
 )
 from modules.gemini_client import get_file, get_file_state, upload_file
 
+# orjson is optional - it parses the Aladhan/Nominatim/Overpass JSON bodies several times faster
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
 logger = logging.getLogger(__name__)
 
+# Parser for HTTP JSON bodies (aiohttp's response.json(loads=...) accepts any str -> object callable)
+_json_loads = orjson.loads if ORJSON_AVAILABLE else json.loads
+
 # Define retry decorator for Gemini API calls
 retry_on_api_error = retry(
     wait=wait_exponential(multiplier=1, min=1, max=10),
@@ -136,42 +147,109 @@ http_retry_decorator = retry(
     reraise=True
 )
 
+# Shared keep-alive session for callers that opt in (see get_session)
+_SESSION: aiohttp.ClientSession | None = None
+
+async def get_session() -> aiohttp.ClientSession:
+    """
+    Get the shared HTTP session, creating it on first use
+
+    Connections (and TLS sessions) are kept alive and reused across requests.
+    """
+    global _SESSION
+    if _SESSION is None or _SESSION.closed:
+        _SESSION = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=32, limit_per_host=8, ttl_dns_cache=300, keepalive_timeout=60)
+        )
+    return _SESSION
+
+async def close_session():
+    """Close the shared HTTP session (call on shutdown)"""
+    global _SESSION
+    if _SESSION is not None and not _SESSION.closed:
+        await _SESSION.close()
+    _SESSION = None
+
+# Transient statuses (rate limiting, server errors) that are retried like network errors
+RETRYABLE_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+class RetryableHTTPStatus(aiohttp.ClientError):
+    """Raised for a transient HTTP status so the retry decorator backs off and tries again"""
+
+    def __init__(self, status: int, url: str):
+        super().__init__(f"HTTP {status}: {url}")
+        self.status = status
+
+async def _get_json(session: aiohttp.ClientSession, url: str, params: dict, headers: dict, timeout: int):
+    async with session.get(
+        url,
+        params=params,
+        headers=headers,
+        timeout=aiohttp.ClientTimeout(total=timeout)
+    ) as response:
+        if response.status == 200:
+            return await response.json(loads=_json_loads)
+        elif response.status in RETRYABLE_STATUSES:
+            raise RetryableHTTPStatus(response.status, url)
+        else:
+            logger.warning(f"HTTP GET failed with status {response.status}: {url}")
+            return None
+
 @http_retry_decorator
-async def http_get_with_retry(url: str, params: dict = None, headers: dict = None, timeout: int = 30):
+async def _http_get_attempts(url: str, params: dict, headers: dict, timeout: int, session: aiohttp.ClientSession):
+    try:
+        if session is not None:
+            return await _get_json(session, url, params, headers, timeout)
+        async with aiohttp.ClientSession() as own_session:
+            return await _get_json(own_session, url, params, headers, timeout)
+    except asyncio.TimeoutError:
+        logger.error(f"HTTP GET timeout after {timeout} seconds: {url}")
+        raise
+    except Exception as e:
+        logger.error(f"HTTP GET error: {e}")
+        raise
+
+async def http_get_with_retry(url: str, params: dict = None, headers: dict = None, timeout: int = 30,
+                              session: aiohttp.ClientSession = None):
     """
     HTTP GET request with automatic retry on failure
 
+    Network errors, timeouts and 429/5xx responses are retried with exponential backoff.
+
     Args:
         url: URL to fetch
         params: Query parameters
         headers: HTTP headers
         timeout: Timeout in seconds
+        session: Optional shared session to reuse; a throwaway one is used otherwise
 
     Returns:
         Response data as JSON dict or None on error
     """
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(
-                url,
-                params=params,
-                headers=headers,
-                timeout=aiohttp.ClientTimeout(total=timeout)
-            ) as response:
-                if response.status == 200:
-                    return await response.json()
-                else:
-                    logger.warning(f"HTTP GET failed with status {response.status}: {url}")
-                    return None
-    except asyncio.TimeoutError:
-        logger.error(f"HTTP GET timeout after {timeout} seconds: {url}")
-        raise
-    except Exception as e:
-        logger.error(f"HTTP GET error: {e}")
-        raise
+        return await _http_get_attempts(url, params, headers, timeout, session)
+    except RetryableHTTPStatus as e:
+        logger.warning(f"HTTP GET still failing with status {e.status} after retries: {url}")
+        return None
+
+async def _post_json(session: aiohttp.ClientSession, url: str, data: dict, params: dict, headers: dict, timeout: int,
+                     text: bool = False):
+    async with session.post(
+        url,
+        data=data,
+        params=params,
+        headers=headers,
+        timeout=aiohttp.ClientTimeout(total=timeout)
+    ) as response:
+        if response.status == 200:
+            return await response.text() if text else await response.json(loads=_json_loads)
+        else:
+            logger.warning(f"HTTP POST failed with status {response.status}: {url}")
+            return None
 
 @http_retry_decorator
-async def http_post_with_retry(url: str, data: dict = None, params: dict = None, headers: dict = None, timeout: int = 30):
+async def http_post_with_retry(url: str, data: dict = None, params: dict = None, headers: dict = None, timeout: int = 30,
+                               session: aiohttp.ClientSession = None, text: bool = False):
     """
     HTTP POST request with automatic retry on failure
 
@@ -181,24 +259,17 @@ async def http_post_with_retry(url: str, data: dict = None, params: dict = None,
         params: Query parameters
         headers: HTTP headers
         timeout: Timeout in seconds
+        session: Optional shared session to reuse; a throwaway one is used otherwise
+        text: Return the raw response body instead of parsing it as JSON
 
     Returns:
-        Response data as JSON dict or None on error
+        Response data as JSON dict (or str with text=True) or None on error
     """
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                url,
-                data=data,
-                params=params,
-                headers=headers,
-                timeout=aiohttp.ClientTimeout(total=timeout)
-            ) as response:
-                if response.status == 200:
-                    return await response.json()
-                else:
-                    logger.warning(f"HTTP POST failed with status {response.status}: {url}")
-                    return None
+        if session is not None:
+            return await _post_json(session, url, data, params, headers, timeout, text)
+        async with aiohttp.ClientSession() as own_session:
+            return await _post_json(own_session, url, data, params, headers, timeout, text)
     except asyncio.TimeoutError:
         logger.error(f"HTTP POST timeout after {timeout} seconds: {url}")
         raise